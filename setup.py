@@ -40,6 +40,7 @@ setup(
         'grond.problems.rectangular',
         'grond.optimisers',
         'grond.optimisers.highscore',
+        'grond.optimisers.evolution',
         'grond.analysers',
         'grond.analysers.noise_analyser',
         'grond.analysers.target_balancing',
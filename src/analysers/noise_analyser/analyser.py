@@ -17,16 +17,19 @@ guts_prefix = 'grond'
 def get_phase_arrival_time(engine, source, target, wavename):
     """
     Get arrival time from Green's Function store for respective
-    :class:`pyrocko.gf.seismosizer.Target`,
+    :class:`grond.targets.WaveformMisfitTarget`,
     :class:`pyrocko.gf.meta.Location` pair.
 
+    Arrival times are evaluated jointly for all targets sharing the target's
+    :class:`grond.targets.PhaseTimingService`.
+
     Parameters
     ----------
     engine : :class:`pyrocko.gf.seismosizer.LocalEngine`
     source : :class:`pyrocko.gf.meta.Location`
         can be therefore :class:`pyrocko.gf.seismosizer.Source` or
         :class:`pyrocko.model.Event`
-    target : :class:`pyrocko.gf.seismosizer.Target`
+    target : :class:`grond.targets.WaveformMisfitTarget`
     wavename : string
         of the tabulated phase_def that determines the phase arrival
 
@@ -34,10 +37,8 @@ def get_phase_arrival_time(engine, source, target, wavename):
     -------
     scalar, float of the arrival time of the wave
     """
-    store = engine.get_store(target.store_id)
-    dist = target.distance_to(source)
-    depth = source.depth
-    return store.t(wavename, (depth, dist)) + source.time
+    return target.get_timing_service().t(
+        engine, wavename, source, target) + source.time
 
 
 def seismic_noise_variance(traces, engine, event, targets,
@@ -29,6 +29,8 @@ class TargetBalancingAnalyser(Analyser):
      described as adaptive station weighting in Heimann (2011).
      """
 
+    nbatch = 100
+
     def __init__(self, niter):
         Analyser.__init__(self)
         self.niter = niter
@@ -69,11 +71,8 @@ class TargetBalancingAnalyser(Analyser):
         mss = num.zeros((self.niter, wproblem.ntargets))
         rstate = num.random.RandomState(123)
 
-        isbad_mask = None
-
-        self._tlog_last = 0
+        xs = num.zeros((self.niter, npar))
         for iiter in range(self.niter):
-            self.log_progress(problem, iiter, self.niter)
             while True:
                 x = []
                 for ipar in range(npar):
@@ -81,20 +80,28 @@ class TargetBalancingAnalyser(Analyser):
                     x.append(v)
 
                 try:
-                    x = wproblem.preconstrain(x)
+                    xs[iiter, :] = wproblem.preconstrain(x)
                     break
 
                 except Forbidden:
                     pass
 
-            if isbad_mask is not None and num.any(isbad_mask):
+        # the first model tells which targets are unavailable, the others
+        # are modelled in batches without them
+        isok_mask = None
+        self._tlog_last = 0
+        iiter = 0
+        while iiter < self.niter:
+            self.log_progress(problem, iiter, self.niter)
+            nbatch = 1 if iiter == 0 else min(self.nbatch, self.niter - iiter)
+            mss[iiter:iiter+nbatch, :] = wproblem.misfits_many(
+                xs[iiter:iiter+nbatch], mask=isok_mask)[:, :, 1]
+
+            isbad_mask = num.isnan(mss[iiter, :])
+            if num.any(isbad_mask):
                 isok_mask = num.logical_not(isbad_mask)
-            else:
-                isok_mask = None
-            ms = wproblem.misfits(x, mask=isok_mask)[:, 1]
-            mss[iiter, :] = ms
 
-            isbad_mask = num.isnan(ms)
+            iiter += nbatch
 
         mean_ms = num.mean(mss, axis=0)
         weights = 1. / mean_ms
@@ -574,6 +574,10 @@ def command_go(args):
         parser.add_option(
             '--preserve', dest='preserve', action='store_true',
             help='preserve old rundir')
+        parser.add_option(
+            '--resume', dest='resume', action='store_true',
+            help='continue an interrupted optimisation in an existing '
+                 'rundir')
         parser.add_option(
             '--status', dest='status', default='state',
             type='choice', choices=['state', 'quiet'],
@@ -582,10 +586,15 @@ def command_go(args):
         parser.add_option(
             '--parallel', dest='nparallel', type=int, default=1,
             help='set number of events to process in parallel, '
-                 'If set to more than one, --status=quiet is implied.')
+                 'If set to more than one, --status=quiet is implied and '
+                 'each event is optimised in a single process, regardless '
+                 'of the optimiser\'s nprocs setting.')
 
     parser, options, args = cl_parse('go', args, setup)
 
+    if options.resume and (options.force or options.preserve):
+        die('--resume cannot be combined with --force or --preserve')
+
     try:
         env = Environment(args)
 
@@ -597,6 +606,7 @@ def command_go(args):
             env,
             force=options.force,
             preserve=options.preserve,
+            resume=options.resume,
             status=status,
             nparallel=options.nparallel)
         if len(env.get_selected_event_names()) == 1:
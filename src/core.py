@@ -16,7 +16,7 @@ from pyrocko import parimap, model, marker as pmarker
 
 from .dataset import NotFound
 from .problems.base import Problem, load_problem_info_and_data, \
-    load_problem_data, load_optimiser_info
+    load_problem_data, load_optimiser_info, load_problem_info
 
 from .optimisers.base import BadProblem
 from .targets.waveform.target import WaveformMisfitResult
@@ -433,6 +433,8 @@ def check(
                 event.name or util.time_to_str(event.time),
                 str(e)))
 
+        ds.log_cache_stats()
+
         if show_waveforms:
             trace.snuffle(trs_all, stations=ds.get_stations(), markers=markers)
 
@@ -443,10 +445,10 @@ g_state = {}
 
 
 def go(environment,
-       force=False, preserve=False,
+       force=False, preserve=False, resume=False,
        nparallel=1, status='state'):
 
-    g_data = (environment, force, preserve,
+    g_data = (environment, force, preserve, resume,
               status, nparallel)
     g_state[id(g_data)] = g_data
 
@@ -462,7 +464,7 @@ def go(environment,
 
 def process_event(ievent, g_data_id):
 
-    environment, force, preserve, status, nparallel = \
+    environment, force, preserve, resume, status, nparallel = \
         g_state[g_data_id]
 
     config = environment.get_config()
@@ -485,7 +487,17 @@ def process_event(ievent, g_data_id):
         dict(problem_name=problem.name))
     environment.set_rundir_path(rundir)
 
-    if op.exists(rundir):
+    if resume and not op.exists(op.join(rundir, 'optimiser.yaml')):
+        if op.exists(rundir):
+            raise GrondError(
+                'cannot resume problem %s: rundir contains no optimiser '
+                'setup: %s' % (problem.name, rundir))
+        else:
+            raise GrondError(
+                'cannot resume problem %s: rundir does not exist: %s'
+                % (problem.name, rundir))
+
+    if op.exists(rundir) and not resume:
         if preserve:
             nold_rundirs = len(glob.glob(rundir + '*'))
             shutil.move(rundir, rundir+'-old-%d' % (nold_rundirs))
@@ -503,20 +515,33 @@ def process_event(ievent, g_data_id):
 
     logger.info('rundir: %s' % rundir)
 
-    logger.info('analysing problem %s' % problem.name)
+    if resume:
+        # continue with the problem setup stored in the rundir, including
+        # analyser results; bootstrap weights and residuals are not stored,
+        # they are regenerated from the optimiser's bootstrap_seed when
+        # first needed
+        problem = load_problem_info(rundir)
+        config.setup_modelling_environment(problem)
+        for target in problem.targets:
+            target.set_dataset(ds)
 
-    for analyser_conf in config.analyser_configs:
-        analyser = analyser_conf.get_analyser()
-        analyser.analyse(problem, ds)
+        optimiser = load_optimiser_info(rundir)
 
-    basepath = config.get_basepath()
-    config.change_basepath(rundir)
-    guts.dump(config, filename=op.join(rundir, 'config.yaml'))
-    config.change_basepath(basepath)
+    else:
+        logger.info('analysing problem %s' % problem.name)
+
+        for analyser_conf in config.analyser_configs:
+            analyser = analyser_conf.get_analyser()
+            analyser.analyse(problem, ds)
 
-    optimiser = config.optimiser_config.get_optimiser()
-    optimiser.init_bootstraps(problem)
-    problem.dump_problem_info(rundir)
+        basepath = config.get_basepath()
+        config.change_basepath(rundir)
+        guts.dump(config, filename=op.join(rundir, 'config.yaml'))
+        config.change_basepath(basepath)
+
+        optimiser = config.optimiser_config.get_optimiser()
+        optimiser.init_bootstraps(problem)
+        problem.dump_problem_info(rundir)
 
     monitor = None
     if status == 'state':
@@ -528,7 +553,7 @@ def process_event(ievent, g_data_id):
         xs_inject = synt.get_x()[num.newaxis, :]
 
     try:
-        if xs_inject is not None:
+        if xs_inject is not None and not resume:
             from .optimisers import highscore
             if not isinstance(optimiser, highscore.HighScoreOptimiser):
                 raise GrondError(
@@ -539,7 +564,8 @@ def process_event(ievent, g_data_id):
 
         optimiser.optimise(
             problem,
-            rundir=rundir)
+            rundir=rundir,
+            resume=resume)
 
         harvest(rundir, problem, force=True)
 
@@ -553,6 +579,8 @@ def process_event(ievent, g_data_id):
         if monitor:
             monitor.terminate()
 
+    ds.log_cache_stats()
+
     tstop = time.time()
     logger.info(
         'stop %i / %i (%g min)' % (ievent+1, nevents, (tstop - tstart)/60.))
@@ -1,3 +1,4 @@
+import os
 import glob
 import copy
 import os.path as op
@@ -7,13 +8,15 @@ import numpy as num
 
 from collections import defaultdict
 from pyrocko import util, pile, model, config, trace, \
-    marker as pmarker
+    marker as pmarker, orthodrome as od
 from pyrocko.fdsn import enhanced_sacpz, station as fs
-from pyrocko.guts import (Object, Tuple, String, Float, List, Bool, dump_all,
-                          load_all)
+from pyrocko.guts import (Object, Tuple, String, Float, Int, List, Bool,
+                          dump_all, load_all)
 
 from .meta import Path, HasPaths, expand_template
 from .synthetic_tests import SyntheticTest
+from .dataset_cache import DatasetCache, WaveformDiskCache, \
+    MetadataCache, fingerprint_files, get_response_cache
 
 guts_prefix = 'grond'
 logger = logging.getLogger('grond.dataset')
@@ -64,6 +67,49 @@ def dump_station_corrections(station_corrections, filename):
     return dump_all(station_corrections, filename=filename)
 
 
+def _load_stationxml(filename):
+    return fs.load_xml(filename=filename)
+
+
+def _stationxml_to_stations(sx):
+    return sx.get_pyrocko_stations()
+
+
+def _load_sacpz_dirname(dirname):
+    return list(enhanced_sacpz.iload_dirname(dirname))
+
+
+def _load_gnss_campaign(filename):
+    return load_all(filename=filename)[0]
+
+
+def _load_kite_scene(filename):
+    try:
+        from kite import Scene
+    except ImportError:
+        raise ImportError('module kite could not be imported,'
+                          ' please install from https://pyrocko.org')
+
+    scene = Scene()
+    scene._log.setLevel(logger.level)
+    scene.load(filename)
+    return scene
+
+
+def _select_gnss_campaign_files(paths):
+    return util.select_files(
+        paths,
+        regex=r'\.yml|\.yaml',
+        show_progress=False)
+
+
+def _select_kite_scene_files(paths):
+    return util.select_files(
+        paths,
+        regex=r'\.npz',
+        show_progress=False)
+
+
 class Dataset(object):
 
     def __init__(self, event_name=None):
@@ -83,16 +129,73 @@ class Dataset(object):
         self.apply_correction_delays = True
         self.apply_correction_factors = True
         self.extend_incomplete = False
+        self.keep_waveform_data = False
         self.clip_handling = 'by_nsl'
         self.kite_scenes = []
         self.gnss_campaigns = []
         self.synthetic_test = None
         self._picks = None
-        self._cache = {}
+        self._cache = DatasetCache()
+        self._spectrum_cache = DatasetCache(size_max=5e8)
+        self._disk_cache = None
+        self._nslc_index = None
+        self._selection_status = {}
+        self._response_memo = {}
+        self._response_cache = get_response_cache()
+        self._metadata_cache = None
+        self._response_fingerprint = []
         self._event_name = event_name
 
     def empty_cache(self):
-        self._cache = {}
+        self._cache.clear()
+        self._spectrum_cache.clear()
+
+    def set_cache_limits(self, size_max=None, nentries_max=None):
+        '''
+        Set limits of the in-memory cache of processed waveforms.
+
+        :param size_max: maximum total size of cached sample data [bytes]
+        :param nentries_max: maximum number of cached entries
+        '''
+        self._cache.size_max = size_max
+        self._cache.nentries_max = nentries_max
+        self._cache._evict()
+
+    def log_cache_stats(self):
+        logger.info('Waveform cache: %s' % self._cache.get_stats_str())
+        logger.info(
+            'Raw waveform spectrum cache: %s'
+            % self._spectrum_cache.get_stats_str())
+        if self._disk_cache is not None:
+            logger.info(
+                'Persistent waveform cache: %s'
+                % self._disk_cache.get_stats_str())
+
+    def set_disk_cache(self, disk_cache):
+        '''
+        Set persistent cache for restituted waveforms.
+
+        :param disk_cache: :py:class:`grond.dataset_cache.WaveformDiskCache`
+            object or ``None`` to disable persistent caching.
+        '''
+        self._disk_cache = disk_cache
+
+    def set_metadata_cache(self, metadata_cache):
+        '''
+        Set cache for parsed metadata files.
+
+        :param metadata_cache: :py:class:`grond.dataset_cache.MetadataCache`
+            object or ``None``
+        '''
+        self._metadata_cache = metadata_cache
+
+    def _load(self, loader, path, persistent=True, base=None):
+        if self._metadata_cache is not None:
+            return self._metadata_cache.load(loader, path, persistent, base)
+        elif base is not None:
+            return loader(base(path))
+        else:
+            return loader(path)
 
     def set_synthetic_test(self, synthetic_test):
         self.synthetic_test = synthetic_test
@@ -112,7 +215,9 @@ class Dataset(object):
                 'loading stations from file %s' %
                 pyrocko_stations_filename)
 
-            for station in model.load_stations(pyrocko_stations_filename):
+            for station in self._load(
+                    model.load_stations, pyrocko_stations_filename):
+
                 self.stations[station.nsl()] = station
 
         if stationxml_filenames is not None and len(stationxml_filenames) > 0:
@@ -122,8 +227,10 @@ class Dataset(object):
                     'loading stations from StationXML file %s' %
                     stationxml_filename)
 
-                sx = fs.load_xml(filename=stationxml_filename)
-                for station in sx.get_pyrocko_stations():
+                for station in self._load(
+                        _stationxml_to_stations, stationxml_filename,
+                        base=_load_stationxml):
+
                     channels = station.get_channels()
                     if len(channels) == 1 and channels[0].name.endswith('Z'):
                         logger.warning(
@@ -141,26 +248,150 @@ class Dataset(object):
 
         if filename is not None:
             logger.debug('Loading events from file %s' % filename)
-            self.events.extend(model.load_events(filename))
+            self.events.extend(self._load(model.load_events, filename))
 
     def add_waveforms(self, paths, regex=None, fileformat='detect',
-                      show_progress=False):
+                      show_progress=False, tmin=None, tmax=None):
         cachedirname = config.config().cache_dir
         logger.debug('Selecting waveform files %s' % paths)
         fns = util.select_files(paths, regex=regex,
                                 show_progress=show_progress)
         cache = pile.get_cache(cachedirname)
+        if tmin is not None or tmax is not None:
+            fns = self._select_waveform_files(fns, cache, tmin, tmax)
+
         logger.debug('Scanning waveform files %s' % paths)
         self.pile.load_files(sorted(fns), cache=cache,
                              fileformat=fileformat,
                              show_progress=show_progress)
 
+        self._nslc_index = None
+
+    def _select_waveform_files(self, fns, cache, tmin, tmax):
+        '''
+        Drop files which do not overlap with the time span ``(tmin, tmax)``.
+
+        Only files with up-to-date entries in the Pyrocko file metadata cache
+        can be checked; all other files are kept.
+        '''
+
+        tmin = tmin if tmin is not None else -num.inf
+        tmax = tmax if tmax is not None else num.inf
+
+        fns_selected = []
+        for fn in fns:
+            abspath = op.abspath(fn)
+            tfile = cache.get(abspath)
+            try:
+                if tfile is not None and tfile.tmin is not None \
+                        and tfile.mtime == os.stat(abspath)[8] \
+                        and not tfile.overlaps(tmin, tmax):
+                    continue
+
+            except OSError:
+                pass
+
+            fns_selected.append(fn)
+
+        logger.debug(
+            'Using %i of %i waveform files in time span %s - %s' % (
+                len(fns_selected), len(fns),
+                util.time_to_str(tmin) if num.isfinite(tmin) else '-',
+                util.time_to_str(tmax) if num.isfinite(tmax) else '-'))
+
+        return fns_selected
+
+    def _get_nslc_index(self):
+        '''
+        Get mapping of NSLC and NSL codes to waveform files in the pile.
+        '''
+
+        if self._nslc_index is None:
+            index = defaultdict(set)
+            for file in self.pile.iter_files():
+                for tr in file.traces:
+                    index[tr.nslc_id].add(file)
+                    index[tr.nslc_id[:3]].add(file)
+
+            self._nslc_index = dict(
+                (codes, sorted(files, key=lambda f: f.abspath or ''))
+                for (codes, files) in index.items())
+
+        return self._nslc_index
+
+    def _get_pile_traces(self, codes, tmin, tmax):
+        n = len(codes)
+        return [
+            tr
+            for file in self._get_nslc_index().get(codes, [])
+            if file.is_relevant(tmin, tmax)
+            for tr in file.traces
+            if tr.nslc_id[:n] == codes and tr.is_relevant(tmin, tmax)]
+
+    def _pile_all(
+            self, codes, tmin, tmax, tpad=0.,
+            want_incomplete=True, load_data=True):
+
+        '''
+        Get waveforms from the pile, selected by NSL or NSLC codes.
+
+        Equivalent to ``self.pile.all(...)`` with a ``trace_selector``
+        matching the codes but only visits the files which contain traces with
+        the given codes.
+        '''
+
+        ctmin = tmin - tpad
+        ctmax = tmax + tpad
+        traces = self._get_pile_traces(codes, ctmin, ctmax)
+
+        files = []
+        keep_data = self.keep_waveform_data
+        if load_data:
+            files_changed = False
+            for tr in traces:
+                if tr.file is not None and tr.file not in files:
+                    if tr.file.load_data():
+                        files_changed = True
+
+                    files.append(tr.file)
+
+            if not keep_data:
+                for file in files:
+                    file.use_data()
+
+            if files_changed:
+                self._nslc_index = None
+                traces = self._get_pile_traces(codes, ctmin, ctmax)
+
+        try:
+            chopped = []
+            for tr in traces:
+                if not load_data and tr.ydata is not None:
+                    tr = tr.copy(data=False)
+                    tr.ydata = None
+
+                try:
+                    chopped.append(tr.chop(ctmin, ctmax, inplace=False))
+                except trace.NoData:
+                    pass
+
+        finally:
+            if not keep_data:
+                for file in files:
+                    file.drop_data()
+
+        return self.pile._process_chopped(
+            chopped, True, 5, None, want_incomplete, tmax, tmin, tpad)
+
     def add_responses(self, sacpz_dirname=None, stationxml_filenames=None):
         if sacpz_dirname:
             logger.debug('Loading SAC PZ responses from %s' % sacpz_dirname)
-            for x in enhanced_sacpz.iload_dirname(sacpz_dirname):
+            for x in self._load(_load_sacpz_dirname, sacpz_dirname):
                 self.responses[x.codes].append(x)
 
+            self._response_fingerprint.extend(
+                fingerprint_files([sacpz_dirname]))
+
         if stationxml_filenames:
             for stationxml_filename in stationxml_filenames:
                 logger.debug(
@@ -168,10 +399,13 @@ class Dataset(object):
                     stationxml_filename)
 
                 self.responses_stationxml.append(
-                    fs.load_xml(filename=stationxml_filename))
+                    self._load(_load_stationxml, stationxml_filename))
+
+            self._response_fingerprint.extend(
+                fingerprint_files(stationxml_filenames))
 
     def add_clippings(self, markers_filename):
-        markers = pmarker.load_markers(markers_filename)
+        markers = self._load(pmarker.load_markers, markers_filename)
         clippings = {}
         for marker in markers:
             nslc = marker.one_nslc()
@@ -187,10 +421,10 @@ class Dataset(object):
 
         for k, times in clippings.items():
             atimes = num.array(times, dtype=num.float)
-            if k not in self.clippings:
-                self.clippings[k] = atimes
-            else:
-                self.clippings[k] = num.concatenate(self.clippings, atimes)
+            if k in self.clippings:
+                atimes = num.concatenate((self.clippings[k], atimes))
+
+            self.clippings[k] = num.sort(atimes)
 
     def add_blacklist(self, blacklist=[], filenames=None):
         logger.debug('Loading blacklisted stations')
@@ -209,6 +443,8 @@ class Dataset(object):
                 x = tuple(x.split('.'))
             self.blacklist.add(x)
 
+        self._selection_status = {}
+
     def add_whitelist(self, whitelist=[], filenames=None):
         logger.debug('Loading whitelisted stations')
         if filenames:
@@ -231,23 +467,20 @@ class Dataset(object):
             else:
                 self.whitelist.add(x)
 
+        self._selection_status = {}
+
     def add_station_corrections(self, filename):
         self.station_corrections.update(
             (sc.codes, sc) for sc in load_station_corrections(filename))
 
     def add_picks(self, filename):
         self.pick_markers.extend(
-            pmarker.load_markers(filename))
+            self._load(pmarker.load_markers, filename))
 
         self._picks = None
 
     def add_gnss_campaigns(self, paths):
-        paths = util.select_files(
-            paths,
-            regex=r'\.yml|\.yaml',
-            show_progress=False)
-
-        for path in paths:
+        for path in _select_gnss_campaign_files(paths):
             self.add_gnss_campaign(filename=path)
 
     def add_gnss_campaign(self, filename):
@@ -258,17 +491,12 @@ class Dataset(object):
                               ' please upgrade pyrocko!')
         logger.debug('loading GNSS campaign from %s' % filename)
 
-        campaign = load_all(filename=filename)
-        self.gnss_campaigns.append(campaign[0])
+        self.gnss_campaigns.append(
+            self._load(_load_gnss_campaign, filename))
 
     def add_kite_scenes(self, paths):
         logger.info('loading kite InSAR scenes...')
-        paths = util.select_files(
-            paths,
-            regex=r'\.npz',
-            show_progress=False)
-
-        for path in paths:
+        for path in _select_kite_scene_files(paths):
             self.add_kite_scene(filename=path)
 
         if not self.kite_scenes:
@@ -276,16 +504,8 @@ class Dataset(object):
                            self.kite_scene_paths)
 
     def add_kite_scene(self, filename):
-        try:
-            from kite import Scene
-        except ImportError:
-            raise ImportError('module kite could not be imported,'
-                              ' please install from https://pyrocko.org')
         logger.debug('loading kite scene from %s' % filename)
-
-        scene = Scene()
-        scene._log.setLevel(logger.level)
-        scene.load(filename)
+        scene = self._load(_load_kite_scene, filename, persistent=False)
 
         try:
             self.get_kite_scene(scene.meta.scene_id)
@@ -330,12 +550,33 @@ class Dataset(object):
         except InvalidObject:
             return nsl in self.whitelist_nsl_xx
 
+    def get_selection_status(self, nslc):
+        '''
+        Get reason why a channel is excluded by black- or whitelisting.
+
+        :returns: ``'blacklisted'``, ``'not on whitelist'`` or ``None`` if
+            the channel is selected. Results are memoised.
+        '''
+
+        if nslc not in self._selection_status:
+            if self.is_blacklisted(nslc):
+                status = 'blacklisted'
+            elif not self.is_whitelisted(nslc):
+                status = 'not on whitelist'
+            else:
+                status = None
+
+            self._selection_status[nslc] = status
+
+        return self._selection_status[nslc]
+
     def has_clipping(self, nsl_or_nslc, tmin, tmax):
         if nsl_or_nslc not in self.clippings:
             return False
 
         atimes = self.clippings[nsl_or_nslc]
-        return num.any(num.logical_and(tmin < atimes, atimes <= tmax))
+        i = num.searchsorted(atimes, tmin, side='right')
+        return bool(i < atimes.size and atimes[i] <= tmax)
 
     def get_nsl(self, obj):
         if isinstance(obj, trace.Trace):
@@ -414,6 +655,48 @@ class Dataset(object):
                 return camp
         raise NotFound('GNSS campaign %s not found!' % name)
 
+    def _get_response_memo(self, source, quantity, make):
+        '''
+        Get response object, created once per source of response information.
+
+        Returning the same object for repeated requests allows the evaluated
+        responses to be reused, see
+        :py:class:`grond.dataset_cache.ResponseCache`.
+        '''
+
+        key = (id(source), quantity)
+        if key not in self._response_memo:
+            self._response_memo[key] = source, make()
+
+        return self._response_memo[key][1]
+
+    def _make_sacpz_response(self, x, quantity):
+        if quantity == 'displacement':
+            return x.response
+        elif quantity == 'velocity':
+            return trace.MultiplyResponse([
+                x.response,
+                trace.DifferentiationResponse()])
+        elif quantity == 'acceleration':
+            return trace.MultiplyResponse([
+                x.response,
+                trace.DifferentiationResponse(2)])
+        else:
+            assert False
+
+    def _make_stationxml_response(self, channel, quantity, nslc):
+        quantity_to_unit = {
+            'displacement': 'M',
+            'velocity': 'M/S',
+            'acceleration': 'M/S**2'}
+
+        resp = channel.response
+        resp.check_sample_rates(channel)
+        resp.check_units()
+        return resp.get_pyrocko_response(
+            '.'.join(nslc),
+            fake_input_units=quantity_to_unit[quantity]).expect_one()
+
     def get_response(self, obj, quantity='displacement'):
         if (self.responses is None or len(self.responses) == 0) \
                 and (self.responses_stationxml is None
@@ -421,11 +704,6 @@ class Dataset(object):
 
             raise NotFound('no response information available')
 
-        quantity_to_unit = {
-            'displacement': 'M',
-            'velocity': 'M/S',
-            'acceleration': 'M/S**2'}
-
         if self.is_blacklisted(obj):
             raise NotFound('response is blacklisted', self.get_nslc(obj))
 
@@ -448,29 +726,23 @@ class Dataset(object):
             if k in self.responses:
                 for x in self.responses[k]:
                     if x.tmin < tmin and (x.tmax is None or tmax < x.tmax):
-                        if quantity == 'displacement':
-                            candidates.append(x.response)
-                        elif quantity == 'velocity':
-                            candidates.append(trace.MultiplyResponse([
-                                x.response,
-                                trace.DifferentiationResponse()]))
-                        elif quantity == 'acceleration':
-                            candidates.append(trace.MultiplyResponse([
-                                x.response,
-                                trace.DifferentiationResponse(2)]))
-                        else:
-                            assert False
+                        candidates.append(self._get_response_memo(
+                            x, quantity,
+                            lambda: self._make_sacpz_response(x, quantity)))
 
         for sx in self.responses_stationxml:
-            try:
-                candidates.append(
-                    sx.get_pyrocko_response(
-                        (net, sta, loc, cha),
-                        timespan=(tmin, tmax),
-                        fake_input_units=quantity_to_unit[quantity]))
+            resps = []
+            for _, _, channel in sx.iter_network_station_channels(
+                    net, sta, loc, cha, timespan=(tmin, tmax)):
 
-            except (fs.NoResponseInformation, fs.MultipleResponseInformation):
-                pass
+                if channel.response:
+                    resps.append(self._get_response_memo(
+                        channel, quantity,
+                        lambda: self._make_stationxml_response(
+                            channel, quantity, (net, sta, loc, cha))))
+
+            if len(resps) == 1:
+                candidates.append(resps[0])
 
         if len(candidates) == 1:
             return candidates[0]
@@ -491,13 +763,9 @@ class Dataset(object):
 
         net, sta, loc, cha = self.get_nslc(obj)
 
-        if self.is_blacklisted((net, sta, loc, cha)):
-            raise NotFound(
-                'waveform is blacklisted', (net, sta, loc, cha))
-
-        if not self.is_whitelisted((net, sta, loc, cha)):
-            raise NotFound(
-                'waveform is not on whitelist', (net, sta, loc, cha))
+        status = self.get_selection_status((net, sta, loc, cha))
+        if status:
+            raise NotFound('waveform is %s' % status, (net, sta, loc, cha))
 
         if self.clip_handling == 'by_nsl':
             if self.has_clipping((net, sta, loc), tmin, tmax):
@@ -509,11 +777,11 @@ class Dataset(object):
                 raise NotFound(
                     'waveform clipped', (net, sta, loc, cha))
 
-        trs = self.pile.all(
+        trs = self._pile_all(
+            (net, sta, loc, cha),
             tmin=tmin+toffset_noise_extract,
             tmax=tmax+toffset_noise_extract,
             tpad=tpad,
-            trace_selector=lambda tr: tr.nslc_id == (net, sta, loc, cha),
             want_incomplete=want_incomplete or extend_incomplete)
 
         if toffset_noise_extract != 0.0:
@@ -550,25 +818,69 @@ class Dataset(object):
             want_incomplete=False,
             extend_incomplete=False):
 
-        trs_raw = self.get_waveform_raw(
-            obj, tmin=tmin, tmax=tmax, tpad=tpad+tfade,
-            toffset_noise_extract=toffset_noise_extract,
-            want_incomplete=want_incomplete,
-            extend_incomplete=extend_incomplete)
+        trs_raw, spectra = self._get_waveform_spectra(
+            obj, tmin, tmax, tpad, tfade, deltat, toffset_noise_extract,
+            want_incomplete, extend_incomplete)
 
         trs_restituted = []
+        for tr, spectrum in zip(trs_raw, spectra):
+            resp = self.get_response(tr, quantity=quantity)
+            trs_restituted.append(
+                self._response_cache.transfer(
+                    tr, tfade=tfade, freqlimits=freqlimits,
+                    transfer_function=resp, invert=True,
+                    spectrum=spectrum))
+
+        # the cached raw traces must not be modified by callers
+        return trs_restituted, [tr.copy() for tr in trs_raw]
+
+    def _get_waveform_spectra(
+            self, obj, tmin, tmax, tpad, tfade, deltat,
+            toffset_noise_extract, want_incomplete, extend_incomplete):
+
+        '''
+        Get resampled raw traces and their spectra for restitution.
+
+        This part of the processing does not depend on the frequency band or
+        on the output quantity. It is cached, so that target groups using the
+        same station and time window in different bands share the data
+        loading, resampling and forward FFT. Only response deconvolution,
+        band-pass taper and inverse FFT are done for each band.
+        '''
+
+        key = (self.get_nslc(obj), tmin, tmax, tpad, tfade, deltat,
+               toffset_noise_extract, want_incomplete, extend_incomplete)
+
+        entry = self._spectrum_cache.get(key)
+        if isinstance(entry, Exception):
+            raise entry
+
+        elif entry is not None:
+            return entry
+
+        try:
+            trs_raw = self.get_waveform_raw(
+                obj, tmin=tmin, tmax=tmax, tpad=tpad+tfade,
+                toffset_noise_extract=toffset_noise_extract,
+                want_incomplete=want_incomplete,
+                extend_incomplete=extend_incomplete)
+
+        except NotFound as e:
+            self._spectrum_cache[key] = e
+            raise
+
+        spectra = []
         for tr in trs_raw:
             if deltat is not None:
                 tr.downsample_to(deltat, snap=True, allow_upsample_max=5)
                 tr.deltat = deltat
 
-            resp = self.get_response(tr, quantity=quantity)
-            trs_restituted.append(
-                tr.transfer(
-                    tfade=tfade, freqlimits=freqlimits,
-                    transfer_function=resp, invert=True))
+            spectra.append(
+                self._response_cache.get_spectrum(tr, tfade=tfade))
 
-        return trs_restituted, trs_raw
+        entry = tuple(trs_raw), tuple(spectra)
+        self._spectrum_cache[key] = entry
+        return entry
 
     def _get_projections(
             self, station, backazimuth, source, target, tmin, tmax):
@@ -578,11 +890,8 @@ class Dataset(object):
         if not station.get_channels():
             station = copy.deepcopy(station)
 
-            nsl = station.nsl()
-            trs = self.pile.all(
-                tmin=tmin, tmax=tmax,
-                trace_selector=lambda tr: tr.nslc_id[:3] == nsl,
-                load_data=False)
+            trs = self._pile_all(
+                station.nsl(), tmin=tmin, tmax=tmax, load_data=False)
 
             channels = list(set(tr.channel for tr in trs))
             station.set_channels_by_name(*channels)
@@ -606,6 +915,125 @@ class Dataset(object):
 
         return projections
 
+    def _get_waveforms_projected(
+            self, station, channel, projections, quantity, tmin, tmax, tpad,
+            toffset_noise_extract, tfade, freqlimits, deltat, debug):
+
+        trs_projected = []
+        trs_restituted = []
+        trs_raw = []
+        exceptions = []
+        for matrix, in_channels, out_channels in projections:
+            deps = trace.project_dependencies(
+                matrix, in_channels, out_channels)
+
+            try:
+                trs_restituted_group = []
+                trs_raw_group = []
+                if channel in deps:
+                    for cha in deps[channel]:
+                        trs_restituted_this, trs_raw_this = \
+                            self.get_waveform_restituted(
+                                station.nsl() + (cha,),
+                                quantity=quantity,
+                                tmin=tmin, tmax=tmax,
+                                tpad=tpad,
+                                toffset_noise_extract=toffset_noise_extract,
+                                tfade=tfade,
+                                freqlimits=freqlimits,
+                                deltat=deltat,
+                                want_incomplete=debug,
+                                extend_incomplete=self.extend_incomplete)
+
+                        trs_restituted_group.extend(trs_restituted_this)
+                        trs_raw_group.extend(trs_raw_this)
+
+                    trs_projected.extend(
+                        trace.project(
+                            trs_restituted_group, matrix,
+                            in_channels, out_channels))
+
+                    trs_restituted.extend(trs_restituted_group)
+                    trs_raw.extend(trs_raw_group)
+
+            except NotFound as e:
+                exceptions.append((in_channels, out_channels, e))
+
+        if not trs_projected:
+            err = []
+            for (in_channels, out_channels, e) in exceptions:
+                sin = ', '.join(c.name for c in in_channels)
+                sout = ', '.join(c.name for c in out_channels)
+                err.append('(%s) -> (%s): %s' % (sin, sout, e))
+
+            raise NotFound('\n'.join(err))
+
+        for tr in trs_projected:
+            sc = self.station_corrections.get(tr.nslc_id, None)
+            if sc:
+                if self.apply_correction_factors:
+                    tr.ydata /= sc.factor
+
+                if self.apply_correction_delays:
+                    tr.shift(-sc.delay)
+
+            if tmin is not None and tmax is not None:
+                tr.chop(tmin, tmax)
+
+        return trs_projected, trs_restituted, trs_raw
+
+    def _get_disk_cache_key(
+            self, station, channel, projections, quantity, tmin, tmax, tpad,
+            tfade, freqlimits, deltat):
+
+        '''
+        Get key and validation token for the persistent waveform cache.
+
+        The key covers the processing parameters, the projections, the
+        response files, station corrections and all black-/whitelisting and
+        clipping information which may affect the result. The validation
+        token lists the raw data files contributing to the time window.
+        '''
+
+        nsl = station.nsl()
+        channels = set([channel])
+        projections_fp = []
+        for matrix, in_channels, out_channels in projections:
+            projections_fp.append((
+                matrix.tolist(),
+                [(c.name, c.azimuth, c.dip) for c in in_channels],
+                [(c.name, c.azimuth, c.dip) for c in out_channels]))
+
+            channels.update(c.name for c in in_channels)
+            channels.update(c.name for c in out_channels)
+
+        selection_fp = []
+        for cha in sorted(channels):
+            nslc = nsl + (cha,)
+            sc = self.station_corrections.get(nslc, None)
+            selection_fp.append((
+                cha, self.get_selection_status(nslc),
+                (sc.delay, sc.factor) if sc else None))
+
+        clippings_fp = sorted(
+            (k, v.tolist()) for (k, v) in self.clippings.items()
+            if k[:3] == nsl)
+
+        key = self._disk_cache.make_key(
+            nsl, channel, quantity, tmin, tmax, tpad, tfade,
+            tuple(freqlimits), deltat, projections_fp, selection_fp,
+            clippings_fp, self.clip_handling, self.extend_incomplete,
+            self.apply_correction_factors, self.apply_correction_delays,
+            self._response_fingerprint)
+
+        tpad_total = tpad + tfade
+        validation = sorted(set(
+            (tr.file.abspath, tr.file.mtime) for tr in self._get_pile_traces(
+                nsl, tmin - tpad_total, tmax + tpad_total)
+            if tr.file is not None))
+
+        return key, validation
+
     def _get_waveform(
             self,
             obj, quantity='displacement',
@@ -626,13 +1054,9 @@ class Dataset(object):
 
         nslc = station.nsl() + (channel,)
 
-        if self.is_blacklisted(nslc):
-            raise NotFound(
-                'waveform is blacklisted', nslc)
-
-        if not self.is_whitelisted(nslc):
-            raise NotFound(
-                'waveform is not on whitelist', nslc)
+        status = self.get_selection_status(nslc)
+        if status:
+            raise NotFound('waveform is %s' % status, nslc)
 
         assert tmin is not None
         assert tmax is not None
@@ -644,11 +1068,11 @@ class Dataset(object):
 
         cache_k = nslc + (
             tmin, tmax, tuple(freqlimits), tfade, deltat, tpad, quantity)
-        if cache is not None and (nslc + cache_k) in cache:
-            obj = cache[nslc + cache_k]
+        if cache is not None:
+            obj = cache.get(nslc + cache_k)
             if isinstance(obj, Exception):
                 raise obj
-            else:
+            elif obj is not None:
                 return obj
 
         syn_test = self.synthetic_test
@@ -690,67 +1114,29 @@ class Dataset(object):
         projections = self._get_projections(
             station, backazimuth, source, target, tmin, tmax)
 
-        try:
-            trs_projected = []
-            trs_restituted = []
-            trs_raw = []
-            exceptions = []
-            for matrix, in_channels, out_channels in projections:
-                deps = trace.project_dependencies(
-                    matrix, in_channels, out_channels)
+        disk_cache = self._disk_cache if not (syn_test or debug) else None
+        trs_projected = None
+        if disk_cache is not None:
+            disk_key, validation = self._get_disk_cache_key(
+                station, channel, projections, quantity, tmin, tmax,
+                tpad + abs_delay_max, tfade, freqlimits, deltat)
 
-                try:
-                    trs_restituted_group = []
-                    trs_raw_group = []
-                    if channel in deps:
-                        for cha in deps[channel]:
-                            trs_restituted_this, trs_raw_this = \
-                                self.get_waveform_restituted(
-                                    station.nsl() + (cha,),
-                                    quantity=quantity,
-                                    tmin=tmin, tmax=tmax,
-                                    tpad=tpad+abs_delay_max,
-                                    toffset_noise_extract=toffset_noise_extract,  # noqa
-                                    tfade=tfade,
-                                    freqlimits=freqlimits,
-                                    deltat=deltat,
-                                    want_incomplete=debug,
-                                    extend_incomplete=self.extend_incomplete)
-
-                            trs_restituted_group.extend(trs_restituted_this)
-                            trs_raw_group.extend(trs_raw_this)
-
-                        trs_projected.extend(
-                            trace.project(
-                                trs_restituted_group, matrix,
-                                in_channels, out_channels))
-
-                        trs_restituted.extend(trs_restituted_group)
-                        trs_raw.extend(trs_raw_group)
-
-                except NotFound as e:
-                    exceptions.append((in_channels, out_channels, e))
-
-            if not trs_projected:
-                err = []
-                for (in_channels, out_channels, e) in exceptions:
-                    sin = ', '.join(c.name for c in in_channels)
-                    sout = ', '.join(c.name for c in out_channels)
-                    err.append('(%s) -> (%s): %s' % (sin, sout, e))
-
-                raise NotFound('\n'.join(err))
+            trs_projected = disk_cache.get(disk_key, validation)
 
-            for tr in trs_projected:
-                sc = self.station_corrections.get(tr.nslc_id, None)
-                if sc:
-                    if self.apply_correction_factors:
-                        tr.ydata /= sc.factor
+        try:
+            if trs_projected is None:
+                trs_projected, trs_restituted, trs_raw = \
+                    self._get_waveforms_projected(
+                        station, channel, projections, quantity,
+                        tmin, tmax, tpad + abs_delay_max,
+                        toffset_noise_extract, tfade, freqlimits, deltat,
+                        debug)
 
-                    if self.apply_correction_delays:
-                        tr.shift(-sc.delay)
+                if disk_cache is not None:
+                    disk_cache.put(disk_key, validation, trs_projected)
 
-                if tmin is not None and tmax is not None:
-                    tr.chop(tmin, tmax)
+            else:
+                trs_restituted, trs_raw = [], []
 
             if syn_test:
                 trs_projected_synthetic = []
@@ -968,6 +1354,51 @@ class DatasetConfig(HasPaths):
         Path.T(),
         optional=True)
 
+    waveform_event_window = Bool.T(
+        default=False,
+        help='Only use waveform files overlapping with a time window around '
+             'the event. The window starts ``waveform_event_window_tpad`` '
+             'before the origin time (further extended by the noise offset of '
+             'synthetic tests) and ends ``waveform_event_window_tpad`` after '
+             'the latest arrival at the most distant station, estimated with '
+             'the velocity ``waveform_event_window_vmin``. Waveform data is '
+             'kept in memory after first access.')
+    waveform_event_window_vmin = Float.T(
+        default=1500.,
+        help='Lowest apparent velocity [m/s] used to estimate the maximum '
+             'travel time with ``waveform_event_window``.')
+    waveform_event_window_tpad = Float.T(
+        default=3600.,
+        help='Time padding [s] of ``waveform_event_window``. Must cover '
+             'noise windows, tapers and filter transients.')
+
+    metadata_cache = Bool.T(
+        default=True,
+        help='Keep parsed station, response, event, pick and GNSS files in '
+             'a binary cache in the Pyrocko cache directory.')
+
+    metadata_nthreads = Int.T(
+        default=4,
+        help='Number of threads used to load metadata files.')
+
+    waveform_cache_size_max = Float.T(
+        optional=True,
+        default=2e9,
+        help='Size limit [bytes] of the in-memory cache of processed '
+             'waveforms. Set to None for no limit.')
+
+    waveform_cache_nentries_max = Int.T(
+        optional=True,
+        default=100000,
+        help='Maximum number of entries in the in-memory cache of processed '
+             'waveforms. Set to None for no limit.')
+
+    waveform_disk_cache_size_max = Float.T(
+        default=1e9,
+        help='Size limit [bytes] of the persistent cache of restituted '
+             'waveforms, located in the Pyrocko cache directory. Set to 0 to '
+             'disable the persistent cache.')
+
     def __init__(self, *args, **kwargs):
         HasPaths.__init__(self, *args, **kwargs)
         self._ds = {}
@@ -987,6 +1418,76 @@ class DatasetConfig(HasPaths):
         event_names = [ev.name for ev in events]
         return event_names
 
+    def _get_waveform_event_window(self, ds):
+        try:
+            event = ds.get_event()
+        except NotFound:
+            logger.warning(
+                'Cannot restrict waveforms to event time window: '
+                'no event information.')
+            return None, None
+
+        distances = [
+            od.distance_accurate50m(event, station)
+            for station in ds.get_stations()]
+
+        tpad = self.waveform_event_window_tpad
+        tmin = event.time - tpad
+        tmax = event.time + tpad
+        if distances:
+            tmax += max(distances) / self.waveform_event_window_vmin
+
+        syn_test = self.synthetic_test
+        if syn_test and syn_test.real_noise_scale != 0.0:
+            toffset = syn_test.real_noise_toffset
+            tmin = min(tmin, tmin + toffset)
+            tmax = max(tmax, tmax + toffset)
+
+        return tmin, tmax
+
+    def _get_metadata_jobs(self, extra):
+        def paths(*xs):
+            ps = []
+            for x in xs:
+                p = self.expand_path(x, extra=extra) if x else None
+                if isinstance(p, list):
+                    ps.extend(p)
+                elif p is not None:
+                    ps.append(p)
+
+            return [p for p in ps if op.exists(p)]
+
+        jobs = []
+        for p in paths(self.stations_path):
+            jobs.append((model.load_stations, p))
+
+        for p in paths(self.events_path):
+            jobs.append((model.load_events, p))
+
+        for p in paths(self.responses_sacpz_path):
+            jobs.append((_load_sacpz_dirname, p))
+
+        for p in paths(self.stations_stationxml_paths):
+            jobs.append((
+                _stationxml_to_stations, p, True, _load_stationxml))
+
+        for p in paths(self.responses_stationxml_paths):
+            jobs.append((_load_stationxml, p))
+
+        for p in paths(self.clippings_path, *self.picks_paths):
+            jobs.append((pmarker.load_markers, p))
+
+        if self.gnss_campaign_paths:
+            for p in _select_gnss_campaign_files(
+                    paths(self.gnss_campaign_paths)):
+                jobs.append((_load_gnss_campaign, p))
+
+        if self.kite_scene_paths:
+            for p in _select_kite_scene_files(paths(self.kite_scene_paths)):
+                jobs.append((_load_kite_scene, p, False))
+
+        return jobs
+
     def get_dataset(self, event_name):
         if event_name not in self._ds:
             def extra(path):
@@ -1009,6 +1510,12 @@ class DatasetConfig(HasPaths):
                 return p
 
             ds = Dataset(event_name)
+            metadata_cache = MetadataCache(persistent=self.metadata_cache)
+            metadata_cache.prefetch(
+                self._get_metadata_jobs(extra),
+                nthreads=self.metadata_nthreads)
+
+            ds.set_metadata_cache(metadata_cache)
             ds.add_stations(
                 pyrocko_stations_filename=fp(self.stations_path),
                 stationxml_filenames=fp(self.stations_stationxml_paths))
@@ -1016,7 +1523,13 @@ class DatasetConfig(HasPaths):
             ds.add_events(filename=fp(self.events_path))
 
             if self.waveform_paths:
-                ds.add_waveforms(paths=fp(self.waveform_paths))
+                tmin, tmax = None, None
+                if self.waveform_event_window:
+                    tmin, tmax = self._get_waveform_event_window(ds)
+                    ds.keep_waveform_data = True
+
+                ds.add_waveforms(
+                    paths=fp(self.waveform_paths), tmin=tmin, tmax=tmax)
 
             if self.kite_scene_paths:
                 ds.add_kite_scenes(paths=fp(self.kite_scene_paths))
@@ -1055,6 +1568,16 @@ class DatasetConfig(HasPaths):
                 ds.add_whitelist(filenames=fp(self.whitelist_paths))
 
             ds.set_synthetic_test(copy.deepcopy(self.synthetic_test))
+            ds.set_metadata_cache(None)
+
+            ds.set_cache_limits(
+                size_max=self.waveform_cache_size_max,
+                nentries_max=self.waveform_cache_nentries_max)
+
+            if self.waveform_disk_cache_size_max > 0:
+                ds.set_disk_cache(WaveformDiskCache(
+                    size_max=self.waveform_disk_cache_size_max))
+
             self._ds[event_name] = ds
 
         return self._ds[event_name]
@@ -0,0 +1,740 @@
+'''
+Caches for processed observed data.
+'''
+
+import os
+import os.path as op
+import gc
+import json
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as num
+
+import pyrocko
+from pyrocko import config, trace, util
+
+guts_prefix = 'grond'
+logger = logging.getLogger('grond.dataset_cache')
+
+
+def fingerprint_files(paths):
+    '''
+    Get list of ``(path, mtime, size)`` of existing files.
+
+    Directories are expanded (non-recursive).
+    '''
+
+    fps = []
+    for path in paths:
+        if op.isdir(path):
+            fps.extend(fingerprint_files(
+                op.join(path, fn) for fn in sorted(os.listdir(path))
+                if not op.isdir(op.join(path, fn))))
+
+        elif op.exists(path):
+            st = os.stat(path)
+            fps.append((op.abspath(path), st.st_mtime, st.st_size))
+
+    return fps
+
+
+g_gc_lock = threading.Lock()
+g_gc_pause_count = 0
+g_gc_was_enabled = False
+
+
+@contextmanager
+def gc_paused():
+    '''
+    Disable the garbage collector, e.g. while unpickling large object trees.
+
+    Can be used concurrently from several threads; the collector is
+    re-enabled when the last user exits.
+    '''
+
+    global g_gc_pause_count, g_gc_was_enabled
+    with g_gc_lock:
+        if g_gc_pause_count == 0:
+            g_gc_was_enabled = gc.isenabled()
+            gc.disable()
+
+        g_gc_pause_count += 1
+
+    try:
+        yield
+
+    finally:
+        with g_gc_lock:
+            g_gc_pause_count -= 1
+            if g_gc_pause_count == 0 and g_gc_was_enabled:
+                gc.enable()
+
+
+g_nbytes_nominal = 1024
+
+
+def get_nbytes(obj):
+    '''
+    Get approximate memory footprint of a cached object [bytes].
+
+    Objects without sample data, e.g. cached exceptions, are accounted with
+    a nominal size, so that they are subject to the size limit, too.
+    '''
+
+    if isinstance(obj, num.ndarray):
+        return obj.nbytes
+
+    if isinstance(obj, (list, tuple)):
+        return sum(get_nbytes(x) for x in obj)
+
+    ydata = getattr(obj, 'ydata', None)
+    if ydata is not None:
+        return ydata.nbytes
+
+    return g_nbytes_nominal
+
+
+class DatasetCache(object):
+    '''
+    In-memory LRU cache for processed observed data.
+
+    The number of entries is bounded by ``nentries_max`` and the total size
+    of the cached sample data by ``size_max`` [bytes]. Set a limit to
+    ``None`` to disable it. Lookups through :py:meth:`get` are counted as
+    hits or misses, removals due to the limits as evictions.
+    '''
+
+    def __init__(self, size_max=None, nentries_max=None):
+        self.size_max = size_max
+        self.nentries_max = nentries_max
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        value, _ = self._entries[key]
+        self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._entries:
+            self._size -= self._entries.pop(key)[1]
+
+        size = get_nbytes(value)
+        self._entries[key] = value, size
+        self._size += size
+        self._evict()
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self.nhits += 1
+            return self[key]
+
+        self.nmisses += 1
+        return default
+
+    @property
+    def size(self):
+        return self._size
+
+    def _evict(self):
+        while self._entries and (
+                (self.size_max is not None
+                 and self._size > self.size_max) or
+                (self.nentries_max is not None
+                 and len(self._entries) > self.nentries_max)):
+
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self.nevictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def get_stats_str(self):
+        return '%i entries, %s, %i hits, %i misses, %i evictions' % (
+            len(self), util.human_bytesize(self._size), self.nhits,
+            self.nmisses, self.nevictions)
+
+
+class ResponseCache(object):
+    '''
+    Cache of frequency responses evaluated on FFT frequency grids.
+
+    Responses are identified by their ``uuid`` attribute, so the same
+    response object must be used for repeated requests to benefit from the
+    cache. For each response, sampling interval and FFT length, the response
+    is evaluated once on the full frequency grid. The coefficients for any
+    band of frequencies are then taken from the cached array.
+    '''
+
+    def __init__(self, size_max=2e8):
+        self._cache = DatasetCache(size_max=size_max)
+
+    @property
+    def nhits(self):
+        return self._cache.nhits
+
+    @property
+    def nmisses(self):
+        return self._cache.nmisses
+
+    def evaluate(self, transfer_function, ntrans, deltat):
+        '''
+        Get response coefficients at frequencies ``k / (ntrans * deltat)``,
+        ``k = 0, ..., ntrans // 2``.
+        '''
+
+        key = (transfer_function.uuid, ntrans, deltat)
+        coeffs = self._cache.get(key)
+        if coeffs is None:
+            freqs = num.arange(ntrans//2 + 1) * (1.0 / (deltat * ntrans))
+            with num.errstate(divide='ignore', invalid='ignore'):
+                coeffs = transfer_function.evaluate(freqs)
+
+            self._cache[key] = coeffs
+
+        return coeffs
+
+    def get_tapered_coeffs(
+            self, tr, ntrans, freqlimits, transfer_function, invert=False,
+            demean=True):
+
+        '''
+        Same as :py:meth:`pyrocko.trace.Trace._get_tapered_coeffs`, using the
+        cached response coefficients.
+        '''
+
+        deltaf = 1./(tr.deltat*ntrans)
+        nfreqs = ntrans//2 + 1
+        coeffs_all = self.evaluate(transfer_function, ntrans, tr.deltat)
+        if freqlimits is not None:
+            hi = trace.snapper(nfreqs, deltaf)
+            kmin, kmax = hi(freqlimits[0]), hi(freqlimits[3])
+            coeffs = coeffs_all[kmin:kmax]
+            transfer = num.ones(nfreqs, dtype=complex)
+            if invert:
+                if num.any(coeffs == 0.0):
+                    raise trace.InfiniteResponse('%s.%s.%s.%s' % tr.nslc_id)
+
+                transfer[kmin:kmax] = 1.0 / coeffs
+            else:
+                transfer[kmin:kmax] = coeffs
+
+            tapered_transfer = trace.costaper(
+                *freqlimits, nfreqs, deltaf) * transfer
+
+        else:
+            if invert:
+                raise Exception(
+                    'transfer: `freqlimits` must be given when `invert` is '
+                    'set to `True`')
+
+            tapered_transfer = coeffs_all.copy()
+
+        if demean:
+            tapered_transfer[0] = 0.0
+
+        return tapered_transfer
+
+    def get_spectrum(self, tr, tfade=0., demean=True):
+        '''
+        Get spectrum of the padded and faded trace as used in
+        :py:meth:`transfer`.
+
+        The spectrum does not depend on the response or on the frequency
+        band, so it can be computed once and passed to :py:meth:`transfer`
+        for several bands or quantities.
+        '''
+
+        ndata = tr.ydata.size
+        ntrans = trace.nextpow2(ndata*1.2)
+        data_pad = num.zeros(ntrans, dtype=float)
+        data_pad[:ndata] = tr.ydata
+        if demean:
+            data_pad[:ndata] -= tr.ydata.mean()
+
+        if tfade != 0.0:
+            data_pad[:ndata] *= trace.costaper(
+                0., tfade, tr.deltat*(ndata-1)-tfade, tr.deltat*ndata,
+                ndata, tr.deltat)
+
+        return num.fft.rfft(data_pad)
+
+    def transfer(
+            self, tr, tfade=0., freqlimits=None, transfer_function=None,
+            cut_off_fading=True, demean=True, invert=False, spectrum=None):
+
+        '''
+        Same as :py:meth:`pyrocko.trace.Trace.transfer`, using the cached
+        response coefficients.
+
+        If given, ``spectrum`` must have been computed with
+        :py:meth:`get_spectrum` from the same trace and with the same
+        ``tfade`` and ``demean`` settings.
+        '''
+
+        if transfer_function is None:
+            transfer_function = trace.g_one_response
+
+        if freqlimits is None and transfer_function.is_scalar():
+            return tr.transfer(
+                tfade=tfade, freqlimits=freqlimits,
+                transfer_function=transfer_function,
+                cut_off_fading=cut_off_fading, demean=demean, invert=invert)
+
+        if tr.tmax - tr.tmin <= tfade*2.:
+            raise trace.TraceTooShort(
+                'Trace %s.%s.%s.%s too short for fading length setting. '
+                'trace length = %g, fading length = %g'
+                % (tr.nslc_id + (tr.tmax-tr.tmin, tfade)))
+
+        ndata = tr.ydata.size
+        ntrans = trace.nextpow2(ndata*1.2)
+        coeffs = self.get_tapered_coeffs(
+            tr, ntrans, freqlimits, transfer_function, invert=invert,
+            demean=demean)
+
+        if spectrum is None:
+            fdata = self.get_spectrum(tr, tfade=tfade, demean=demean)
+            fdata *= coeffs
+        else:
+            fdata = spectrum * coeffs
+
+        ddata = num.fft.irfft(fdata)
+        output = tr.copy(data=False)
+        output.set_ydata(ddata[:ndata])
+
+        if cut_off_fading and tfade != 0.0:
+            try:
+                output.chop(output.tmin+tfade, output.tmax-tfade, inplace=True)
+            except trace.NoData:
+                raise trace.TraceTooShort(
+                    'Trace %s.%s.%s.%s too short for fading length setting. '
+                    'trace length = %g, fading length = %g'
+                    % (tr.nslc_id + (tr.tmax-tr.tmin, tfade)))
+        else:
+            output.ydata = output.ydata.copy()
+
+        return output
+
+
+g_response_cache = None
+
+
+def get_response_cache():
+    '''
+    Get response cache shared within the process.
+    '''
+
+    global g_response_cache
+    if g_response_cache is None:
+        g_response_cache = ResponseCache()
+
+    return g_response_cache
+
+
+class MetadataCache(object):
+    '''
+    Cache for parsed metadata files, e.g. station and response information.
+
+    Results of ``loader(path)`` are kept in memory for the lifetime of the
+    cache object, so that a file used for several purposes, e.g. a StationXML
+    file providing station coordinates and responses, is parsed only once.
+    With ``persistent=True``, the results are also pickled to ``dirname``,
+    keyed by loader and path, and are reused by later processes as long as
+    the path, modification time and size of the input files are unchanged.
+    '''
+
+    version = 1
+
+    def __init__(self, dirname=None, persistent=True):
+        if dirname is None:
+            dirname = op.join(config.config().cache_dir, 'grond', 'metadata')
+
+        self.dirname = dirname
+        self.persistent = persistent
+        self._memo = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _get_path(self, loader, path):
+        h = hashlib.sha1()
+        h.update(repr((
+            loader.__module__, loader.__name__,
+            op.abspath(path))).encode('utf8'))
+
+        return op.join(self.dirname, h.hexdigest() + '.pickle')
+
+    def _get_fingerprint(self, path):
+        return (
+            self.version, pyrocko.__version__, fingerprint_files([path]))
+
+    def _load_persistent(self, loader, path, make):
+        fn = self._get_path(loader, path)
+        fingerprint = self._get_fingerprint(path)
+        if op.exists(fn):
+            try:
+                with open(fn, 'rb') as f, gc_paused():
+                    if pickle.load(f) == fingerprint:
+                        logger.debug('Using cached metadata for %s' % path)
+                        return pickle.load(f)
+
+            except Exception as e:
+                logger.debug('Cannot read metadata cache: %s' % e)
+
+        obj = make(path)
+
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            fn_tmp = fn + '.tmp-%i-%i' % (os.getpid(), id(obj))
+            with open(fn_tmp, 'wb') as f:
+                pickle.dump(fingerprint, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(fn_tmp, fn)
+
+        except Exception as e:
+            logger.warning('Cannot write metadata cache: %s' % e)
+
+        return obj
+
+    def load(self, loader, path, persistent=True, base=None):
+        '''
+        Get result of ``loader(path)``.
+
+        If ``base`` is given, the result of ``loader(base(path))`` is
+        returned, where the intermediate result is also cached, e.g. to get
+        station objects from a StationXML file which is also used for its
+        responses. Set ``persistent`` to ``False`` for loaders whose results
+        should not be stored on disk.
+        '''
+
+        key = (loader, op.abspath(path))
+        if key not in self._memo:
+            with self._lock:
+                lock = self._locks.setdefault(key, threading.Lock())
+
+            with lock:
+                if key not in self._memo:
+                    if base is not None:
+                        def make(path):
+                            return loader(self.load(base, path, persistent))
+                    else:
+                        make = loader
+
+                    if self.persistent and persistent:
+                        self._memo[key] = self._load_persistent(
+                            loader, path, make)
+                    else:
+                        self._memo[key] = make(path)
+
+        return self._memo[key]
+
+    def prefetch(self, jobs, nthreads=4):
+        '''
+        Load files concurrently on a thread pool.
+
+        :param jobs: list of tuples with the arguments to :py:meth:`load`
+
+        Errors are ignored here, they are raised when the file is requested
+        with :py:meth:`load`.
+        '''
+
+        def load(job):
+            try:
+                self.load(*job)
+            except Exception:
+                pass
+
+        keys = set()
+        jobs_todo = []
+        for job in jobs:
+            key = (job[0], op.abspath(job[1]))
+            if key not in self._memo and key not in keys:
+                keys.add(key)
+                jobs_todo.append(job)
+
+        jobs = jobs_todo
+
+        if not jobs:
+            return
+
+        if nthreads > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                list(executor.map(load, jobs))
+        else:
+            for job in jobs:
+                load(job)
+
+
+class WaveformDiskCache(object):
+    '''
+    Persistent cache of restituted, projected and filtered waveforms.
+
+    Entries are stored as pairs of a ``.npy`` file with the concatenated
+    sample data of a set of traces and a small ``.json`` file holding the
+    trace headers and a validation token. The data files are memory-mapped
+    (copy-on-write) when read. An entry is discarded if its validation token,
+    e.g. the paths and modification times of the raw input files, does not
+    match the one given on lookup. When the total size of the cache exceeds
+    ``size_max`` [bytes], the least recently used entries are removed.
+    '''
+
+    version = 1
+
+    def __init__(self, dirname=None, size_max=1e9):
+        if dirname is None:
+            dirname = op.join(config.config().cache_dir, 'grond', 'waveforms')
+
+        self.dirname = dirname
+        self.size_max = size_max
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+        self._sizes = None
+
+    def make_key(self, *args):
+        h = hashlib.sha1()
+        h.update(repr((self.version,) + args).encode('utf8'))
+        return h.hexdigest()
+
+    def _paths(self, key):
+        fn = op.join(self.dirname, key)
+        return fn + '.json', fn + '.npy'
+
+    def _remove(self, key):
+        for fn in self._paths(key):
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+
+        if self._sizes is not None:
+            self._sizes.pop(key, None)
+
+    def _scan(self):
+        entries = []
+        if op.isdir(self.dirname):
+            for fn in os.listdir(self.dirname):
+                if not fn.endswith('.json'):
+                    continue
+
+                key = fn[:-5]
+                try:
+                    size = sum(os.stat(p).st_size for p in self._paths(key))
+                    entries.append(
+                        (os.stat(self._paths(key)[0]).st_mtime, key, size))
+
+                except OSError:
+                    pass
+
+        entries.sort()
+        self._sizes = OrderedDict((key, size) for (_, key, size) in entries)
+
+    def _touch(self, key, size=None):
+        if self._sizes is None:
+            return
+
+        if size is None:
+            size = self._sizes.get(key, 0)
+
+        self._sizes.pop(key, None)
+        self._sizes[key] = size
+
+    def _evict(self):
+        if self._sizes is None:
+            self._scan()
+
+        total = sum(self._sizes.values())
+        while total > self.size_max and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self._remove(key)
+            total -= size
+            self.nevictions += 1
+
+    def get(self, key, validation):
+        '''
+        Get cached traces.
+
+        :returns: list of :py:class:`pyrocko.trace.Trace` objects or ``None``
+            if there is no valid entry for ``key``.
+        '''
+
+        fn_meta, fn_data = self._paths(key)
+        try:
+            with open(fn_meta, 'r') as f:
+                meta = json.load(f)
+
+            if meta['validation'] != json.loads(json.dumps(validation)):
+                logger.debug('Waveform cache entry outdated: %s' % key)
+                self._remove(key)
+                self.nmisses += 1
+                return None
+
+            data = num.load(fn_data, mmap_mode='c')
+            os.utime(fn_meta)
+
+        except (OSError, ValueError, KeyError):
+            self.nmisses += 1
+            return None
+
+        self._touch(key)
+
+        trs = []
+        for (net, sta, loc, cha, tmin, deltat, i, n) in meta['traces']:
+            trs.append(trace.Trace(
+                net, sta, loc, cha,
+                tmin=tmin, deltat=deltat, ydata=data[i:i+n]))
+
+        self.nhits += 1
+        return trs
+
+    def put(self, key, validation, traces):
+        '''
+        Store traces in the cache.
+        '''
+
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+        except OSError as e:
+            logger.warning('Cannot create waveform cache directory: %s' % e)
+            return
+
+        headers = []
+        i = 0
+        for tr in traces:
+            headers.append(tr.nslc_id + (tr.tmin, tr.deltat, i, tr.ydata.size))
+            i += tr.ydata.size
+
+        data = num.concatenate(
+            [tr.get_ydata().astype(num.float) for tr in traces])
+
+        meta = dict(validation=validation, traces=headers)
+        fn_meta, fn_data = self._paths(key)
+        suffix = '.tmp-%i' % os.getpid()
+        try:
+            with open(fn_data + suffix, 'wb') as f:
+                num.save(f, data)
+
+            with open(fn_meta + suffix, 'w') as f:
+                json.dump(meta, f)
+
+            os.replace(fn_data + suffix, fn_data)
+            os.replace(fn_meta + suffix, fn_meta)
+
+        except OSError as e:
+            logger.warning('Cannot write to waveform cache: %s' % e)
+            for fn in (fn_data + suffix, fn_meta + suffix):
+                if op.exists(fn):
+                    os.unlink(fn)
+
+            return
+
+        if self._sizes is None:
+            self._scan()
+
+        self._touch(key, os.stat(fn_data).st_size + os.stat(fn_meta).st_size)
+        self._evict()
+
+    def clear(self):
+        if self._sizes is None:
+            self._scan()
+
+        for key in list(self._sizes.keys()):
+            self._remove(key)
+
+    def get_stats_str(self):
+        return '%i hits, %i misses, %i evictions' % (
+            self.nhits, self.nmisses, self.nevictions)
+
+
+class NoiseRealisationCache(object):
+    '''
+    Persistent cache of noise realisations, e.g. for bootstrapping residuals.
+
+    Each entry is a 2D array with one realisation per row, stored as ``.npy``
+    file under a key derived from everything the realisations depend on,
+    including the random seed. Realisations are expected to be seeded
+    individually, so that an entry can be extended by further rows when more
+    realisations are requested later.
+    '''
+
+    version = 1
+
+    def __init__(self, dirname=None):
+        if dirname is None:
+            dirname = op.join(config.config().cache_dir, 'grond', 'noise')
+
+        self.dirname = dirname
+
+    def make_key(self, *args):
+        h = hashlib.sha1()
+        h.update(repr((self.version,) + args).encode('utf8'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return op.join(self.dirname, key + '.npy')
+
+    def get(self, key):
+        '''
+        Get cached realisations.
+
+        :returns: 2D array or ``None`` if there is no entry for ``key``.
+        '''
+
+        try:
+            realisations = num.load(self._path(key))
+
+        except (OSError, ValueError):
+            return None
+
+        if realisations.ndim != 2:
+            return None
+
+        return realisations
+
+    def put(self, key, realisations):
+        '''
+        Store realisations, replacing any previous entry for ``key``.
+        '''
+
+        fn = self._path(key)
+        fn_temp = fn + '.tmp-%i' % os.getpid()
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            with open(fn_temp, 'wb') as f:
+                num.save(f, num.asarray(realisations, dtype=num.float))
+
+            os.replace(fn_temp, fn)
+
+        except OSError as e:
+            logger.warning('Cannot write to noise cache: %s' % e)
+            if op.exists(fn_temp):
+                os.unlink(fn_temp)
+
+
+__all__ = '''
+    DatasetCache
+    MetadataCache
+    NoiseRealisationCache
+    ResponseCache
+    WaveformDiskCache
+    fingerprint_files
+    get_response_cache
+'''.split()
@@ -1,5 +1,6 @@
 import logging
 import math
+import multiprocessing
 import numpy as num
 import os.path as op
 from string import Template
@@ -101,6 +102,26 @@ class GrondError(Exception):
     pass
 
 
+def make_process_pool(nprocs):
+    '''
+    Create pool of ``nprocs`` forked worker processes.
+
+    Returns ``None`` when called from a daemonic process, e.g. from one of
+    the event workers of ``grond go --parallel``, because such processes are
+    not allowed to have children. The caller should then do the work in the
+    calling process.
+    '''
+
+    if multiprocessing.current_process().daemon:
+        logger.warning(
+            'cannot start %i worker processes from within a daemonic '
+            'process (grond go --parallel), continuing serially' % nprocs)
+
+        return None
+
+    return multiprocessing.get_context('fork').Pool(nprocs)
+
+
 def expand_template(template, d):
     try:
         return Template(template).substitute(d)
@@ -1,7 +1,9 @@
 import logging
 
-from pyrocko.guts import Object
-from grond.meta import GrondError
+import numpy as num
+
+from pyrocko.guts import Object, StringChoice, Int
+from grond.meta import GrondError, make_process_pool
 
 guts_prefix = 'grond'
 
@@ -12,9 +14,102 @@ class BadProblem(GrondError):
     pass
 
 
+g_state = {}
+
+
+def _evaluate_misfits(g_data_id, x, mask):
+    problem = g_state[g_data_id]
+    return problem.misfits(x, mask=mask)
+
+
+def _evaluate_misfits_many(g_data_id, xs, mask):
+    problem = g_state[g_data_id]
+    return problem.misfits_many(xs, mask=mask)
+
+
+class _SerialResult(object):
+
+    def __init__(self, problem, x, mask):
+        self._args = problem, x, mask
+
+    def get(self):
+        problem, x, mask = self._args
+        return problem.misfits(x, mask=mask)
+
+
+class MisfitEvaluator(object):
+    '''
+    Evaluate problem misfits, optionally on a pool of local processes.
+
+    Candidates are handed in with :py:meth:`submit` which returns a handle
+    whose ``get()`` method blocks until the misfits are available. With
+    ``nprocs=1``, the evaluation is done lazily in the calling process when
+    ``get()`` is called.
+
+    Worker processes are forked, so that the problem, its engine and its
+    dataset are shared with the workers without being pickled. Caches built
+    up in the workers are not propagated back to the parent process. Inside
+    a daemonic process, e.g. an event worker of ``grond go --parallel``,
+    no workers can be started and the evaluation is done serially.
+
+    :param problem: :py:class:`grond.Problem` instance
+    :param nprocs: number of worker processes
+    '''
+
+    def __init__(self, problem, nprocs=1):
+        self.problem = problem
+        self.nprocs = nprocs
+        self._pool = None
+        self._g_data_id = None
+
+    def __enter__(self):
+        if self.nprocs > 1:
+            self._g_data_id = id(self)
+            g_state[self._g_data_id] = self.problem
+            self._pool = make_process_pool(self.nprocs)
+            if self._pool is None:
+                del g_state[self._g_data_id]
+
+        return self
+
+    def __exit__(self, *args):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            del g_state[self._g_data_id]
+
+    def submit(self, x, mask=None):
+        if self._pool is None:
+            return _SerialResult(self.problem, x, mask)
+        else:
+            return self._pool.apply_async(
+                _evaluate_misfits, (self._g_data_id, x, mask))
+
+    def misfits_many(self, xs, mask=None):
+        '''
+        Evaluate a batch of candidates and wait for the results.
+
+        The batch is split into one chunk per worker process, each of which
+        is modelled with :py:meth:`grond.Problem.misfits_many`.
+
+        :returns: 3D array ``misfits[imodel, iresidual, 0:2]``
+        '''
+        if self._pool is None:
+            return self.problem.misfits_many(xs, mask=mask)
+
+        results = [
+            self._pool.apply_async(
+                _evaluate_misfits_many, (self._g_data_id, xs_chunk, mask))
+            for xs_chunk in num.array_split(xs, self.nprocs)
+            if xs_chunk.shape[0] != 0]
+
+        return num.concatenate([result.get() for result in results])
+
+
 class Optimiser(Object):
 
-    def optimise(self, problem):
+    def optimise(self, problem, rundir=None, resume=False):
         raise NotImplementedError
 
     @property
@@ -33,6 +128,160 @@ class Optimiser(Object):
         return plot.get_plot_classes()
 
 
+class BootstrapTypeChoice(StringChoice):
+    choices = ['bayesian', 'classic']
+
+
+def make_bayesian_weights(nbootstrap, nmisfits,
+                          type='bayesian', rstate=None):
+    ws = num.zeros((nbootstrap, nmisfits))
+    if rstate is None:
+        rstate = num.random.RandomState()
+
+    for ibootstrap in range(nbootstrap):
+        if type == 'classic':
+            ii = rstate.randint(0, nmisfits, size=nmisfits)
+            ws[ibootstrap, :] = num.histogram(
+                ii, nmisfits, (-0.5, nmisfits - 0.5))[0]
+        elif type == 'bayesian':
+            f = rstate.uniform(0., 1., size=nmisfits+1)
+            f[0] = 0.
+            f[-1] = 1.
+            f = num.sort(f)
+            g = f[1:] - f[:-1]
+            ws[ibootstrap, :] = g * nmisfits
+        else:
+            assert False
+    return ws
+
+
+class BootstrapOptimiser(Optimiser):
+    '''
+    Base class for optimisers tracking bootstrap misfits of their models.
+
+    Besides the global misfit, the misfits of ``nbootstrap`` bootstrap
+    realisations are computed for each model and stored in the model history.
+    '''
+
+    nbootstrap = Int.T(default=100)
+    bootstrap_type = BootstrapTypeChoice.T(default='bayesian')
+    bootstrap_seed = Int.T(default=23)
+    nprocs = Int.T(default=1)
+
+    def __init__(self, **kwargs):
+        Optimiser.__init__(self, **kwargs)
+        self._bootstrap_weights = None
+        self._bootstrap_residuals = None
+        self.rstate = num.random.RandomState(self.bootstrap_seed)
+
+    def init_bootstraps(self, problem):
+        self.init_bootstrap_weights(problem)
+        self.init_bootstrap_residuals(problem)
+
+    def init_bootstrap_weights(self, problem):
+        logger.info('Initializing Bayesian bootstrap weights')
+        bootstrap_targets = set([t for t in problem.targets
+                                 if t.can_bootstrap_weights])
+
+        ws = make_bayesian_weights(
+            self.nbootstrap,
+            nmisfits=problem.nmisfits,
+            rstate=self.rstate)
+
+        imf = 0
+        for it, t in enumerate(bootstrap_targets):
+            t.set_bootstrap_weights(ws[:, imf:imf+t.nmisfits])
+            imf += t.nmisfits
+
+        for t in set(problem.targets) - bootstrap_targets:
+            t.set_bootstrap_weights(
+                num.ones((self.nbootstrap, t.nmisfits)))
+
+    def init_bootstrap_residuals(self, problem):
+        logger.info('Initializing Bayesian bootstrap residuals')
+        residual_targets = set([t for t in problem.targets
+                                if t.can_bootstrap_residuals])
+
+        for t in residual_targets:
+            t.init_bootstrap_residuals(
+                self.nbootstrap, rstate=self.rstate,
+                nprocs=self.nprocs)
+
+        for t in set(problem.targets) - residual_targets:
+            t.set_bootstrap_residuals(num.zeros((self.nbootstrap, t.nmisfits)))
+
+    def get_bootstrap_weights(self, problem):
+        if self._bootstrap_weights is None:
+            try:
+                problem.targets[0].get_bootstrap_weights()
+            except Exception:
+                self.init_bootstraps(problem)
+
+            bootstrap_weights = num.hstack(
+                [t.get_bootstrap_weights()
+                 for t in problem.targets])
+
+            self._bootstrap_weights = num.vstack((
+                num.ones((1, problem.nmisfits)),
+                bootstrap_weights))
+
+        return self._bootstrap_weights
+
+    def get_bootstrap_residuals(self, problem):
+        if self._bootstrap_residuals is None:
+            try:
+                problem.targets[0].get_bootstrap_residuals()
+            except Exception:
+                self.init_bootstraps(problem)
+
+            bootstrap_residuals = num.hstack(
+                [t.get_bootstrap_residuals()
+                 for t in problem.targets])
+
+            self._bootstrap_residuals = num.vstack((
+                num.zeros((1, problem.nmisfits)),
+                bootstrap_residuals))
+
+        return self._bootstrap_residuals
+
+    @property
+    def nchains(self):
+        return self.nbootstrap + 1
+
+    def process_result(
+            self, problem, history, iiter, x, misfits, isbad_mask):
+
+        bootstrap_misfits = problem.combine_misfits(
+            misfits,
+            extra_weights=self.get_bootstrap_weights(problem),
+            extra_residuals=self.get_bootstrap_residuals(problem))
+
+        isbad_mask_new = num.isnan(misfits[:, 0])
+        if isbad_mask is not None and num.any(
+                isbad_mask != isbad_mask_new):
+
+            errmess = [
+                'problem %s: inconsistency in data availability'
+                ' at iteration %i' %
+                (problem.name, iiter)]
+
+            for target, isbad_new, isbad in zip(
+                    problem.targets, isbad_mask_new, isbad_mask):
+
+                if isbad_new != isbad:
+                    errmess.append('  %s, %s -> %s' % (
+                        target.string_id(), isbad, isbad_new))
+
+            raise BadProblem('\n'.join(errmess))
+
+        if num.all(isbad_mask_new):
+            raise BadProblem(
+                'problem %s: all target misfit values are NaN'
+                % problem.name)
+
+        history.append(x, misfits, bootstrap_misfits)
+
+
 class OptimiserConfig(Object):
     pass
 
@@ -63,5 +312,7 @@ class OptimiserStatus(object):
 __all__ = '''
     BadProblem
     Optimiser
+    BootstrapOptimiser
     OptimiserConfig
+    MisfitEvaluator
 '''.split()
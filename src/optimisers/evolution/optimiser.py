@@ -0,0 +1,370 @@
+import logging
+import os.path as op
+import numpy as num
+from collections import OrderedDict
+
+from pyrocko.guts import StringChoice, Int, Float
+
+from grond.meta import GrondError, Forbidden
+from grond.problems.base import ModelHistory, get_nmodels, \
+    truncate_problem_data
+from grond.optimisers.base import BootstrapOptimiser, OptimiserConfig, \
+    OptimiserStatus, MisfitEvaluator
+from grond.optimisers.highscore.optimiser import UniformSamplerPhase
+
+guts_prefix = 'grond'
+
+logger = logging.getLogger('grond.optimisers.evolution.optimiser')
+
+
+class DifferentialEvolutionStrategyChoice(StringChoice):
+    choices = ['best1bin', 'rand1bin', 'current_to_best1bin']
+
+
+class DifferentialEvolutionOptimiser(BootstrapOptimiser):
+    '''
+    Differential evolution optimisation of the global misfit.
+
+    The optimiser works on a population of ``population_size`` models.
+    Each generation, a trial model is built for every member of the
+    population by mutation and binomial crossover. All trials of a
+    generation are evaluated as a batch with
+    :py:meth:`grond.Problem.misfits_many`, optionally split over ``nprocs``
+    worker processes, and a trial replaces its parent if its global misfit is
+    lower or equal.
+
+    The first generation is drawn uniformly from the model space. All
+    models are written to the model history in generation order, together
+    with their bootstrap misfits, so that harvesting and plotting work as
+    for the :py:class:`HighScoreOptimiser`. The bootstrap misfits do not
+    steer the search.
+    '''
+
+    ngenerations = Int.T(default=100)
+    population_size = Int.T(default=50)
+    strategy = DifferentialEvolutionStrategyChoice.T(default='best1bin')
+    mutation_min = Float.T(default=0.5)
+    mutation_max = Float.T(default=1.0)
+    crossover_probability = Float.T(default=0.7)
+    tolerance = Float.T(optional=True)
+    ntries_preconstrain_limit = Int.T(default=1000)
+    sampler_seed = Int.T(optional=True)
+
+    def __init__(self, **kwargs):
+        BootstrapOptimiser.__init__(self, **kwargs)
+        self.sampler_rstate = num.random.default_rng(self.sampler_seed)
+
+    @property
+    def niterations(self):
+        return self.ngenerations * self.population_size
+
+    def get_generation_rstate(self, igeneration):
+        '''
+        Get the random number generator for drawing a generation.
+
+        With a ``sampler_seed`` set, each generation has its own generator
+        derived from the seed, so that a resumed run draws the same trials
+        as an uninterrupted one.
+        '''
+        if self.sampler_seed is None:
+            return self.sampler_rstate
+
+        return num.random.default_rng((self.sampler_seed, igeneration))
+
+    def select(self, history, ipop, igeneration):
+        '''
+        Replace population members by better trials of a generation.
+
+        :param ipop: 1D array with the history indices of the population
+            members before *igeneration*
+        :returns: 1D array with the history indices of the population
+            members after *igeneration*
+        '''
+        npop = self.population_size
+        itrials = igeneration * npop + num.arange(npop)
+        misfits = self.get_global_misfits(history)
+        return num.where(misfits[itrials] <= misfits[ipop], itrials, ipop)
+
+    def get_global_misfits(self, history):
+        misfits = history.bootstrap_misfits[:, 0]
+        return num.where(num.isfinite(misfits), misfits, num.inf)
+
+    def get_population(self, history):
+        '''
+        Reconstruct the current population from the model history.
+
+        As long as the first generation is incomplete, all models evaluated
+        so far are returned.
+
+        :returns: 1D array with the history indices of the population members
+        '''
+        npop = self.population_size
+        ngenerations = history.nmodels // npop
+        if ngenerations == 0:
+            return num.arange(history.nmodels)
+
+        ipop = num.arange(npop)
+        for igeneration in range(1, ngenerations):
+            ipop = self.select(history, ipop, igeneration)
+
+        return ipop
+
+    def is_converged(self, misfits):
+        if self.tolerance is None:
+            return False
+
+        return num.std(misfits) <= self.tolerance * num.abs(num.mean(misfits))
+
+    def get_raw_trials(self, xs, misfits, iparents, xbounds, rstate):
+        npop, npar = xs.shape
+        n = iparents.size
+
+        # three distinct population members other than the parent
+        keys = rstate.random((n, npop))
+        keys[num.arange(n), iparents] = 2.0
+        ir = num.argsort(keys, axis=1)[:, :3]
+
+        f = rstate.uniform(self.mutation_min, self.mutation_max, size=n)
+        f = f[:, num.newaxis]
+        xbest = xs[num.argmin(misfits), :]
+        parents = xs[iparents, :]
+
+        if self.strategy == 'best1bin':
+            mutants = xbest + f * (xs[ir[:, 0]] - xs[ir[:, 1]])
+        elif self.strategy == 'rand1bin':
+            mutants = xs[ir[:, 0]] + f * (xs[ir[:, 1]] - xs[ir[:, 2]])
+        elif self.strategy == 'current_to_best1bin':
+            mutants = parents + f * (xbest - parents) \
+                + f * (xs[ir[:, 0]] - xs[ir[:, 1]])
+        else:
+            assert False, 'invalid strategy choice: %s' % self.strategy
+
+        cross = rstate.random((n, npar)) < self.crossover_probability
+        cross[num.arange(n), rstate.integers(0, npar, size=n)] = True
+        trials = num.where(cross, mutants, parents)
+
+        # out of bounds values are moved between parent and violated bound
+        xmin, xmax = xbounds[:, 0], xbounds[:, 1]
+        u = rstate.random((n, npar))
+        trials = num.where(trials < xmin, xmin + u * (parents - xmin), trials)
+        trials = num.where(trials > xmax, xmax - u * (xmax - parents), trials)
+        return trials
+
+    def get_trials(self, problem, xs, misfits, rstate):
+        '''
+        Build the preconstrained trial models for a population.
+
+        :param xs: 2D array ``xs[imember, iparameter]`` with the population
+        :param misfits: 1D array with the global misfits of the population
+        :returns: 2D array ``xs[imember, iparameter]`` with the trials
+        '''
+        xbounds = problem.get_parameter_bounds()
+        trials = num.zeros(xs.shape, dtype=num.float)
+        todo = num.arange(xs.shape[0])
+
+        for ntries_preconstrain in range(self.ntries_preconstrain_limit):
+            xs_raw = self.get_raw_trials(xs, misfits, todo, xbounds, rstate)
+
+            forbidden = []
+            for imember, x in zip(todo, xs_raw):
+                try:
+                    trials[imember, :] = problem.preconstrain(x)
+
+                except Forbidden:
+                    forbidden.append(imember)
+
+            todo = num.array(forbidden, dtype=num.int)
+            if todo.size == 0:
+                return trials
+
+        raise GrondError(
+            'could not find any suitable trial model within %i tries' % (
+                self.ntries_preconstrain_limit))
+
+    def resume_history(self, problem, rundir):
+        '''
+        Reopen the model history of an interrupted run for appending.
+
+        Models of the last, incomplete generation are discarded.
+        '''
+        nmodels = get_nmodels(rundir, problem, nchains=self.nchains)
+        nmodels -= nmodels % self.population_size
+        truncate_problem_data(rundir, problem, nmodels, nchains=self.nchains)
+
+        logger.info('resuming problem %s at generation %i' % (
+            problem.name, nmodels // self.population_size))
+
+        return ModelHistory(
+            problem, nchains=self.nchains, path=rundir, mode='a')
+
+    def optimise(self, problem, rundir=None, resume=False):
+        npop = self.population_size
+        if npop < 5:
+            raise GrondError(
+                'population_size of differential evolution must be at '
+                'least 5')
+
+        if resume:
+            history = self.resume_history(problem, rundir)
+
+        else:
+            if rundir is not None:
+                self.dump(filename=op.join(rundir, 'optimiser.yaml'))
+
+            history = ModelHistory(problem,
+                                   nchains=self.nchains,
+                                   path=rundir, mode='w')
+
+        isbad_mask = None
+        ipop = None
+        if history.nmodels != 0:
+            isbad_mask = num.isnan(history.misfits[-1, :, 0])
+            ipop = self.get_population(history)
+
+        with MisfitEvaluator(problem, nprocs=self.nprocs) as evaluator:
+            for igeneration in range(
+                    history.nmodels // npop, self.ngenerations):
+
+                rstate = self.get_generation_rstate(igeneration)
+                if igeneration == 0:
+                    xs = UniformSamplerPhase(
+                        niterations=npop,
+                        ntries_preconstrain_limit=(
+                            self.ntries_preconstrain_limit)).get_samples(
+                        problem, num.arange(npop), None, rstate=rstate)
+
+                else:
+                    misfits_pop = self.get_global_misfits(history)[ipop]
+                    if self.is_converged(misfits_pop):
+                        logger.info(
+                            '%s: population converged at generation %i/%i'
+                            % (problem.name, igeneration, self.ngenerations))
+
+                        break
+
+                    xs = self.get_trials(
+                        problem, history.models[ipop, :], misfits_pop,
+                        rstate)
+
+                if isbad_mask is not None and num.any(isbad_mask):
+                    isok_mask = num.logical_not(isbad_mask)
+                else:
+                    isok_mask = None
+
+                misfitss = evaluator.misfits_many(xs, mask=isok_mask)
+                for imember, (x, misfits) in enumerate(zip(xs, misfitss)):
+                    self.process_result(
+                        problem, history, igeneration * npop + imember, x,
+                        misfits, isbad_mask)
+
+                    isbad_mask = num.isnan(misfits[:, 0])
+
+                if igeneration == 0:
+                    ipop = num.arange(npop)
+                else:
+                    ipop = self.select(history, ipop, igeneration)
+
+                logger.info(
+                    '%s at generation %i/%i, best misfit %g' % (
+                        problem.name, igeneration + 1, self.ngenerations,
+                        num.min(self.get_global_misfits(history)[ipop])))
+
+    def get_status(self, history):
+        problem = history.problem
+
+        row_names = [p.name_nogroups for p in problem.parameters]
+        row_names.append('Misfit')
+
+        def colum_array(data, misfit):
+            arr = num.full(len(row_names), fill_value=num.nan)
+            arr[:data.size] = data
+            arr[-1] = misfit
+            return arr
+
+        if history.nmodels == 0:
+            pop_mean = pop_std = pop_best = colum_array(
+                num.zeros(0), num.nan)
+
+        else:
+            ipop = self.get_population(history)
+            xs = history.models[ipop, :]
+            misfits = history.bootstrap_misfits[ipop, 0]
+
+            ibest = num.argmin(self.get_global_misfits(history)[ipop])
+
+            pop_mean = colum_array(num.mean(xs, axis=0), num.mean(misfits))
+            pop_std = colum_array(num.std(xs, axis=0), num.std(misfits))
+            pop_best = colum_array(xs[ibest], misfits[ibest])
+
+        return OptimiserStatus(
+            row_names=row_names,
+            column_data=OrderedDict(
+                zip(['Pop mean', 'Pop std', 'Pop best'],
+                    [pop_mean, pop_std, pop_best])),
+            extra_header=u'Optimiser generation: %i/%i, population size %i'
+                         % (history.nmodels // self.population_size,
+                            self.ngenerations,
+                            self.population_size))
+
+
+class DifferentialEvolutionOptimiserConfig(OptimiserConfig):
+
+    ngenerations = Int.T(
+        default=100,
+        help='Number of generations.')
+    population_size = Int.T(
+        default=50,
+        help='Number of models in the population. Each generation, as many '
+             'trial models are evaluated.')
+    strategy = DifferentialEvolutionStrategyChoice.T(
+        default='best1bin',
+        help='Mutation strategy: \'best1bin\' mutates the best member, '
+             '\'rand1bin\' a random member and \'current_to_best1bin\' '
+             'moves the parent towards the best member.')
+    mutation_min = Float.T(
+        default=0.5,
+        help='Lower bound of the mutation factor, which is drawn randomly '
+             'for each trial.')
+    mutation_max = Float.T(
+        default=1.0,
+        help='Upper bound of the mutation factor.')
+    crossover_probability = Float.T(
+        default=0.7,
+        help='Probability for a parameter to be taken from the mutant '
+             'rather than from the parent.')
+    tolerance = Float.T(
+        optional=True,
+        help='If set, stop when the standard deviation of the population\'s '
+             'misfits falls below tolerance times their mean.')
+    nbootstrap = Int.T(
+        default=100,
+        help='Number of bootstrap realisations for which misfits are '
+             'recorded.')
+    sampler_seed = Int.T(
+        optional=True,
+        help='Seed for the random number generator of the optimiser. '
+             'If not set, a fresh seed is taken from the operating system.')
+    nprocs = Int.T(
+        default=1,
+        help='Number of local worker processes used to evaluate the trial '
+             'models of a generation concurrently.')
+
+    def get_optimiser(self):
+        return DifferentialEvolutionOptimiser(
+            ngenerations=self.ngenerations,
+            population_size=self.population_size,
+            strategy=self.strategy,
+            mutation_min=self.mutation_min,
+            mutation_max=self.mutation_max,
+            crossover_probability=self.crossover_probability,
+            tolerance=self.tolerance,
+            nbootstrap=self.nbootstrap,
+            sampler_seed=self.sampler_seed,
+            nprocs=self.nprocs)
+
+
+__all__ = '''
+    DifferentialEvolutionStrategyChoice
+    DifferentialEvolutionOptimiser
+    DifferentialEvolutionOptimiserConfig
+'''.split()
@@ -4,16 +4,19 @@ import os.path as op
 import os
 import logging
 import time
+import json
 import numpy as num
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from scipy.spatial import cKDTree
 
-from pyrocko.guts import StringChoice, Int, Float, Object, List
+from pyrocko import guts
+from pyrocko.guts import StringChoice, Int, Float, Object, List, String
 from pyrocko.guts_array import Array
 
 from grond.meta import GrondError, Forbidden
-from grond.problems.base import ModelHistory
-from grond.optimisers.base import Optimiser, OptimiserConfig, BadProblem, \
-    OptimiserStatus
+from grond.problems.base import ModelHistory, truncate_problem_data
+from grond.optimisers.base import BootstrapOptimiser, OptimiserConfig, \
+    OptimiserStatus, MisfitEvaluator
 
 guts_prefix = 'grond'
 
@@ -22,26 +25,108 @@ logger = logging.getLogger('grond.optimisers.highscore.optimiser')
 
 def excentricity_compensated_probabilities(xs, sbx, factor):
     inonflat = num.where(sbx != 0.0)[0]
-    scale = num.zeros_like(sbx)
-    scale[inonflat] = 1.0 / (sbx[inonflat] * (factor if factor != 0. else 1.0))
-    distances_sqr_all = num.sum(
-        ((xs[num.newaxis, :, :] - xs[:, num.newaxis, :]) *
-         scale[num.newaxis, num.newaxis, :])**2, axis=2)
-    probabilities = 1.0 / num.sum(distances_sqr_all < 1.0, axis=1)
-    # print(num.sort(num.sum(distances_sqr_all < 1.0, axis=1)))
+    if inonflat.size == 0:
+        return num.full(xs.shape[0], 1.0 / xs.shape[0])
+
+    scale = 1.0 / (sbx[inonflat] * (factor if factor != 0. else 1.0))
+    xs_scaled = xs[:, inonflat] * scale[num.newaxis, :]
+
+    # number of models within unit distance, counting the model itself
+    tree = cKDTree(xs_scaled)
+    nneighbours = tree.query_ball_point(
+        xs_scaled, r=num.nextafter(1.0, 0.0), return_length=True)
+
+    probabilities = 1.0 / nneighbours
     probabilities /= num.sum(probabilities)
     return probabilities
 
 
-def excentricity_compensated_choice(xs, sbx, factor):
+def excentricity_compensated_choice(xs, sbx, factor, rstate=None,
+                                    size=None):
     probabilities = excentricity_compensated_probabilities(
         xs, sbx, factor)
-    r = num.random.random()
+    if rstate is None:
+        rstate = num.random
+    r = rstate.random(size)
     ichoice = num.searchsorted(num.cumsum(probabilities), r)
-    ichoice = min(ichoice, xs.shape[0]-1)
+    ichoice = num.minimum(ichoice, xs.shape[0]-1)
     return ichoice
 
 
+def truncated_normal(loc, scale, xbounds, rstate, ntries_limit):
+    '''
+    Draw from normal distributions truncated to parameter bounds.
+
+    Out-of-bounds values are redrawn (vectorized rejection sampling) until
+    all values are within bounds or *ntries_limit* is exceeded.
+
+    :param loc: 2D array ``loc[isample, ipar]`` with the centers
+    :param scale: 2D array ``scale[isample, ipar]`` with standard deviations
+    :param xbounds: 2D array ``xbounds[ipar, 0:2]`` with parameter bounds
+    :param rstate: :py:class:`numpy.random.Generator` to draw from
+    :param ntries_limit: maximum number of redraws
+    :returns: tuple ``(xs, failed)`` with the drawn values and a boolean
+        mask of entries for which no valid value could be found
+    '''
+    xmin = num.broadcast_to(xbounds[:, 0], loc.shape)
+    xmax = num.broadcast_to(xbounds[:, 1], loc.shape)
+
+    xs = num.empty(loc.shape, dtype=num.float)
+    failed = num.ones(loc.shape, dtype=num.bool)
+    for ntries in range(ntries_limit + 1):
+        xs[failed] = rstate.normal(loc[failed], scale[failed])
+        failed[failed] = num.logical_or(
+            xs[failed] < xmin[failed], xmax[failed] < xs[failed])
+
+        if not num.any(failed):
+            break
+
+    return xs, failed
+
+
+def truncated_multivariate_normal(
+        loc, scale, cov_factor, xbounds, rstate, ntries_limit):
+    '''
+    Draw from multivariate normal distributions truncated to parameter bounds.
+
+    Rows with any out-of-bounds value are redrawn until all rows are within
+    bounds or *ntries_limit* is exceeded.
+
+    :param loc: 2D array ``loc[isample, ipar]`` with the centers
+    :param scale: 1D array ``scale[isample]`` with scaling factors applied to
+        the standard deviations
+    :param cov_factor: 2D matrix ``L[ipar, ipar]`` with ``L L^T`` being the
+        covariance matrix, e.g. its Cholesky factor
+    :param xbounds: 2D array ``xbounds[ipar, 0:2]`` with parameter bounds
+    :param rstate: :py:class:`numpy.random.Generator` to draw from
+    :param ntries_limit: maximum number of redraws
+    :returns: tuple ``(xs, failed, ok_mask_sum)`` with the drawn values, a
+        boolean mask of rows for which no valid sample could be found and the
+        number of in-bounds draws per parameter accumulated over all rejected
+        rows
+    '''
+    nsamples, npar = loc.shape
+    xs = num.empty(loc.shape, dtype=num.float)
+    failed = num.ones(nsamples, dtype=num.bool)
+    ok_mask_sum = num.zeros(npar, dtype=num.int)
+    for ntries in range(ntries_limit + 1):
+        nfailed = num.sum(failed)
+        xs[failed, :] = loc[failed, :] + scale[failed, num.newaxis] \
+            * num.dot(rstate.standard_normal((nfailed, npar)), cov_factor.T)
+
+        ok_mask = num.logical_and(
+            xbounds[:, 0] <= xs[failed, :], xs[failed, :] <= xbounds[:, 1])
+
+        isok = num.all(ok_mask, axis=1)
+        ok_mask_sum += num.sum(ok_mask[~isok, :], axis=0)
+        failed[failed] = ~isok
+
+        if not num.any(failed):
+            break
+
+    return xs, failed, ok_mask_sum
+
+
 def local_std(xs):
     ssbx = num.sort(xs, axis=0)
     dssbx = num.diff(ssbx, axis=0)
@@ -64,10 +149,6 @@ class SamplerStartingPointChoice(StringChoice):
     choices = ['excentricity_compensated', 'random', 'mean']
 
 
-class BootstrapTypeChoice(StringChoice):
-    choices = ['bayesian', 'classic']
-
-
 class SamplerPhase(Object):
     niterations = Int.T(
         help='Number of iteration for this phase.')
@@ -75,40 +156,365 @@ class SamplerPhase(Object):
         default=1000,
         help='Tries to find a valid preconstrained sample.')
 
-    def get_raw_sample(self, problem, iiter, chains):
+    def get_raw_samples(self, problem, iiters, chains, rstate=None):
+        '''
+        Draw a batch of unconstrained candidate models.
+
+        :param iiters: 1D array with the phase iteration number of each
+            requested candidate
+        :param rstate: :py:class:`numpy.random.Generator` to draw from
+        :returns: 2D array ``xs[isample, iparameter]``
+        '''
         raise NotImplementedError
 
-    def get_sample(self, problem, iiter, chains):
-        assert 0 <= iiter < self.niterations
+    def get_raw_sample(self, problem, iiter, chains, rstate=None):
+        return self.get_raw_samples(
+            problem, num.array([iiter]), chains, rstate=rstate)[0, :]
+
+    def get_samples(self, problem, iiters, chains, rstate=None):
+        '''
+        Draw a batch of preconstrained candidate models.
+
+        :param iiters: 1D array with the phase iteration number of each
+            requested candidate
+        :param rstate: :py:class:`numpy.random.Generator` to draw from
+        :returns: 2D array ``xs[isample, iparameter]``
+        '''
+        iiters = num.asarray(iiters, dtype=num.int)
+        assert num.all((0 <= iiters) & (iiters < self.niterations))
+
+        if rstate is None:
+            rstate = num.random.default_rng()
+
+        xs = num.zeros((iiters.size, problem.nparameters), dtype=num.float)
+        todo = num.arange(iiters.size)
 
-        ntries_preconstrain = 0
         for ntries_preconstrain in range(self.ntries_preconstrain_limit):
-            try:
-                return problem.preconstrain(
-                    self.get_raw_sample(problem, iiter, chains))
+            xs_raw = self.get_raw_samples(
+                problem, iiters[todo], chains, rstate=rstate)
 
-            except Forbidden:
-                pass
+            forbidden = []
+            for isample, x in zip(todo, xs_raw):
+                try:
+                    xs[isample, :] = problem.preconstrain(x)
+
+                except Forbidden:
+                    forbidden.append(isample)
+
+            todo = num.array(forbidden, dtype=num.int)
+            if todo.size == 0:
+                return xs
 
         raise GrondError(
             'could not find any suitable candidate sample within %i tries' % (
                 self.ntries_preconstrain_limit))
 
+    def get_sample(self, problem, iiter, chains, rstate=None):
+        return self.get_samples(
+            problem, num.array([iiter]), chains, rstate=rstate)[0, :]
+
+    def check_convergence(self, chains, iiter_phase):
+        return None
+
+    def get_convergence_snapshots(self):
+        return []
+
+    def set_convergence_snapshots(self, snapshots):
+        pass
+
 
 class InjectionSamplerPhase(SamplerPhase):
     xs_inject = Array.T(
         dtype=num.float, shape=(None, None),
         help='Array with the reference model.')
 
-    def get_raw_sample(self, problem, iiter, chains):
-        return self.xs_inject[iiter, :]
+    def get_raw_samples(self, problem, iiters, chains, rstate=None):
+        return self.xs_inject[iiters, :]
 
 
 class UniformSamplerPhase(SamplerPhase):
 
-    def get_raw_sample(self, problem, iiter, chains):
+    def get_raw_samples(self, problem, iiters, chains, rstate=None):
         xbounds = problem.get_parameter_bounds()
-        return problem.random_uniform(xbounds)
+        return num.array([
+            problem.random_uniform(xbounds, rstate=rstate)
+            for _ in range(len(iiters))], dtype=num.float)
+
+
+class ConvergenceSnapshot(Object):
+    '''
+    State of the chains at one iteration of a convergence window.
+    '''
+    iphase = Int.T(
+        default=0,
+        help='Index of the sampler phase.')
+    iiter_phase = Int.T(
+        help='Iteration within the sampler phase.')
+    accept_sum = Array.T(
+        shape=(None,), dtype=num.int, serialize_as='list',
+        help='Number of models accepted into each chain.')
+    best_misfits = Array.T(
+        shape=(None,), dtype=num.float, serialize_as='list',
+        help='Best misfit of each chain.')
+    mean_model = Array.T(
+        shape=(None,), dtype=num.float, serialize_as='list',
+        help='Mean model of all chains.')
+
+
+class SamplerPhaseConvergence(Object):
+    '''
+    Convergence criterion to end a sampler phase early.
+
+    The criterion is met when all of the configured limits are undercut
+    over a sliding window of recent iterations.
+    '''
+    window = Int.T(
+        default=1000,
+        help='Number of iterations over which the chains are compared.')
+    acceptance_rate_limit = Float.T(
+        optional=True,
+        help='Converged if the fraction of new models accepted into the '
+             'chains, averaged over all chains, falls below this value.')
+    misfit_improvement_limit = Float.T(
+        optional=True,
+        help='Converged if the relative improvement of the best misfit, '
+             'averaged over all chains, falls below this value.')
+    mean_shift_limit = Float.T(
+        optional=True,
+        help='Converged if no parameter of the mean model of all chains '
+             'moves by more than this value, measured in standard '
+             'deviations of the models in all chains.')
+
+    def __init__(self, **kwargs):
+        Object.__init__(self, **kwargs)
+        self._snapshots = deque()
+
+    @property
+    def nstep(self):
+        return max(1, self.window // 10)
+
+    def get_snapshots(self):
+        return [
+            ConvergenceSnapshot(
+                iiter_phase=iiter_phase,
+                accept_sum=accept_sum,
+                best_misfits=best_misfits,
+                mean_model=mean_model)
+            for (iiter_phase, accept_sum, best_misfits, mean_model)
+            in self._snapshots]
+
+    def set_snapshots(self, snapshots):
+        self._snapshots = deque(
+            (s.iiter_phase, s.accept_sum, s.best_misfits, s.mean_model)
+            for s in snapshots)
+
+    def check(self, chains, iiter_phase):
+        '''
+        Update the window and check for convergence.
+
+        :returns: ``None`` or a string describing why the phase is
+            considered converged
+        '''
+        if iiter_phase == 0:
+            self._snapshots.clear()
+
+        if iiter_phase % self.nstep != 0:
+            return None
+
+        accept_sum = chains.accept_sum.copy()
+        best_misfits = chains.chains_m[:, 0].copy()
+        mean_model = chains.mean_model()
+
+        self._snapshots.append(
+            (iiter_phase, accept_sum, best_misfits, mean_model))
+
+        iiter_begin, accept_sum_begin, best_misfits_begin, \
+            mean_model_begin = self._snapshots[0]
+
+        if iiter_phase - iiter_begin < self.window:
+            return None
+
+        self._snapshots.popleft()
+
+        niter = iiter_phase - iiter_begin
+        reasons = []
+        if self.acceptance_rate_limit is not None:
+            acceptance_rate = num.mean(accept_sum - accept_sum_begin) / niter
+            if acceptance_rate >= self.acceptance_rate_limit:
+                return None
+
+            reasons.append('acceptance rate %g' % acceptance_rate)
+
+        if self.misfit_improvement_limit is not None:
+            misfit_begin = num.mean(best_misfits_begin)
+            if misfit_begin > 0.0:
+                improvement = 1.0 - num.mean(best_misfits) / misfit_begin
+            else:
+                # perfect fit at the beginning of the window, nothing left
+                # to improve
+                improvement = 0.0
+
+            if improvement >= self.misfit_improvement_limit:
+                return None
+
+            reasons.append('misfit improvement %g' % improvement)
+
+        if self.mean_shift_limit is not None:
+            std = chains.standard_deviation_models(
+                None, 'standard_deviation_all_chains')
+
+            inonflat = std != 0.0
+            shift = num.max(
+                num.abs(mean_model - mean_model_begin)[inonflat]
+                / std[inonflat], initial=0.0)
+
+            if shift >= self.mean_shift_limit:
+                return None
+
+            reasons.append('mean model shift %g' % shift)
+
+        if not reasons:
+            return None
+
+        return '%s within last %i iterations' % (', '.join(reasons), niter)
+
+
+class SurrogateScreening(Object):
+    '''
+    Surrogate model based pre-screening of candidate models.
+
+    A radial basis function interpolant of the bootstrap misfits is fitted
+    on the models evaluated so far. Candidates of directed sampler phases
+    for which the predicted misfits, reduced by the surrogate's expected
+    error, are higher than the worst link of every chain are dropped before
+    they are modelled and a new candidate is drawn instead.
+    '''
+    nmodels_min = Int.T(
+        default=1000,
+        help='Minimum number of evaluated models before screening starts.')
+    refit_interval = Int.T(
+        default=500,
+        help='Number of iterations after which the surrogate is refitted.')
+    nneighbors = Int.T(
+        default=50,
+        help='Number of nearest models used to interpolate the misfits.')
+    nvalidation = Int.T(
+        default=200,
+        help='Number of most recent models held back at each refit to '
+             'estimate the error of the surrogate.')
+    error_quantile = Float.T(
+        default=0.95,
+        help='Quantile of the surrogate\'s absolute misfit error used as '
+             'safety margin.')
+    nskip_limit = Int.T(
+        default=10,
+        help='Maximum number of candidates dropped in a row for a single '
+             'iteration. The last candidate drawn is evaluated anyway.')
+
+    def __init__(self, **kwargs):
+        Object.__init__(self, **kwargs)
+        self._nmodels_fit = None
+        self._interpolant = None
+        self._error = None
+        self._nscreened = 0
+        self._nskipped = 0
+
+    def _fit(self, problem, history, nmodels):
+        from scipy.interpolate import RBFInterpolator
+
+        xbounds = problem.get_parameter_bounds()
+        xs = (history.models[:nmodels] - xbounds[:, 0]) \
+            / (xbounds[:, 1] - xbounds[:, 0])
+
+        return RBFInterpolator(
+            xs, history.bootstrap_misfits[:nmodels],
+            neighbors=min(self.nneighbors, nmodels),
+            kernel='linear')
+
+    def _predict(self, problem, interpolant, xs):
+        xbounds = problem.get_parameter_bounds()
+        return interpolant(
+            (xs - xbounds[:, 0]) / (xbounds[:, 1] - xbounds[:, 0]))
+
+    def update(self, problem, history):
+        '''
+        Refit the surrogate if ``refit_interval`` models have been added.
+
+        The surrogate is fitted on the first ``k * refit_interval`` models
+        of the history, so that it does not depend on when it is refitted.
+        '''
+        nmodels = (history.nmodels // self.refit_interval) \
+            * self.refit_interval
+
+        if nmodels < max(self.nmodels_min, self.nvalidation + 1) \
+                or nmodels == self._nmodels_fit:
+            return
+
+        nfit = nmodels - self.nvalidation
+        try:
+            misfits_predicted = self._predict(
+                problem,
+                self._fit(problem, history, nfit),
+                history.models[nfit:nmodels])
+
+            interpolant = self._fit(problem, history, nmodels)
+
+        except num.linalg.LinAlgError as e:
+            logger.warning(
+                'surrogate fit failed, screening disabled until the next '
+                'refit: %s' % e)
+
+            self._interpolant = None
+            self._nmodels_fit = nmodels
+            return
+
+        errors = num.abs(
+            misfits_predicted - history.bootstrap_misfits[nfit:nmodels])
+
+        if self._nmodels_fit is not None and self._nscreened != 0:
+            logger.info(
+                'surrogate dropped %i of %i screened candidates (%.1f%%) '
+                'since the last refit' % (
+                    self._nskipped, self._nscreened,
+                    100. * self._nskipped / self._nscreened))
+
+        logger.info(
+            'surrogate refitted on %i models, held back %i models: absolute '
+            'misfit error median %g, %g-quantile %g' % (
+                nmodels, self.nvalidation,
+                num.nanmedian(errors),
+                self.error_quantile,
+                num.nanquantile(errors, self.error_quantile)))
+
+        self._interpolant = interpolant
+        self._error = num.nanquantile(errors, self.error_quantile, axis=0)
+        self._nmodels_fit = nmodels
+        self._nscreened = 0
+        self._nskipped = 0
+
+    def screen(self, problem, history, chains, xs):
+        '''
+        Check which candidates are unlikely to enter any chain.
+
+        :param xs: 2D array ``xs[isample, iparameter]`` with candidates
+        :returns: boolean mask of candidates to be dropped
+        '''
+        skip = num.zeros(xs.shape[0], dtype=num.bool)
+        self.update(problem, history)
+        if self._interpolant is None \
+                or chains.nlinks < chains.nlinks_cap - 1 \
+                or xs.shape[0] == 0:
+            return skip
+
+        misfits_worst = chains.chains_m[:, chains.nlinks-1]
+        misfits_predicted = self._predict(problem, self._interpolant, xs)
+
+        skip = num.all(
+            misfits_predicted - self._error > misfits_worst, axis=1)
+
+        self._nscreened += skip.size
+        self._nskipped += num.sum(skip)
+        return skip
 
 
 class DirectedSamplerPhase(SamplerPhase):
@@ -136,6 +542,27 @@ class DirectedSamplerPhase(SamplerPhase):
 
     ntries_sample_limit = Int.T(default=1000)
 
+    convergence = SamplerPhaseConvergence.T(
+        optional=True,
+        help='If set, the phase ends as soon as the convergence criterion '
+             'is met.')
+
+    def check_convergence(self, chains, iiter_phase):
+        if self.convergence is None:
+            return None
+
+        return self.convergence.check(chains, iiter_phase)
+
+    def get_convergence_snapshots(self):
+        if self.convergence is None:
+            return []
+
+        return self.convergence.get_snapshots()
+
+    def set_convergence_snapshots(self, snapshots):
+        if self.convergence is not None:
+            self.convergence.set_snapshots(snapshots)
+
     def get_scatter_scale_factor(self, iiter):
         s = self.scatter_scale
         sa = self.scatter_scale_begin
@@ -147,133 +574,97 @@ class DirectedSamplerPhase(SamplerPhase):
             tb = float(self.niterations-1)
             tau = tb/(math.log(sa) - math.log(sb))
             t0 = math.log(sa) * tau
-            t = float(iiter)
+            t = num.asarray(iiter, dtype=num.float)
             return num.exp(-(t-t0) / tau)
 
         else:
             return s or 1.0
 
-    def get_raw_sample(self, problem, iiter, chains):
+    def get_raw_samples(self, problem, iiters, chains, rstate=None):
+
+        if rstate is None:
+            rstate = num.random.default_rng()
+
+        nsamples = len(iiters)
+        factors = self.get_scatter_scale_factor(iiters) \
+            * num.ones(nsamples, dtype=num.float)
 
-        factor = self.get_scatter_scale_factor(iiter)
-        npar = problem.nparameters
         pnames = problem.parameter_names
         xbounds = problem.get_parameter_bounds()
 
         ichain_choice = num.argmin(chains.accept_sum)
 
         if self.starting_point == 'excentricity_compensated':
-            models = chains.models(ichain_choice)
-            ilink_choice = excentricity_compensated_choice(
-                models,
-                chains.standard_deviation_models(
-                    ichain_choice, self.standard_deviation_estimator),
-                2.)
+            ilink_choices = chains.excentricity_compensated_choice(
+                ichain_choice, self.standard_deviation_estimator, 2.,
+                rstate=rstate, size=nsamples)
 
-            xchoice = chains.model(ichain_choice, ilink_choice)
+            xchoices = chains.models(ichain_choice)[ilink_choices, :]
 
         elif self.starting_point == 'random':
-            ilink_choice = num.random.randint(0, chains.nlinks)
-            xchoice = chains.model(ichain_choice, ilink_choice)
+            ilink_choices = rstate.integers(0, chains.nlinks, size=nsamples)
+            xchoices = chains.models(ichain_choice)[ilink_choices, :]
 
         elif self.starting_point == 'mean':
-            xchoice = chains.mean_model(ichain_choice)
+            xchoices = num.tile(
+                chains.mean_model(ichain_choice), (nsamples, 1))
 
         else:
             assert False, 'invalid starting_point choice: %s' % (
                 self.starting_point)
 
-        ntries_sample = 0
         if self.sampler_distribution == 'normal':
-            x = num.zeros(npar, dtype=num.float)
             sx = chains.standard_deviation_models(
                 ichain_choice, self.standard_deviation_estimator)
 
-            for ipar in range(npar):
-                ntries = 0
-                while True:
-                    if sx[ipar] > 0.:
-                        v = num.random.normal(
-                            xchoice[ipar],
-                            factor*sx[ipar])
-                    else:
-                        v = xchoice[ipar]
+            xs, failed = truncated_normal(
+                xchoices,
+                factors[:, num.newaxis] * sx[num.newaxis, :],
+                xbounds,
+                rstate=rstate,
+                ntries_limit=self.ntries_sample_limit)
 
-                    if xbounds[ipar, 0] <= v and \
-                            v <= xbounds[ipar, 1]:
-
-                        break
-
-                    if ntries > self.ntries_sample_limit:
-                        logger.warning(
-                            'failed to produce a suitable '
-                            'candidate sample from normal '
-                            'distribution for parameter \'%s\''
-                            '- drawing from uniform instead.' %
-                            pnames[ipar])
-                        v = num.random.uniform(xbounds[ipar, 0],
-                                               xbounds[ipar, 1])
-                        break
-
-                    ntries += 1
+            if num.any(failed):
+                for ipar in num.where(num.any(failed, axis=0))[0]:
+                    logger.warning(
+                        'failed to produce a suitable '
+                        'candidate sample from normal '
+                        'distribution for parameter \'%s\''
+                        '- drawing from uniform instead.' %
+                        pnames[ipar])
 
-                x[ipar] = v
+                xs[failed] = rstate.uniform(
+                    num.broadcast_to(xbounds[:, 0], xs.shape)[failed],
+                    num.broadcast_to(xbounds[:, 1], xs.shape)[failed])
 
         elif self.sampler_distribution == 'multivariate_normal':
-            ok_mask_sum = num.zeros(npar, dtype=num.int)
-            while True:
-                ntries_sample += 1
-                xcandi = num.random.multivariate_normal(
-                    xchoice, factor**2 * chains.cov(ichain_choice))
+            xs, failed, ok_mask_sum = truncated_multivariate_normal(
+                xchoices,
+                factors,
+                chains.covariance_factor_models(ichain_choice),
+                xbounds,
+                rstate=rstate,
+                ntries_limit=self.ntries_sample_limit)
 
-                ok_mask = num.logical_and(
-                    xbounds[:, 0] <= xcandi, xcandi <= xbounds[:, 1])
+            if num.any(failed):
+                logger.warning(
+                    'failed to produce a suitable candidate '
+                    'sample from multivariate normal '
+                    'distribution, (%s) - drawing from uniform instead' %
+                    ', '.join('%s:%i' % xx for xx in
+                              zip(pnames, ok_mask_sum)))
 
-                if num.all(ok_mask):
-                    break
+                for isample in num.where(failed)[0]:
+                    xs[isample, :] = problem.random_uniform(
+                        xbounds, rstate=rstate)
 
-                ok_mask_sum += ok_mask
+        return xs
 
-                if ntries_sample > self.ntries_sample_limit:
-                    logger.warning(
-                        'failed to produce a suitable candidate '
-                        'sample from multivariate normal '
-                        'distribution, (%s) - drawing from uniform instead' %
-                        ', '.join('%s:%i' % xx for xx in
-                                  zip(pnames, ok_mask_sum)))
-                    xbounds = problem.get_parameter_bounds()
-                    xcandi = problem.random_uniform(xbounds)
-                    break
 
-            x = xcandi
-
-        return x
-
-
-def make_bayesian_weights(nbootstrap, nmisfits,
-                          type='bayesian', rstate=None):
-    ws = num.zeros((nbootstrap, nmisfits))
-    if rstate is None:
-        rstate = num.random.RandomState()
-
-    for ibootstrap in range(nbootstrap):
-        if type == 'classic':
-            ii = rstate.randint(0, nmisfits, size=nmisfits)
-            ws[ibootstrap, :] = num.histogram(
-                ii, nmisfits, (-0.5, nmisfits - 0.5))[0]
-        elif type == 'bayesian':
-            f = rstate.uniform(0., 1., size=nmisfits+1)
-            f[0] = 0.
-            f[-1] = 1.
-            f = num.sort(f)
-            g = f[1:] - f[:-1]
-            ws[ibootstrap, :] = g * nmisfits
-        else:
-            assert False
-    return ws
+class Chains(object):
 
+    nblock_max = 256
 
-class Chains(object):
     def __init__(
             self, problem, history, nchains, nlinks_cap):
 
@@ -288,6 +679,9 @@ class Chains(object):
         self.nlinks = 0
         self.accept_sum = num.zeros(self.nchains, dtype=num.int)
         self.nread = 0
+        self._probabilities_cache = {}
+        self._moments = None
+        self._covariance_factor_cache = {}
         history.add_listener(self)
 
     def goto(self, n=None):
@@ -299,30 +693,129 @@ class Chains(object):
         assert self.nread <= n
 
         while self.nread < n:
-            gbms = self.history.bootstrap_misfits[self.nread, :]
-
-            self.chains_m[:, self.nlinks] = gbms
-            self.chains_i[:, self.nlinks] = n-1
-            nbootstrap = self.chains_m.shape[0]
-
-            self.nlinks += 1
-            chains_m = self.chains_m
-            chains_i = self.chains_i
-
-            for ichain in range(nbootstrap):
-                isort = num.argsort(chains_m[ichain, :self.nlinks])
-                chains_m[ichain, :self.nlinks] = chains_m[ichain, isort]
-                chains_i[ichain, :self.nlinks] = chains_i[ichain, isort]
-
-            if self.nlinks == self.nlinks_cap:
-                accept = (
-                    chains_i[:, self.nlinks_cap-1] != n-1).astype(num.int)
-                self.nlinks -= 1
-            else:
-                accept = num.ones(self.nchains, dtype=num.int)
-
-            self.accept_sum += accept
-            self.nread += 1
+            nblock = min(n - self.nread, self.nblock_max)
+            self.insert(
+                self.history.bootstrap_misfits[
+                    self.nread:self.nread+nblock, :].T)
+
+    def insert(self, block_m):
+        '''
+        Insert a block of consecutive models into the chains.
+
+        :param block_m: 2D array ``block_m[ichain, imodel]`` with the
+            bootstrap misfits of the models following the ones already read
+
+        The chains and acceptance counts are the same as if the models were
+        inserted one after another: each chain keeps the ``nlinks_cap - 1``
+        best models, ties are resolved in favour of older models.
+        '''
+        nchains, nblock = block_m.shape
+        nlinks = self.nlinks
+        nlinks_max = self.nlinks_cap - 1
+        ichains = num.arange(nchains)[:, num.newaxis]
+
+        nread = self.nread
+        self.nread += nblock
+
+        block_i = num.broadcast_to(
+            num.arange(nread, nread + nblock), (nchains, nblock))
+
+        if nlinks == nlinks_max:
+            # only models better than the worst link of a full chain can
+            # enter it, all others are left out of the merge
+            candidate = block_m < self.chains_m[:, nlinks-1, num.newaxis]
+            ncandidates = num.sum(candidate, axis=1)
+            nblock = num.max(ncandidates)
+            if nblock == 0:
+                return
+
+            icandidates = num.argsort(
+                ~candidate, axis=1, kind='stable')[:, :nblock]
+
+            candidate = num.take_along_axis(candidate, icandidates, axis=1)
+            block_m = num.where(
+                candidate,
+                num.take_along_axis(block_m, icandidates, axis=1),
+                num.inf)
+            block_i = num.take_along_axis(block_i, icandidates, axis=1)
+
+        merged_m = num.hstack((self.chains_m[:, :nlinks], block_m))
+        merged_i = num.hstack((self.chains_i[:, :nlinks], block_i))
+        isort = num.argsort(merged_m, axis=1, kind='stable')
+
+        # a new model enters a chain if less than nlinks_max models read
+        # before it have a misfit lower than or equal to its own
+        ipos = num.empty_like(isort)
+        ipos[ichains, isort] = num.arange(nlinks + nblock)
+        isort_block = num.argsort(block_m, axis=1, kind='stable')
+        irank_block = num.empty_like(isort_block)
+        irank_block[ichains, isort_block] = num.arange(nblock)
+        nbetter_chain = ipos[:, nlinks:] - irank_block
+
+        nbetter_block = num.sum(
+            num.logical_and(
+                block_m[:, :, num.newaxis] <= block_m[:, num.newaxis, :],
+                num.tri(nblock, k=-1, dtype=num.bool).T[num.newaxis, :, :]),
+            axis=1)
+
+        accept = (nbetter_chain + nbetter_block) < nlinks_max
+
+        self.nlinks = min(nlinks + nblock, nlinks_max)
+        isort = isort[:, :self.nlinks]
+
+        if self._moments is not None:
+            self._update_moments(merged_i, isort, nlinks)
+
+        self.chains_m[:, :self.nlinks] = num.take_along_axis(
+            merged_m, isort, axis=1)
+        self.chains_i[:, :self.nlinks] = num.take_along_axis(
+            merged_i, isort, axis=1)
+
+        self.accept_sum += num.sum(accept, axis=1)
+
+    def _init_moments(self, ichains=None):
+        if self._moments is None:
+            xs = self.models()
+            x0 = num.mean(xs, axis=0)
+            npar = xs.shape[1]
+            self._moments = dict(
+                x0=x0,
+                s1=num.zeros((self.nchains, npar)),
+                s2=num.zeros((self.nchains, npar, npar)),
+                nupdates=num.zeros(self.nchains, dtype=num.int))
+
+        mo = self._moments
+        if ichains is None:
+            ichains = num.arange(self.nchains)
+
+        for ichain in ichains:
+            dxs = self.models(ichain) - mo['x0']
+            mo['s1'][ichain] = num.sum(dxs, axis=0)
+            mo['s2'][ichain] = num.dot(dxs.T, dxs)
+            mo['nupdates'][ichain] = 0
+
+    def _update_moments(self, merged_i, isort, nlinks_old):
+        # add the models which entered the chains, remove the evicted ones
+        nchains, nmerged = merged_i.shape
+        weights = num.zeros((nchains, nmerged), dtype=num.int)
+        weights[:, :nlinks_old] = -1
+        weights[num.arange(nchains)[:, num.newaxis], isort] += 1
+
+        ichains, imerged = num.nonzero(weights)
+        if ichains.size == 0:
+            return
+
+        mo = self._moments
+        ws = weights[ichains, imerged].astype(num.float)
+        dxs = self.history.models[merged_i[ichains, imerged], :] - mo['x0']
+
+        num.add.at(mo['s1'], ichains, ws[:, num.newaxis] * dxs)
+        num.add.at(
+            mo['s2'], ichains,
+            ws[:, num.newaxis, num.newaxis]
+            * dxs[:, :, num.newaxis] * dxs[:, num.newaxis, :])
+
+        num.add.at(mo['nupdates'], ichains, 1)
 
     def append(self, iiter, model, misfits):
         self.goto(iiter)
@@ -374,97 +867,150 @@ class Chains(object):
             assert False, 'invalid standard_deviation_estimator choice'
 
     def covariance_models(self, ichain):
-        xs = self.models(ichain)
-        return num.cov(xs.T)
-
-
-class HighScoreOptimiser(Optimiser):
-    '''Monte-Carlo-based directed search optimisation with bootstrap.'''
-
-    sampler_phases = List.T(SamplerPhase.T())
-    chain_length_factor = Float.T(default=8.)
-    nbootstrap = Int.T(default=100)
-    bootstrap_type = BootstrapTypeChoice.T(default='bayesian')
-    bootstrap_seed = Int.T(default=23)
-
-    def __init__(self, **kwargs):
-        Optimiser.__init__(self, **kwargs)
-        self._bootstrap_weights = None
-        self._bootstrap_residuals = None
-        self._status_chains = None
-        self.rstate = num.random.RandomState(self.bootstrap_seed)
-
-    def init_bootstraps(self, problem):
-        self.init_bootstrap_weights(problem)
-        self.init_bootstrap_residuals(problem)
-
-    def init_bootstrap_weights(self, problem):
-        logger.info('Initializing Bayesian bootstrap weights')
-        bootstrap_targets = set([t for t in problem.targets
-                                 if t.can_bootstrap_weights])
-
-        ws = make_bayesian_weights(
-            self.nbootstrap,
-            nmisfits=problem.nmisfits,
-            rstate=self.rstate)
-
-        imf = 0
-        for it, t in enumerate(bootstrap_targets):
-            t.set_bootstrap_weights(ws[:, imf:imf+t.nmisfits])
-            imf += t.nmisfits
-
-        for t in set(problem.targets) - bootstrap_targets:
-            t.set_bootstrap_weights(
-                num.ones((self.nbootstrap, t.nmisfits)))
+        '''
+        Get the covariance matrix of the models in a chain.
+
+        Running sums of the links are updated on insertion into the chains,
+        so that the covariance is not recomputed from all links on every
+        call. To limit the accumulation of rounding errors, the sums of a
+        chain are recomputed after it has changed ``8 * nlinks_cap`` times.
+        '''
+        if self._moments is None:
+            self._init_moments()
+
+        mo = self._moments
+        if mo['nupdates'][ichain] > 8 * self.nlinks_cap:
+            self._init_moments([ichain])
+
+        n = self.nlinks
+        s1 = mo['s1'][ichain]
+        return (mo['s2'][ichain] - num.outer(s1, s1) / n) / (n - 1)
+
+    def covariance_factor_models(self, ichain):
+        '''
+        Get a matrix ``L`` with ``L L^T`` equal to the chain's covariance.
+
+        The Cholesky factor is used if the covariance matrix is positive
+        definite, otherwise a factor is derived from its eigendecomposition.
+        The factor is cached until the chain changes.
+        '''
+        version = self.accept_sum[ichain]
+        if ichain in self._covariance_factor_cache:
+            version_cached, factor = self._covariance_factor_cache[ichain]
+            if version_cached == version:
+                return factor
+
+        cov = self.covariance_models(ichain)
+        try:
+            factor = num.linalg.cholesky(cov)
+        except num.linalg.LinAlgError:
+            w, v = num.linalg.eigh(cov)
+            factor = v * num.sqrt(num.maximum(w, 0.0))
+
+        self._covariance_factor_cache[ichain] = version, factor
+        return factor
+
+    def excentricity_compensated_probabilities(
+            self, ichain, estimator, factor):
+        '''
+        Get excentricity compensated link probabilities of a chain.
+
+        The result is cached per chain and only recomputed after the chain
+        (or, for estimators depending on all chains, any chain) has changed.
+        '''
+        if estimator == 'standard_deviation_all_chains':
+            version = num.sum(self.accept_sum)
+        else:
+            version = self.accept_sum[ichain]
 
-    def init_bootstrap_residuals(self, problem):
-        logger.info('Initializing Bayesian bootstrap residuals')
-        residual_targets = set([t for t in problem.targets
-                                if t.can_bootstrap_residuals])
+        key = (ichain, estimator, factor)
+        if key in self._probabilities_cache:
+            version_cached, probabilities = self._probabilities_cache[key]
+            if version_cached == version:
+                return probabilities
 
-        for t in residual_targets:
-            t.init_bootstrap_residuals(self.nbootstrap, rstate=self.rstate)
+        probabilities = excentricity_compensated_probabilities(
+            self.models(ichain),
+            self.standard_deviation_models(ichain, estimator),
+            factor)
 
-        for t in set(problem.targets) - residual_targets:
-            t.set_bootstrap_residuals(num.zeros((self.nbootstrap, t.nmisfits)))
+        self._probabilities_cache[key] = version, probabilities
+        return probabilities
 
-    def get_bootstrap_weights(self, problem):
-        if self._bootstrap_weights is None:
-            try:
-                problem.targets[0].get_bootstrap_weights()
-            except Exception:
-                self.init_bootstraps(problem)
+    def excentricity_compensated_choice(
+            self, ichain, estimator, factor, rstate=None, size=None):
 
-            bootstrap_weights = num.hstack(
-                [t.get_bootstrap_weights()
-                 for t in problem.targets])
+        probabilities = self.excentricity_compensated_probabilities(
+            ichain, estimator, factor)
 
-            self._bootstrap_weights = num.vstack((
-                num.ones((1, problem.nmisfits)),
-                bootstrap_weights))
+        if rstate is None:
+            rstate = num.random
 
-        return self._bootstrap_weights
+        r = rstate.random(size)
+        ilink = num.searchsorted(num.cumsum(probabilities), r)
+        return num.minimum(ilink, self.nlinks-1)
 
-    def get_bootstrap_residuals(self, problem):
-        if self._bootstrap_residuals is None:
-            try:
-                problem.targets[0].get_bootstrap_residuals()
-            except Exception:
-                self.init_bootstraps(problem)
 
-            bootstrap_residuals = num.hstack(
-                [t.get_bootstrap_residuals()
-                 for t in problem.targets])
+class SamplerPhaseStop(Object):
+    '''
+    Record of a sampler phase which has been ended early.
+    '''
+    iphase = Int.T(
+        help='Index of the sampler phase.')
+    niterations = Int.T(
+        help='Number of iterations done in the phase.')
+    reason = String.T(
+        help='Why the phase has been ended.')
+
+
+class InflightCandidate(Object):
+    '''
+    Candidate model which has been drawn but is not yet in the history.
+    '''
+    x = Array.T(
+        shape=(None,), dtype=num.float, serialize_as='list',
+        help='Model parameters.')
+    mask = Array.T(
+        shape=(None,), dtype=bool, serialize_as='list', optional=True,
+        help='Residuals to be evaluated, ``None`` for all.')
+
+
+class HighScoreOptimiserState(Object):
+    '''
+    Checkpoint of a running optimisation, used to resume it.
+    '''
+    nmodels = Int.T(
+        help='Number of models in the rundir when the checkpoint was taken.')
+    sampler_rstate = String.T(
+        help='JSON encoded state of the sampler\'s random number generator.')
+    phase_stops = List.T(
+        SamplerPhaseStop.T(),
+        help='Sampler phases which have been ended early.')
+    inflight = List.T(
+        InflightCandidate.T(),
+        help='Candidates following the last stored model, which have been '
+             'drawn before the checkpoint was taken.')
+    convergence_snapshots = List.T(
+        ConvergenceSnapshot.T(),
+        help='Current windows of the sampler phase convergence checks.')
+
+
+class HighScoreOptimiser(BootstrapOptimiser):
+    '''Monte-Carlo-based directed search optimisation with bootstrap.'''
 
-            self._bootstrap_residuals = num.vstack((
-                num.zeros((1, problem.nmisfits)),
-                bootstrap_residuals))
+    checkpoint_interval = 10.
 
-        return self._bootstrap_residuals
+    sampler_phases = List.T(SamplerPhase.T())
+    chain_length_factor = Float.T(default=8.)
+    sampler_seed = Int.T(optional=True)
+    ncandidates_inflight = Int.T(optional=True)
+    surrogate = SurrogateScreening.T(optional=True)
 
-    @property
-    def nchains(self):
-        return self.nbootstrap + 1
+    def __init__(self, **kwargs):
+        BootstrapOptimiser.__init__(self, **kwargs)
+        self._status_chains = None
+        self.sampler_rstate = num.random.default_rng(self.sampler_seed)
+        self._phase_stops = []
 
     def chains(self, problem, history):
         nlinks_cap = int(round(
@@ -474,16 +1020,58 @@ class HighScoreOptimiser(Optimiser):
             problem, history,
             nchains=self.nchains, nlinks_cap=nlinks_cap)
 
+    def get_phase_niterations(self):
+        '''
+        Get the number of iterations of each sampler phase.
+
+        Phases which have been ended early are accounted with the number of
+        iterations actually done.
+        '''
+        niterations = [phase.niterations for phase in self.sampler_phases]
+        for stop in self._phase_stops:
+            niterations[stop.iphase] = stop.niterations
+
+        return niterations
+
     def get_sampler_phase(self, iiter):
         niter = 0
-        for phase in self.sampler_phases:
-            if iiter < niter + phase.niterations:
+        for phase, niter_phase in zip(
+                self.sampler_phases, self.get_phase_niterations()):
+
+            if iiter < niter + niter_phase:
                 return phase, iiter - niter
 
-            niter += phase.niterations
+            niter += niter_phase
 
         assert False, 'sample out of bounds'
 
+    def is_sampler_phase_stopped(self, phase):
+        iphase = self.sampler_phases.index(phase)
+        return any(stop.iphase == iphase for stop in self._phase_stops)
+
+    def stop_sampler_phase(self, iiter, iiter_end, reason):
+        '''
+        End the sampler phase of iteration *iiter* at iteration *iiter_end*.
+
+        The phase is not shortened beyond its configured number of
+        iterations and each phase is stopped at most once.
+        '''
+        phase, iiter_phase = self.get_sampler_phase(iiter)
+        if self.is_sampler_phase_stopped(phase):
+            return
+
+        iphase = self.sampler_phases.index(phase)
+        niterations = min(
+            iiter_phase + iiter_end - iiter, phase.niterations)
+
+        logger.info(
+            'ending %s after %i/%i iterations: %s' % (
+                phase.__class__.__name__, niterations, phase.niterations,
+                reason))
+
+        self._phase_stops.append(SamplerPhaseStop(
+            iphase=iphase, niterations=niterations, reason=reason))
+
     def log_progress(self, problem, iiter, niter, phase, iiter_phase):
         t = time.time()
         if self._tlog_last < t - 10. \
@@ -498,66 +1086,249 @@ class HighScoreOptimiser(Optimiser):
 
             self._tlog_last = t
 
-    def optimise(self, problem, rundir=None):
+    def get_samples(self, problem, chains, iiter_begin, iiter_end):
+        '''
+        Draw candidates for the iterations ``iiter_begin:iiter_end``.
 
-        if rundir is not None:
-            self.dump(filename=op.join(rundir, 'optimiser.yaml'))
+        The range may span several sampler phases.
+        '''
+        xs = [num.zeros((0, problem.nparameters))]
+        niter = 0
+        for phase, niter_phase in zip(
+                self.sampler_phases, self.get_phase_niterations()):
+
+            ia = max(iiter_begin, niter)
+            ib = min(iiter_end, niter + niter_phase)
+            if ia < ib:
+                xs.append(phase.get_samples(
+                    problem, num.arange(ia, ib) - niter, chains,
+                    rstate=self.sampler_rstate))
+
+            niter += niter_phase
+
+        return num.vstack(xs)
+
+    def get_screened_samples(
+            self, problem, history, chains, iiter_begin, iiter_end):
+        '''
+        Draw candidates and redraw those rejected by the surrogate.
+
+        Only candidates of directed sampler phases are screened.
+        '''
+        xs = self.get_samples(problem, chains, iiter_begin, iiter_end)
+        if self.surrogate is None:
+            return xs
+
+        phases = [
+            self.get_sampler_phase(iiter)
+            for iiter in range(iiter_begin, iiter_end)]
+
+        todo = num.array([
+            isample for (isample, (phase, _)) in enumerate(phases)
+            if isinstance(phase, DirectedSamplerPhase)], dtype=num.int)
+
+        for iskip in range(self.surrogate.nskip_limit):
+            skip = self.surrogate.screen(problem, history, chains, xs[todo])
+            todo = todo[skip]
+            if todo.size == 0:
+                break
+
+            for isample in todo:
+                phase, iiter_phase = phases[isample]
+                xs[isample, :] = phase.get_sample(
+                    problem, iiter_phase, chains, rstate=self.sampler_rstate)
+
+        return xs
+
+    def get_ncandidates_inflight(self):
+        if self.ncandidates_inflight is None:
+            return self.nprocs
+
+        return max(1, self.ncandidates_inflight)
+
+    def dump_state(self, rundir, history, inflight=()):
+        state = HighScoreOptimiserState(
+            nmodels=history.nmodels,
+            sampler_rstate=json.dumps(
+                self.sampler_rstate.bit_generator.state),
+            phase_stops=self._phase_stops,
+            inflight=[
+                InflightCandidate(x=x, mask=mask)
+                for (x, mask, _) in inflight],
+            convergence_snapshots=self.get_convergence_snapshots())
+
+        fn = op.join(rundir, 'optimiser_state.yaml')
+        state.dump(filename=fn + '.tmp')
+        os.rename(fn + '.tmp', fn)
+        self._tcheckpoint_last = time.time()
+
+    def get_convergence_snapshots(self):
+        snapshots = []
+        for iphase, phase in enumerate(self.sampler_phases):
+            for snapshot in phase.get_convergence_snapshots():
+                snapshot.iphase = iphase
+                snapshots.append(snapshot)
+
+        return snapshots
+
+    def set_convergence_snapshots(self, snapshots):
+        for iphase, phase in enumerate(self.sampler_phases):
+            phase.set_convergence_snapshots(
+                [s for s in snapshots if s.iphase == iphase])
+
+    def load_state(self, rundir):
+        fn = op.join(rundir, 'optimiser_state.yaml')
+        if not op.exists(fn):
+            return None
+
+        state = guts.load(filename=fn)
+        self._phase_stops = list(state.phase_stops)
+        return state
+
+    def resume_history(self, problem, rundir):
+        '''
+        Reopen the model history of an interrupted run for appending.
+
+        Models written after the last checkpoint are discarded and the state
+        of the sampler's random number generator is restored from the
+        checkpoint.
+
+        :returns: ``(history, inflight)``, where ``inflight`` is the list
+            of candidates which had been drawn, but not stored, at the time
+            of the checkpoint.
+        '''
+        state = self.load_state(rundir)
+        if state is not None:
+            truncate_problem_data(
+                rundir, problem, state.nmodels, nchains=self.nchains)
+
+            self.sampler_rstate.bit_generator.state = json.loads(
+                state.sampler_rstate)
+
+        history = ModelHistory(
+            problem, nchains=self.nchains, path=rundir, mode='a')
+
+        if state is None:
+            logger.warning(
+                'no optimiser checkpoint found in rundir %s, continuing '
+                'with a newly seeded sampler' % rundir)
+
+            self.sampler_rstate = num.random.default_rng(
+                None if self.sampler_seed is None
+                else (self.sampler_seed, history.nmodels))
+
+        logger.info('resuming problem %s at iteration %i' % (
+            problem.name, history.nmodels))
+
+        inflight = []
+        if state is not None and state.nmodels == history.nmodels:
+            inflight = [(c.x, c.mask) for c in state.inflight]
+            self.set_convergence_snapshots(state.convergence_snapshots)
+
+        return history, inflight
+
+    def optimise(self, problem, rundir=None, resume=False):
+        '''
+        Run the optimisation.
+
+        Up to :py:meth:`get_ncandidates_inflight` candidates are evaluated
+        concurrently on ``nprocs`` worker processes. Results are fed into
+        the model history and the chains strictly in iteration order. The
+        candidate for iteration ``i`` is drawn from chains which have seen
+        all models up to iteration ``i - ncandidates_inflight``, i.e. the
+        chains lag behind by at most ``ncandidates_inflight - 1`` models.
+        With a single candidate in flight, the optimisation is sequential.
+
+        If *resume* is ``True``, the models found in *rundir* are reloaded,
+        the chains are rebuilt from them and the optimisation continues at
+        the last checkpoint, appending to the existing files. Candidates
+        which were in flight at the checkpoint are stored with it and are
+        evaluated again, so that the resumed run draws the same models as an
+        uninterrupted one.
+        '''
+
+        inflight_resumed = []
+        if resume:
+            history, inflight_resumed = self.resume_history(problem, rundir)
+
+        else:
+            if rundir is not None:
+                self.dump(filename=op.join(rundir, 'optimiser.yaml'))
+
+            history = ModelHistory(problem,
+                                   nchains=self.nchains,
+                                   path=rundir, mode='w')
 
-        history = ModelHistory(problem,
-                               nchains=self.nchains,
-                               path=rundir, mode='w')
         chains = self.chains(problem, history)
+        chains.goto()
 
-        niter = self.niterations
+        ninflight = self.get_ncandidates_inflight()
         isbad_mask = None
+        if history.nmodels != 0:
+            isbad_mask = num.isnan(history.misfits[-1, :, 0])
+
         self._tlog_last = 0
-        for iiter in range(niter):
-            phase, iiter_phase = self.get_sampler_phase(iiter)
-            self.log_progress(problem, iiter, niter, phase, iiter_phase)
+        self._tcheckpoint_last = time.time()
 
-            x = phase.get_sample(problem, iiter_phase, chains)
+        inflight = deque()
+        iiter_next = history.nmodels
 
-            if isbad_mask is not None and num.any(isbad_mask):
-                isok_mask = num.logical_not(isbad_mask)
-            else:
-                isok_mask = None
+        with MisfitEvaluator(problem, nprocs=self.nprocs) as evaluator:
+            for x, mask in inflight_resumed:
+                inflight.append((x, mask, evaluator.submit(x, mask=mask)))
+                iiter_next += 1
+
+            iiter = history.nmodels
+            while iiter < self.niterations:
+                niter = self.niterations
+                phase, iiter_phase = self.get_sampler_phase(iiter)
+                self.log_progress(problem, iiter, niter, phase, iiter_phase)
 
-            misfits = problem.misfits(x, mask=isok_mask)
-            bootstrap_misfits = problem.combine_misfits(
-                misfits,
-                extra_weights=self.get_bootstrap_weights(problem),
-                extra_residuals=self.get_bootstrap_residuals(problem))
+                if isbad_mask is not None and num.any(isbad_mask):
+                    isok_mask = num.logical_not(isbad_mask)
+                else:
+                    isok_mask = None
 
-            isbad_mask_new = num.isnan(misfits[:, 0])
-            if isbad_mask is not None and num.any(
-                    isbad_mask != isbad_mask_new):
+                iiter_end = min(iiter + ninflight, niter)
+                for x in self.get_screened_samples(
+                        problem, history, chains, iiter_next, iiter_end):
 
-                errmess = [
-                    'problem %s: inconsistency in data availability'
-                    ' at iteration %i' %
-                    (problem.name, iiter)]
+                    inflight.append(
+                        (x, isok_mask, evaluator.submit(x, mask=isok_mask)))
 
-                for target, isbad_new, isbad in zip(
-                        problem.targets, isbad_mask_new, isbad_mask):
+                iiter_next = max(iiter_next, iiter_end)
 
-                    if isbad_new != isbad:
-                        errmess.append('  %s, %s -> %s' % (
-                            target.string_id(), isbad, isbad_new))
+                x, _, result = inflight.popleft()
+                misfits = result.get()
+                self.process_result(
+                    problem, history, iiter, x, misfits, isbad_mask)
 
-                raise BadProblem('\n'.join(errmess))
+                isbad_mask = num.isnan(misfits[:, 0])
 
-            isbad_mask = isbad_mask_new
+                if self.is_sampler_phase_stopped(phase):
+                    reason = None
+                else:
+                    reason = phase.check_convergence(chains, iiter_phase)
 
-            if num.all(isbad_mask):
-                raise BadProblem(
-                    'problem %s: all target misfit values are NaN'
-                    % problem.name)
+                if reason is not None:
+                    # candidates already in flight complete the phase
+                    self.stop_sampler_phase(iiter, iiter_next, reason)
+                    if rundir is not None:
+                        self.dump_state(rundir, history, inflight)
 
-            history.append(x, misfits, bootstrap_misfits)
+                if rundir is not None and self._tcheckpoint_last \
+                        < time.time() - self.checkpoint_interval:
+
+                    self.dump_state(rundir, history, inflight)
+
+                iiter += 1
+
+        if rundir is not None:
+            self.dump_state(rundir, history)
 
     @property
     def niterations(self):
-        return sum([ph.niterations for ph in self.sampler_phases])
+        return sum(self.get_phase_niterations())
 
     def get_status(self, history):
         sparks = u'\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
@@ -565,6 +1336,9 @@ class HighScoreOptimiser(Optimiser):
         if self._status_chains is None:
             self._status_chains = self.chains(history.problem, history)
 
+        if history.path is not None:
+            self.load_state(history.path)
+
         self._status_chains.goto(history.nmodels)
 
         chains = self._status_chains
@@ -644,12 +1418,33 @@ class HighScoreOptimiserConfig(OptimiserConfig):
         default=100,
         help='Number of bootstrap realisations to be tracked simultaneously in'
              ' the optimisation.')
+    sampler_seed = Int.T(
+        optional=True,
+        help='Seed for the random number generator of the sampler phases. '
+             'If not set, a fresh seed is taken from the operating system.')
+    nprocs = Int.T(
+        default=1,
+        help='Number of local worker processes used to evaluate candidate '
+             'models concurrently.')
+    ncandidates_inflight = Int.T(
+        optional=True,
+        help='Number of candidate models being evaluated at the same time. '
+             'New candidates are drawn from chains which lag behind by at '
+             'most ncandidates_inflight - 1 models. Defaults to nprocs.')
+    surrogate = SurrogateScreening.T(
+        optional=True,
+        help='If set, candidates of the directed sampler phases which are '
+             'unlikely to enter any chain are dropped before modelling.')
 
     def get_optimiser(self):
         return HighScoreOptimiser(
             sampler_phases=list(self.sampler_phases),
             chain_length_factor=self.chain_length_factor,
-            nbootstrap=self.nbootstrap)
+            nbootstrap=self.nbootstrap,
+            sampler_seed=self.sampler_seed,
+            nprocs=self.nprocs,
+            ncandidates_inflight=self.ncandidates_inflight,
+            surrogate=self.surrogate)
 
 
 def load_optimiser_history(dirname, problem):
@@ -681,7 +1476,13 @@ __all__ = '''
     InjectionSamplerPhase
     UniformSamplerPhase
     DirectedSamplerPhase
+    SamplerPhaseConvergence
+    SurrogateScreening
     Chains
     HighScoreOptimiserConfig
     HighScoreOptimiser
+    HighScoreOptimiserState
+    InflightCandidate
+    ConvergenceSnapshot
+    SamplerPhaseStop
 '''.split()
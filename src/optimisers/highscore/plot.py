@@ -179,10 +179,9 @@ class HighScoreOptimiserPlot(object):
         phase, iiter_phase = self.optimiser.get_sampler_phase(self.iiter)
 
         np = 1000
-        models_prob = num.zeros((np, self.problem.nparameters))
-        for ip in range(np):
-            models_prob[ip, :] = phase.get_sample(
-                self.problem, iiter_phase, self.chains)
+        models_prob = phase.get_samples(
+            self.problem, num.full(np, iiter_phase), self.chains,
+            rstate=self.optimiser.sampler_rstate)
 
         fx = self.problem.extract(models_prob, self.ixpar)
         fy = self.problem.extract(models_prob, self.iypar)
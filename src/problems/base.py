@@ -17,8 +17,9 @@ from pyrocko import gf, util, guts
 from pyrocko.guts import Object, String, List, Dict, Int
 
 from ..meta import ADict, Parameter, GrondError, xjoin, Forbidden
-from ..targets import MisfitResult, MisfitTarget, TargetGroup, \
-    WaveformMisfitTarget, SatelliteMisfitTarget, GNSSCampaignMisfitTarget
+from ..targets import MisfitResult, SparseMisfitResult, MisfitTarget, \
+    TargetGroup, WaveformMisfitTarget, SatelliteMisfitTarget, \
+    GNSSCampaignMisfitTarget, PhaseTimingService, complete_deferred_results
 
 from grond.version import __version__
 
@@ -51,6 +52,26 @@ class ProblemConfig(Object):
         raise NotImplementedError
 
 
+class ModellingPlan(object):
+    '''
+    Bookkeeping to model a fixed list of targets, see
+    :py:meth:`Problem.get_modelling_plan`.
+    '''
+
+    __slots__ = [
+        'key', 'engine', 'targets', 'target_mtargets', 'target_slices',
+        'modelling_targets_unique', 'iunique']
+
+    def __init__(self, key, engine, targets):
+        self.key = key
+        self.engine = engine
+        self.targets = list(targets)
+        self.target_mtargets = []
+        self.target_slices = []
+        self.modelling_targets_unique = []
+        self.iunique = []
+
+
 class Problem(Object):
     '''
     Base class for objective function setup.
@@ -75,6 +96,12 @@ class Problem(Object):
         self._target_weights = None
         self._engine = None
         self._family_mask = None
+        self._bootstrap_kernel = None
+        self._modelling_plan = None
+        self._misfit_indices = None
+
+        # phase arrivals of all waveform targets are computed jointly
+        self._timing_service = PhaseTimingService(self.waveform_targets)
 
         if hasattr(self, 'problem_waveform_parameters') and self.has_waveforms:
             self.problem_parameters =\
@@ -91,6 +118,9 @@ class Problem(Object):
     def copy(self):
         o = copy.copy(self)
         o._target_weights = None
+        o._bootstrap_kernel = None
+        o._modelling_plan = None
+        o._misfit_indices = None
         return o
 
     def set_target_parameter_values(self, x):
@@ -235,8 +265,11 @@ class Problem(Object):
     def set_engine(self, engine):
         self._engine = engine
 
-    def random_uniform(self, xbounds):
-        x = num.random.uniform(0., 1., self.nparameters)
+    def random_uniform(self, xbounds, rstate=None):
+        if rstate is None:
+            rstate = num.random
+
+        x = rstate.uniform(0., 1., self.nparameters)
         x *= (xbounds[:, 1] - xbounds[:, 0])
         x += xbounds[:, 0]
         return x
@@ -391,6 +424,12 @@ class Problem(Object):
         assert extra_weights is None or extra_weights.ndim == 2
         assert extra_residuals is None or extra_residuals.ndim == 2
 
+        if (extra_weights is not None or extra_residuals is not None) \
+                and not get_contributions:
+
+            return self.combine_bootstrap_misfits(
+                misfits, extra_weights, extra_residuals)
+
         if extra_weights is not None or extra_residuals is not None:
             if extra_weights is not None:
                 w = extra_weights[num.newaxis, :, :] \
@@ -433,6 +472,93 @@ class Problem(Object):
                 num.nansum(exp(w*misfits[:, :, 0]), axis=1) /
                 num.nansum(exp(w*misfits[:, :, 1]), axis=1))
 
+    def get_bootstrap_kernel(self, extra_weights, extra_residuals):
+        '''
+        Get precomputed factors to combine misfits of bootstrap realisations.
+
+        With ``p = norm_exponent``, the contribution ``(W g (m + R))**p`` of
+        a residual with bootstrap weight ``W``, bootstrap perturbation ``R``,
+        target and family weight ``g`` and misfit ``m`` is expanded
+        binomially into ``sum_j (g**p m**(p-j)) * (binom(p, j) W**p R**j)``.
+        The second factors only depend on the bootstrap realisations and are
+        returned as 2D arrays ``kernel[j][ibootstrap, iresidual]``.
+
+        The kernel is cached for the last pair of arrays given, which must
+        not be modified in place afterwards.
+        '''
+        if self._bootstrap_kernel is not None:
+            extra_weights_cached, extra_residuals_cached, kernel = \
+                self._bootstrap_kernel
+
+            if extra_weights_cached is extra_weights \
+                    and extra_residuals_cached is extra_residuals:
+                return kernel
+
+        p = self.norm_exponent
+        if p not in (1, 2):
+            self.raise_invalid_norm_exponent()
+
+        shape = (extra_weights if extra_weights is not None
+                 else extra_residuals).shape
+
+        ws = extra_weights if extra_weights is not None else num.ones(shape)
+        rs = extra_residuals if extra_residuals is not None \
+            else num.zeros(shape)
+
+        wps = ws**p
+        kernel = [wps]
+        for j in range(1, p+1):
+            binom = math.factorial(p) \
+                // (math.factorial(j) * math.factorial(p-j))
+            kernel.append(binom * wps * rs**j)
+
+        self._bootstrap_kernel = extra_weights, extra_residuals, kernel
+        return kernel
+
+    def combine_bootstrap_misfits(
+            self, misfits, extra_weights=None, extra_residuals=None):
+        '''
+        Combine misfit contributions to bootstrap misfits of many models.
+
+        Equivalent to :py:meth:`combine_misfits` with *extra_weights* or
+        *extra_residuals* given, but the sums over the residuals are done as
+        matrix products with the factors from :py:meth:`get_bootstrap_kernel`
+        instead of building ``(nmodels, nbootstrap, nmisfits)`` temporaries.
+
+        :param misfits: 3D array ``misfits[imodel, iresidual, 0:2]``
+        :returns: 2D array ``misfits[imodel, ibootstrap]``
+        '''
+        p = self.norm_exponent
+        _, root = self.get_norm_functions()
+        kernel = self.get_bootstrap_kernel(extra_weights, extra_residuals)
+
+        ms = misfits[:, :, 0]
+        ns = misfits[:, :, 1]
+        if extra_weights is not None:
+            gs = self.get_target_weights()[num.newaxis, :] \
+                * self.inter_family_weights2(ns)
+        else:
+            gs = num.ones(ms.shape)
+
+        # residuals with NaN misfits are left out, as with nansum
+        gps = gs**p
+        gms = gs * ms
+        isok = ~num.isnan(gms)
+        numerator = num.zeros((ms.shape[0], kernel[0].shape[0]))
+        for j in range(p+1):
+            a = num.where(isok, gps * ms**(p-j), 0.0)
+            numerator += num.dot(a, kernel[j].T)
+
+        gns = gs * ns
+        a = num.where(num.isnan(gns), 0.0, gns**p)
+        denominator = num.dot(a, kernel[0].T)
+
+        if p == 2:
+            # expanding the square may leave tiny negative values
+            numerator = num.maximum(numerator, 0.0)
+
+        return root(numerator / denominator)
+
     def make_family_mask(self):
         family_names = set()
         families = num.zeros(self.nmisfits, dtype=num.int)
@@ -452,10 +578,96 @@ class Problem(Object):
         return self._family_mask
 
     def evaluate(self, x, mask=None, result_mode='full', targets=None):
-        source = self.get_source(x)
+        return self._evaluate_batch(
+            num.asarray(x)[num.newaxis, :], mask, result_mode, targets)[0]
+
+    def evaluate_many(self, xs, mask=None, result_mode='full', targets=None):
+        '''
+        Evaluate many models, if possible with a single engine request.
+
+        All sources are sent to the modelling engine together with the
+        modelling targets, which are set up and de-duplicated only once for
+        the whole batch. Models are evaluated one by one, if any of the
+        targets cannot be modelled in batches or if the models differ in
+        their target parameters.
+
+        :param xs: 2D array ``xs[imodel, iparameter]``
+        :returns: list with the results of each model, as returned by
+            :py:meth:`evaluate`
+        '''
+        xs = num.asarray(xs)
+        nprob = len(self.problem_parameters)
+        if xs.shape[0] == 0:
+            return []
+
+        elif all(target.can_batch_modelling
+                 for target in (targets or self.targets)) \
+                and num.all(xs[:, nprob:] == xs[0, nprob:]):
+
+            return self._evaluate_batch(xs, mask, result_mode, targets)
+
+        else:
+            return [
+                self._evaluate_batch(
+                    x[num.newaxis, :], mask, result_mode, targets)[0]
+                for x in xs]
+
+    def get_modelling_plan(self, engine, source, targets, mask=None):
+        '''
+        Get the modelling targets and index arrays to evaluate *targets*.
+
+        The plan is cached and reused as long as the engine, the targets and
+        the mask stay the same. It is rebuilt for every call if any of the
+        targets cannot be modelled in batches, as their
+        ``prepare_modelling`` may have side effects.
+        '''
+        cacheable = all(target.can_batch_modelling for target in targets)
+        key = (
+            id(engine),
+            tuple(id(target) for target in targets),
+            None if mask is None else num.asarray(mask, dtype=num.bool)
+            .tobytes())
+
+        plan = self._modelling_plan
+        if cacheable and plan is not None and plan.key == key:
+            return plan
+
+        plan = ModellingPlan(key, engine, targets)
+
+        modelling_targets = []
+        for itarget, target in enumerate(targets):
+            mtargets = target.prepare_modelling(engine, source, targets)
+            if mask is None or mask[itarget]:
+                plan.target_mtargets.append(mtargets)
+                plan.target_slices.append(slice(
+                    len(modelling_targets),
+                    len(modelling_targets) + len(mtargets)))
+
+                modelling_targets.extend(mtargets)
+            else:
+                plan.target_mtargets.append(None)
+                plan.target_slices.append(None)
+
+        u2i_map = {}
+        for mtarget in modelling_targets:
+            if mtarget not in u2i_map:
+                u2i_map[mtarget] = len(u2i_map)
+
+            plan.iunique.append(u2i_map[mtarget])
+
+        plan.modelling_targets_unique = list(u2i_map.keys())
+
+        if cacheable:
+            self._modelling_plan = plan
+
+        return plan
+
+    def _evaluate_batch(self, xs, mask, result_mode, targets):
+        sources = [self.get_source(x) for x in xs]
         engine = self.get_engine()
 
-        self.set_target_parameter_values(x)
+        # target parameters are the same for all models of a batch
+        self.set_target_parameter_values(xs[0])
 
         if mask is not None and targets is not None:
             raise ValueError('mask cannot be defined with targets set')
@@ -464,62 +676,102 @@ class Problem(Object):
         for target in targets:
             target.set_result_mode(result_mode)
 
-        modelling_targets = []
-        t2m_map = {}
-        for itarget, target in enumerate(targets):
-            t2m_map[target] = target.prepare_modelling(engine, source, targets)
-            if mask is None or mask[itarget]:
-                modelling_targets.extend(t2m_map[target])
+        plan = self.get_modelling_plan(engine, sources[0], targets, mask)
 
-        u2m_map = {}
-        for imtarget, mtarget in enumerate(modelling_targets):
-            if mtarget not in u2m_map:
-                u2m_map[mtarget] = []
+        # deferring is only allowed while the batch is processed, direct
+        # callers of post_process expect finished results
+        for target in targets:
+            target.set_defer_post_process(True)
 
-            u2m_map[mtarget].append(imtarget)
+        try:
+            resp = engine.process(
+                sources=sources, targets=plan.modelling_targets_unique)
 
-        modelling_targets_unique = list(u2m_map.keys())
+        finally:
+            for target in targets:
+                target.set_defer_post_process(False)
 
-        resp = engine.process(source, modelling_targets_unique)
-        modelling_results_unique = list(resp.results_list[0])
+        # e.g. filter the synthetics of all waveform targets jointly
+        complete_deferred_results(resp.results_list)
 
-        modelling_results = [None] * len(modelling_targets)
+        results_many = []
+        for source, modelling_results_unique in zip(
+                sources, resp.results_list):
 
-        for mtarget, mresult in zip(
-                modelling_targets_unique, modelling_results_unique):
+            modelling_results = [
+                modelling_results_unique[iunique]
+                for iunique in plan.iunique]
 
-            for itarget in u2m_map[mtarget]:
-                modelling_results[itarget] = mresult
+            results = []
+            for target, mtargets, target_slice in zip(
+                    targets, plan.target_mtargets, plan.target_slices):
 
-        imt = 0
-        results = []
-        for itarget, target in enumerate(targets):
-            nmt_this = len(t2m_map[target])
-            if mask is None or mask[itarget]:
-                result = target.finalize_modelling(
-                    engine, source,
-                    t2m_map[target],
-                    modelling_results[imt:imt+nmt_this])
+                if target_slice is not None:
+                    result = target.finalize_modelling(
+                        engine, source,
+                        mtargets,
+                        modelling_results[target_slice])
 
-                imt += nmt_this
-            else:
-                result = gf.SeismosizerError(
-                    'target was excluded from modelling')
+                else:
+                    result = gf.SeismosizerError(
+                        'target was excluded from modelling')
 
-            results.append(result)
+                results.append(result)
 
-        return results
+            results_many.append(results)
+
+        return results_many
+
+    def get_misfit_indices(self):
+        '''
+        Get the indices of each target's residuals in the misfit arrays.
+
+        :returns: list with a 1D index array for each target
+        '''
+        key = tuple(id(target) for target in self.targets)
+        if self._misfit_indices is None or self._misfit_indices[0] != key:
+            misfit_indices = []
+            imisfit = 0
+            for target in self.targets:
+                misfit_indices.append(
+                    num.arange(imisfit, imisfit + target.nmisfits))
+                imisfit += target.nmisfits
+
+            # the targets are kept to keep their ids from being reused
+            self._misfit_indices = key, misfit_indices, list(self.targets)
+
+        return self._misfit_indices[1]
+
+    def _results_to_misfits(self, results, out=None):
+        misfit_indices = self.get_misfit_indices()
+        if out is None:
+            nmisfits = sum(imisfits.size for imisfits in misfit_indices)
+            out = num.empty((nmisfits, 2))
+
+        out.fill(num.nan)
+        for imisfits, result in zip(misfit_indices, results):
+            if isinstance(result, (MisfitResult, SparseMisfitResult)):
+                out[imisfits, :] = result.misfits
+
+        return out
 
     def misfits(self, x, mask=None):
         results = self.evaluate(x, mask=mask, result_mode='sparse')
-        misfits = num.full((self.nmisfits, 2), num.nan)
+        return self._results_to_misfits(results)
+
+    def misfits_many(self, xs, mask=None):
+        '''
+        Get the misfits of many models.
 
-        imisfit = 0
-        for target, result in zip(self.targets, results):
-            if isinstance(result, MisfitResult):
-                misfits[imisfit:imisfit+target.nmisfits, :] = result.misfits
+        Uses :py:meth:`evaluate_many` to model the batch.
 
-            imisfit += target.nmisfits
+        :param xs: 2D array ``xs[imodel, iparameter]``
+        :returns: 3D array ``misfits[imodel, iresidual, 0:2]``
+        '''
+        results_many = self.evaluate_many(xs, mask=mask, result_mode='sparse')
+        misfits = num.empty((len(results_many), self.nmisfits, 2))
+        for imodel, results in enumerate(results_many):
+            self._results_to_misfits(results, out=misfits[imodel])
 
         return misfits
 
@@ -570,7 +822,8 @@ class ModelHistory(object):
     :param problem: :class:`grond.Problem` instance
     :param path: path to rundir, defaults to None
     :type path: str, optional
-    :param mode: open mode, 'r': read, 'w': write
+    :param mode: open mode, 'r': read, 'w': write, 'a': read the models
+        already in *path* and append new ones
     :type mode: str, optional
     '''
 
@@ -594,11 +847,20 @@ class ModelHistory(object):
         self.nmodels_capacity = self.nmodels_capacity_min
         self.listeners = []
 
-        if mode == 'r':
+        if mode in ('r', 'a'):
             self.verify_rundir(self.path)
+            if mode == 'a':
+                truncate_problem_data(
+                    path, problem,
+                    get_nmodels(path, problem, nchains=self.nchains),
+                    nchains=self.nchains)
+
             models, misfits, bootstraps = load_problem_data(
                 path, problem, nchains=self.nchains)
+
+            self.mode = 'r'
             self.extend(models, misfits, bootstraps)
+            self.mode = mode
 
     @staticmethod
     def verify_rundir(rundir):
@@ -711,10 +973,12 @@ class ModelHistory(object):
             self._bootstraps_buffer[nmodels:nmodels+n, :] = bootstrap_misfits
             self.bootstrap_misfits = self._bootstraps_buffer[:nmodels+n, :]
 
-        if self.path and self.mode == 'w':
+        if self.path and self.mode in ('w', 'a'):
             for i in range(n):
                 self.problem.dump_problem_data(
-                        self.path, models[i, :], misfits[i, :, :])
+                        self.path, models[i, :], misfits[i, :, :],
+                        None if bootstrap_misfits is None
+                        else bootstrap_misfits[i, :])
 
         self.emit('extend', nmodels, n, models, misfits)
 
@@ -737,7 +1001,7 @@ class ModelHistory(object):
             self._bootstraps_buffer[nmodels, :] = bootstrap_misfits
             self.bootstrap_misfits = self._bootstraps_buffer[:nmodels+1, :]
 
-        if self.path and self.mode == 'w':
+        if self.path and self.mode in ('w', 'a'):
             self.problem.dump_problem_data(
                 self.path, model, misfits, bootstrap_misfits)
 
@@ -747,7 +1011,8 @@ class ModelHistory(object):
 
     def update(self):
         ''' Update history from path '''
-        nmodels_available = get_nmodels(self.path, self.problem)
+        nmodels_available = get_nmodels(
+            self.path, self.problem, nchains=self.nchains)
         if self.nmodels == nmodels_available:
             return
 
@@ -770,7 +1035,7 @@ class ModelHistory(object):
                 slot(*args, **kwargs)
 
 
-def get_nmodels(dirname, problem):
+def get_nmodels(dirname, problem, nchains=None):
     fn = op.join(dirname, 'models')
     with open(fn, 'r') as f:
         nmodels1 = os.fstat(f.fileno()).st_size // (problem.nparameters * 8)
@@ -779,7 +1044,32 @@ def get_nmodels(dirname, problem):
     with open(fn, 'r') as f:
         nmodels2 = os.fstat(f.fileno()).st_size // (problem.nmisfits * 2 * 8)
 
-    return min(nmodels1, nmodels2)
+    nmodels = min(nmodels1, nmodels2)
+
+    fn = op.join(dirname, 'bootstraps')
+    if nchains is not None and op.exists(fn):
+        nmodels = min(nmodels, os.stat(fn).st_size // (nchains * 8))
+
+    return nmodels
+
+
+def truncate_problem_data(dirname, problem, nmodels, nchains=None):
+    '''
+    Cut the model files in a rundir to a common number of models.
+
+    Incomplete trailing records, e.g. from an interrupted run, are removed.
+    '''
+    for fn, nbytes in [
+            ('models', problem.nparameters * 8),
+            ('misfits', problem.nmisfits * 2 * 8),
+            ('bootstraps', (nchains or 0) * 8)]:
+
+        fn = op.join(dirname, fn)
+        if nbytes != 0 and op.exists(fn) \
+                and os.stat(fn).st_size > nmodels * nbytes:
+
+            logger.debug('truncating %s to %i models' % (fn, nmodels))
+            os.truncate(fn, nmodels * nbytes)
 
 
 def load_problem_info_and_data(dirname, subset=None, nchains=None):
@@ -807,7 +1097,8 @@ def load_problem_info(dirname):
 def load_problem_data(dirname, problem, nmodels_skip=0, nchains=None):
 
     try:
-        nmodels = get_nmodels(dirname, problem) - nmodels_skip
+        nmodels = get_nmodels(dirname, problem, nchains=nchains) \
+            - nmodels_skip
 
         fn = op.join(dirname, 'models')
         with open(fn, 'r') as f:
@@ -856,4 +1147,5 @@ __all__ = '''
     ProblemDataNotAvailable
     load_problem_info
     load_problem_info_and_data
+    truncate_problem_data
 '''.split()
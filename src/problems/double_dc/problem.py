@@ -99,10 +99,13 @@ class DoubleDCProblem(Problem):
                 arr[ip] = source.stf2.duration if source.stf2 else 0.0
         return arr
 
-    def random_uniform(self, xbounds):
+    def random_uniform(self, xbounds, rstate=None):
+        if rstate is None:
+            rstate = num.random
+
         x = num.zeros(self.nparameters)
         for i in range(self.nparameters):
-            x[i] = num.random.uniform(xbounds[i, 0], xbounds[i, 1])
+            x[i] = rstate.uniform(xbounds[i, 0], xbounds[i, 1])
 
         return x.tolist()
 
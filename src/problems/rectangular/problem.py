@@ -89,10 +89,13 @@ class RectangularProblem(Problem):
 
         return source
 
-    def random_uniform(self, xbounds):
+    def random_uniform(self, xbounds, rstate=None):
+        if rstate is None:
+            rstate = num.random
+
         x = num.zeros(self.nparameters)
         for i in range(self.nparameters):
-            x[i] = num.random.uniform(xbounds[i, 0], xbounds[i, 1])
+            x[i] = rstate.uniform(xbounds[i, 0], xbounds[i, 1])
 
         return x
 
@@ -4,6 +4,8 @@ import logging
 from pyrocko import trace
 from pyrocko.guts import (Object, Dict, String, Float, Bool, Int)
 
+from .dataset_cache import get_response_cache
+
 logger = logging.getLogger('grond.synthetic_tests')
 
 guts_prefix = 'grond'
@@ -106,7 +108,8 @@ class SyntheticTest(Object):
         tr = synthetics[nslc]
         tr.extend(tmin - tfade * 2.0, tmax + tfade * 2.0)
 
-        tr = tr.transfer(
+        tr = get_response_cache().transfer(
+            tr,
             tfade=tfade,
             freqlimits=freqlimits)
 
@@ -1,4 +1,5 @@
 from .base import *  # noqa
+from .timing import *  # noqa
 from .waveform import *  # noqa
 from .waveform_phase_ratio import *  # noqa
 from .waveform_oac import *  # noqa
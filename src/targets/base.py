@@ -1,4 +1,5 @@
 import copy
+from collections import OrderedDict
 
 import numpy as num
 
@@ -40,10 +41,110 @@ class MisfitResult(Object):
         dtype=num.float)
 
 
+class SparseMisfitResult(object):
+    '''
+    Lightweight stand-in for :py:class:`MisfitResult`.
+
+    Returned by targets in ``'sparse'`` result mode, where only the misfits
+    are needed, to avoid the construction of guts objects.
+    '''
+
+    __slots__ = ['misfits']
+
+    def __init__(self, misfits):
+        self.misfits = misfits
+
+
 class MisfitConfig(Object):
     pass
 
 
+class ObservedCache(object):
+    '''
+    Bounded cache of processed observed data of a target.
+
+    Entries are looked up by a hashable key describing the processing, e.g. a
+    time window snapped to the sampling interval. The least recently used
+    entry is dropped when more than ``size`` entries are stored. Hits and
+    misses are counted in :py:attr:`nhits` and :py:attr:`nmisses`.
+    '''
+
+    def __init__(self, size=16):
+        self.size = size
+        self.nhits = 0
+        self.nmisses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, make):
+        '''
+        Get entry for ``key``, calling ``make()`` to create it if needed.
+        '''
+
+        if key in self._entries:
+            self.nhits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.nmisses += 1
+        value = make()
+        self._entries[key] = value
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DeferredResult(object):
+    '''
+    Placeholder result of a target's ``post_process``.
+
+    Targets may return objects of this type from ``post_process``, if
+    deferred post-processing has been enabled with
+    :py:meth:`MisfitTarget.set_defer_post_process`. The actual results are
+    then computed jointly for all deferred results of the same type by
+    :py:meth:`complete_many`.
+    '''
+
+    @classmethod
+    def complete_many(cls, deferred_results):
+        '''
+        Compute the actual results.
+
+        :param deferred_results: list of deferred results of this type
+        :returns: list with a result or
+            :py:class:`pyrocko.gf.SeismosizerError` for each deferred result
+        '''
+        raise NotImplementedError()
+
+
+def complete_deferred_results(results_list):
+    '''
+    Replace deferred results in engine responses, in place.
+
+    :param results_list: ``results_list[isource][itarget]``, e.g. from
+        :py:attr:`pyrocko.gf.Response.results_list`
+    '''
+    deferred = {}
+    for results in results_list:
+        for iresult, result in enumerate(results):
+            if isinstance(result, DeferredResult):
+                deferred.setdefault(type(result), []).append(
+                    (results, iresult))
+
+    for cls, positions in deferred.items():
+        completed = cls.complete_many(
+            [results[iresult] for (results, iresult) in positions])
+
+        for (results, iresult), result in zip(positions, completed):
+            results[iresult] = result
+
+
 class MisfitTarget(Object):
 
     manual_weight = Float.T(
@@ -73,6 +174,10 @@ class MisfitTarget(Object):
     can_bootstrap_weights = False
     can_bootstrap_residuals = False
 
+    # False, if prepare_modelling and finalize_modelling rely on a single
+    # source being processed per engine request
+    can_batch_modelling = True
+
     def __init__(self, **kwargs):
         Object.__init__(self, **kwargs)
         self.parameters = []
@@ -85,6 +190,8 @@ class MisfitTarget(Object):
         self._target_ranges = None
 
         self._combined_weight = None
+        self._observed_cache = ObservedCache()
+        self._defer_post_process = False
 
     @classmethod
     def get_plot_classes(cls):
@@ -92,6 +199,7 @@ class MisfitTarget(Object):
 
     def set_dataset(self, ds):
         self._ds = ds
+        self._observed_cache.clear()
 
     def get_dataset(self):
         return self._ds
@@ -122,9 +230,21 @@ class MisfitTarget(Object):
         for i, p in enumerate(self.parameters):
             self.parameter_values[p.name_nogroups] = model[i]
 
+    def get_observed_cache(self):
+        '''
+        Get cache of processed observed data, see :py:class:`ObservedCache`.
+        '''
+        return self._observed_cache
+
     def set_result_mode(self, result_mode):
         self._result_mode = result_mode
 
+    def set_defer_post_process(self, defer):
+        '''
+        Allow ``post_process`` to return :py:class:`DeferredResult` objects.
+        '''
+        self._defer_post_process = defer
+
     def post_process(self, engine, source, statics):
         raise NotImplementedError()
 
@@ -142,7 +262,7 @@ class MisfitTarget(Object):
         nbootstraps = self.bootstrap_weights.size // self.nmisfits
         return self.bootstrap_weights.reshape(nbootstraps, self.nmisfits)
 
-    def init_bootstrap_residuals(self, nbootstrap, rstate=None):
+    def init_bootstrap_residuals(self, nbootstrap, rstate=None, nprocs=1):
         raise NotImplementedError
 
     def set_bootstrap_residuals(self, residuals):
@@ -165,6 +285,10 @@ class MisfitTarget(Object):
 
 __all__ = '''
     TargetGroup
+    ObservedCache
+    DeferredResult
+    complete_deferred_results
     MisfitTarget
     MisfitResult
+    SparseMisfitResult
 '''.split()
@@ -4,7 +4,8 @@ import numpy as num
 from pyrocko import gf
 from pyrocko.guts import String, Dict, List
 
-from ..base import MisfitConfig, MisfitTarget, MisfitResult, TargetGroup
+from ..base import MisfitConfig, MisfitTarget, MisfitResult, TargetGroup, \
+    SparseMisfitResult
 
 guts_prefix = 'grond'
 logger = logging.getLogger('grond.target').getChild('gnss_campaign')
@@ -181,12 +182,14 @@ class GNSSCampaignMisfitTarget(gf.GNSSCampaignTarget, MisfitTarget):
             misfit_norm.reshape((nstations, 3)), axis=1)
 
         mf = num.hstack((misfit_value, misfit_norm))
+        if self._result_mode != 'full':
+            return SparseMisfitResult(misfits=mf)
+
         result = GNSSCampaignMisfitResult(
             misfits=mf)
 
-        if self._result_mode == 'full':
-            result.statics_syn = statics
-            result.statics_obs = obs
+        result.statics_syn = statics
+        result.statics_obs = obs
 
         return result
 
@@ -200,7 +203,7 @@ class GNSSCampaignMisfitTarget(gf.GNSSCampaignTarget, MisfitTarget):
     def prepare_modelling(self, engine, source, targets):
         return [self]
 
-    def init_bootstrap_residuals(self, nbootstraps, rstate=None):
+    def init_bootstrap_residuals(self, nbootstraps, rstate=None, nprocs=1):
         logger.info('GNSS campaign %s, bootstrapping residuals'
                     ' from measurement uncertainties ...'
                     % self.campaign.name)
@@ -1,16 +1,98 @@
 import logging
+import os.path as op
 import numpy as num
 
 from pyrocko import gf
 from pyrocko.guts import String, Bool, Dict, List
 
-from grond.meta import Parameter
-from ..base import MisfitConfig, MisfitTarget, MisfitResult, TargetGroup
+from grond.meta import Parameter, make_process_pool
+from grond.dataset_cache import NoiseRealisationCache, fingerprint_files
+from ..base import MisfitConfig, MisfitTarget, MisfitResult, TargetGroup, \
+    SparseMisfitResult
 
 guts_prefix = 'grond'
 logger = logging.getLogger('grond.targets.satellite.target')
 
 
+g_state = {}
+
+
+def _get_quadtree_noise(args):
+    g_data_id, seed, irealisation = args
+    covariance = g_state[g_data_id]
+    return covariance.getQuadtreeNoise(
+        rstate=num.random.RandomState([seed, irealisation]))
+
+
+def get_quadtree_noise_realisations(
+        covariance, seed, irealisations, nprocs=1):
+
+    '''
+    Compute noise realisations on the quadtree leaves of a Kite scene.
+
+    Realisation ``i`` is generated from a random state seeded with
+    ``(seed, i)``, so that the result does not depend on the number of
+    worker processes or on which realisations are computed together. The
+    first realisation is computed in the calling process, so that the noise
+    power spectrum is prepared before the workers are forked.
+
+    :param covariance: :py:class:`kite.Covariance` of the scene
+    :param seed: base random seed
+    :param irealisations: indices of the realisations to compute
+    :param nprocs: number of worker processes
+    :returns: 2D array with one realisation per row
+    '''
+
+    g_data_id = id(covariance)
+    g_state[g_data_id] = covariance
+    jobs = [(g_data_id, seed, i) for i in irealisations]
+    n = len(jobs)
+    try:
+        realisations = []
+        if jobs:
+            realisations.append(_get_quadtree_noise(jobs[0]))
+
+        pool = None
+        if nprocs > 1 and n > 2:
+            pool = make_process_pool(min(nprocs, n - 1))
+
+        if pool is not None:
+            with pool:
+                for realisation in pool.imap(_get_quadtree_noise, jobs[1:]):
+                    realisations.append(realisation)
+                    if not len(realisations) % 5:
+                        logger.info(
+                            'Calculated noise realisation %d/%d'
+                            % (len(realisations), n))
+
+        else:
+            for job in jobs[1:]:
+                if not len(realisations) % 5:
+                    logger.info(
+                        'Calculating noise realisation %d/%d'
+                        % (len(realisations), n))
+
+                realisations.append(_get_quadtree_noise(job))
+
+    finally:
+        del g_state[g_data_id]
+
+    return num.array(realisations, dtype=num.float)
+
+
+def _get_config_fingerprint(config, exclude=()):
+    fp = []
+    for name in config.T.propnames:
+        if name not in exclude:
+            value = getattr(config, name)
+            if isinstance(value, num.ndarray):
+                value = value.tolist()
+
+            fp.append((name, value))
+
+    return repr(fp)
+
+
 class SatelliteMisfitConfig(MisfitConfig):
     """Carries the misfit configuration."""
     optimise_orbital_ramp = Bool.T(
@@ -187,12 +269,14 @@ class SatelliteMisfitTarget(gf.SatelliteTarget, MisfitTarget):
         misfit_norm = obs
 
         mf = num.vstack([misfit_value, misfit_norm]).T
+        if self._result_mode != 'full':
+            return SparseMisfitResult(misfits=mf)
+
         result = SatelliteMisfitResult(
             misfits=mf)
 
-        if self._result_mode == 'full':
-            result.statics_syn = statics
-            result.statics_obs = quadtree.leaf_medians
+        result.statics_syn = statics
+        result.statics_obs = quadtree.leaf_medians
 
         return result
 
@@ -208,24 +292,53 @@ class SatelliteMisfitTarget(gf.SatelliteTarget, MisfitTarget):
             self, engine, source, modelling_targets, modelling_results):
         return modelling_results[0]
 
-    def init_bootstrap_residuals(self, nbootstraps, rstate=None):
+    def get_noise_cache_key(self, noise_cache, seed):
+        scene = self.scene
+        fn = getattr(scene.meta, 'filename', None)
+        if fn is not None:
+            fn_base = op.splitext(fn)[0]
+            fp_files = fingerprint_files([fn_base + '.npz', fn_base + '.yml'])
+        else:
+            fp_files = []
+
+        return noise_cache.make_key(
+            self.scene_id,
+            _get_config_fingerprint(scene.quadtree.config),
+            _get_config_fingerprint(
+                scene.covariance.config, exclude=('covariance_matrix',)),
+            scene.quadtree.nleaves,
+            seed,
+            fp_files)
+
+    def init_bootstrap_residuals(self, nbootstraps, rstate=None, nprocs=1):
         logger.info('Scene %s, bootstrapping residuals from noise pertubations'
                     ' ...' % self.scene_id)
         if rstate is None:
             rstate = num.random.RandomState()
 
-        scene = self.scene
-        qt = scene.quadtree
-        cov = scene.covariance
-        bootstraps = num.empty((nbootstraps, qt.nleaves))
+        seed = int(rstate.randint(0, 2**31))
+
+        noise_cache = NoiseRealisationCache()
+        key = self.get_noise_cache_key(noise_cache, seed)
+        bootstraps = noise_cache.get(key)
+
+        nleaves = self.scene.quadtree.nleaves
+        if bootstraps is None or bootstraps.shape[1] != nleaves:
+            bootstraps = num.empty((0, nleaves))
+
+        ncached = bootstraps.shape[0]
+        if ncached >= nbootstraps:
+            logger.info('Using %d cached noise realisations' % nbootstraps)
+        else:
+            bootstraps = num.vstack((
+                bootstraps,
+                get_quadtree_noise_realisations(
+                    self.scene.covariance, seed,
+                    range(ncached, nbootstraps), nprocs=nprocs)))
 
-        for ibs in range(nbootstraps):
-            if not ibs % 5:
-                logger.info('Calculating noise realisation %d/%d'
-                            % (ibs, nbootstraps))
-            bootstraps[ibs, :] = cov.getQuadtreeNoise(rstate=rstate)
+            noise_cache.put(key, bootstraps)
 
-        self.set_bootstrap_residuals(bootstraps)
+        self.set_bootstrap_residuals(bootstraps[:nbootstraps])
 
     @classmethod
     def get_plot_classes(cls):
@@ -0,0 +1,260 @@
+'''
+Vectorised and memoised phase arrival times for groups of targets.
+'''
+
+import logging
+from collections import OrderedDict
+
+import numpy as num
+
+from pyrocko import gf, orthodrome as od, spit
+from pyrocko.gf.meta import OutOfBounds
+
+guts_prefix = 'grond'
+logger = logging.getLogger('grond.targets.timing')
+
+
+class PhaseTimingService(object):
+    '''
+    Phase arrival times for a set of targets, computed jointly.
+
+    When the arrival time of a :py:class:`pyrocko.gf.Timing` definition is
+    requested for a single target, it is evaluated for all registered targets
+    sharing the same GF store in one vectorised call on the store's travel
+    time tables. The results are memoised, keyed on the source position
+    snapped to a grid with spacing ``depth_quantum`` (vertical) and
+    ``position_quantum`` (horizontal) [m], so that repeated requests for the
+    same source, e.g. from
+    :py:meth:`WaveformMisfitTarget.get_taper_params` and
+    :py:meth:`WaveformMisfitTarget.get_pick_shift` of every target, are
+    served from the cache. Travel times are computed at the snapped position.
+    With the default spacing of 1 m, the snapping error is far below the
+    interpolation accuracy of the stored travel time tables. Set the spacings
+    to ``None`` to disable snapping.
+    '''
+
+    def __init__(
+            self, targets=(),
+            depth_quantum=1.0,
+            position_quantum=1.0,
+            cache_size=1000):
+
+        self.depth_quantum = depth_quantum
+        self.position_quantum = position_quantum
+        self.cache_size = cache_size
+
+        self._groups = {}
+        self._target_indices = {}
+        self._latlons = {}
+        self._cache = OrderedDict()
+
+        for target in targets:
+            self.add_target(target)
+
+    def add_target(self, target):
+        if id(target) in self._target_indices:
+            return
+
+        group = self._groups.setdefault(target.store_id, [])
+        self._target_indices[id(target)] = len(group)
+        group.append(target)
+        self._latlons.pop(target.store_id, None)
+        self._cache.clear()
+
+        if hasattr(target, 'set_timing_service'):
+            target.set_timing_service(self)
+
+    def clear(self):
+        self._cache.clear()
+
+    def _quantize(self, value, quantum):
+        if quantum is None:
+            return float(value)
+
+        return float(round(value / quantum) * quantum)
+
+    def get_snapped_position(self, source):
+        return (
+            source.lat,
+            source.lon,
+            self._quantize(source.north_shift, self.position_quantum),
+            self._quantize(source.east_shift, self.position_quantum),
+            self._quantize(source.depth, self.depth_quantum))
+
+    def get_snapped_source(self, source):
+        lat, lon, north_shift, east_shift, depth = \
+            self.get_snapped_position(source)
+
+        return gf.Location(
+            lat=lat, lon=lon,
+            north_shift=north_shift, east_shift=east_shift,
+            depth=depth)
+
+    def get_distances(self, source, store_id):
+        targets = self._groups[store_id]
+        if store_id not in self._latlons:
+            self._latlons[store_id] = (
+                num.array([(t.lat, t.lon) for t in targets], dtype=num.float),
+                num.array([t.effective_latlon for t in targets],
+                          dtype=num.float),
+                num.array([(t.north_shift, t.east_shift) for t in targets],
+                          dtype=num.float))
+
+        latlons, effective_latlons, offsets = self._latlons[store_id]
+
+        slat, slon = source.effective_latlon
+        distances = od.distance_accurate50m_numpy(
+            slat, slon, effective_latlons[:, 0], effective_latlons[:, 1])
+
+        same_origin = num.logical_and(
+            latlons[:, 0] == source.lat, latlons[:, 1] == source.lon)
+
+        if num.any(same_origin):
+            distances[same_origin] = num.sqrt(
+                (offsets[same_origin, 0] - source.north_shift)**2 +
+                (offsets[same_origin, 1] - source.east_shift)**2)
+
+        return distances
+
+    def get_indexing_args(self, store, source, store_id):
+        '''
+        Get GF index tuples of all targets of a store as 2D array.
+
+        Returns ``None`` for store types for which the vectorised timing is
+        not available.
+        '''
+
+        distances = self.get_distances(source, store_id)
+        n = distances.size
+        if isinstance(store.config, gf.ConfigTypeA):
+            return num.vstack([
+                num.full(n, source.depth), distances]).T
+
+        elif isinstance(store.config, gf.ConfigTypeB):
+            depths = num.array(
+                [t.depth for t in self._groups[store_id]], dtype=num.float)
+
+            return num.vstack([
+                depths, num.full(n, source.depth), distances]).T
+
+        else:
+            return None
+
+    def _phase_many(self, store, phase_def, args):
+        n = args.shape[0]
+        times = num.full(n, num.nan)
+        out_of_bounds = num.zeros(n, dtype=bool)
+
+        toks = phase_def.split(':', 1)
+        if len(toks) == 1 or toks[0] == 'stored':
+            spt = store.get_stored_phase(toks[-1])
+            inside = num.all(num.logical_and(
+                spt.xbounds[:, 0] <= args,
+                args <= spt.xbounds[:, 1]), axis=1)
+
+            out_of_bounds[~inside] = True
+            if num.any(inside):
+                times[inside] = spt.interpolate_many(args[inside])
+
+        else:
+            phase = store.get_phase(phase_def)
+            for i in range(n):
+                try:
+                    t = phase(tuple(args[i]))
+                    if t is not None:
+                        times[i] = t
+
+                except spit.OutOfBounds:
+                    out_of_bounds[i] = True
+
+        return times, out_of_bounds
+
+    def evaluate_timing(self, store, timing, args):
+        '''
+        Vectorised equivalent of :py:meth:`pyrocko.gf.Timing.evaluate`.
+
+        :returns: ``(times, out_of_bounds)``, arrival times with NaN where no
+            arrival is defined and a mask of index tuples which are out of
+            the bounds of the travel time tables.
+        '''
+
+        n = args.shape[0]
+        out_of_bounds = num.zeros(n, dtype=bool)
+
+        if timing.offset_is == 'slowness' and timing.offset != 0.0:
+            offset, oob = self._phase_many(
+                store, 'vel_surface:%g' % (1.0/timing.offset), args)
+            out_of_bounds |= oob
+        else:
+            offset = num.full(n, timing.offset)
+
+        if not timing.phase_defs:
+            return offset, out_of_bounds
+
+        times = num.full(n, num.nan)
+        for phase_def in timing.phase_defs:
+            phase_times, oob = self._phase_many(store, phase_def, args)
+            out_of_bounds |= oob
+            if timing.select == 'first':
+                times = num.fmin(times, phase_times)
+            elif timing.select == 'last':
+                times = num.fmax(times, phase_times)
+            else:
+                undefined = num.isnan(times)
+                times[undefined] = phase_times[undefined]
+
+        if timing.offset_is == 'percent':
+            times = times * (1. + offset / 100.)
+        else:
+            times = times + offset
+
+        return times, out_of_bounds
+
+    def t(self, engine, timing, source, target):
+        '''
+        Get phase arrival time relative to the source origin time.
+
+        Drop-in replacement for
+        ``engine.get_store(target.store_id).t(timing, source, target)``.
+
+        :returns: travel time [s] or ``None`` if the phase does not exist.
+        :raises: :py:exc:`pyrocko.gf.meta.OutOfBounds`
+        '''
+
+        self.add_target(target)
+        store_id = target.store_id
+
+        key = (store_id, timing if isinstance(timing, str) else str(timing)) \
+            + self.get_snapped_position(source)
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            args, times, out_of_bounds = self._cache[key]
+        else:
+            if not isinstance(timing, gf.Timing):
+                timing = gf.Timing(timing)
+
+            store = engine.get_store(store_id)
+            source = self.get_snapped_source(source)
+            args = self.get_indexing_args(store, source, store_id)
+            if args is None:
+                return store.t(timing, source, target)
+
+            times, out_of_bounds = self.evaluate_timing(store, timing, args)
+            self._cache[key] = args, times, out_of_bounds
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        i = self._target_indices[id(target)]
+        if out_of_bounds[i]:
+            raise OutOfBounds(tuple(args[i]))
+
+        if num.isnan(times[i]):
+            return None
+
+        return float(times[i])
+
+
+__all__ = '''
+    PhaseTimingService
+'''.split()
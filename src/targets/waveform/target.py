@@ -3,6 +3,7 @@ from __future__ import print_function
 import logging
 import math
 import numpy as num
+import scipy.fft
 
 from pyrocko import gf, trace, weeding
 from pyrocko.guts import (Object, String, Float, Bool, Int, StringChoice,
@@ -11,7 +12,9 @@ from pyrocko.guts_array import Array
 
 from grond.dataset import NotFound
 
-from ..base import (MisfitConfig, MisfitTarget, MisfitResult, TargetGroup)
+from ..base import (MisfitConfig, MisfitTarget, MisfitResult, TargetGroup,
+                    DeferredResult, SparseMisfitResult)
+from ..timing import PhaseTimingService
 
 guts_prefix = 'grond'
 logger = logging.getLogger('grond.targets.waveform.target')
@@ -262,6 +265,8 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         gf.Target.__init__(self, **kwargs)
         MisfitTarget.__init__(self, **kwargs)
         self._piggyback_subtargets = []
+        self._timing_service = None
+        self._misfit_buffer = num.empty(0)
 
     def string_id(self):
         return '.'.join(x for x in (self.path,) + self.codes)
@@ -282,11 +287,20 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
 
         return self._combined_weight
 
+    def set_timing_service(self, timing_service):
+        self._timing_service = timing_service
+
+    def get_timing_service(self):
+        if self._timing_service is None:
+            self._timing_service = PhaseTimingService([self])
+
+        return self._timing_service
+
     def get_taper_params(self, engine, source):
-        store = engine.get_store(self.store_id)
+        timing = self.get_timing_service()
         config = self.misfit_config
-        tmin_fit = source.time + store.t(config.tmin, source, self)
-        tmax_fit = source.time + store.t(config.tmax, source, self)
+        tmin_fit = source.time + timing.t(engine, config.tmin, source, self)
+        tmax_fit = source.time + timing.t(engine, config.tmax, source, self)
         if config.fmin > 0.0:
             tfade = 1.0/config.fmin
         else:
@@ -317,9 +331,8 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         ds = self.get_dataset()
 
         if config.pick_synthetic_traveltime and config.pick_phasename:
-            store = engine.get_store(self.store_id)
-            tsyn = source.time + store.t(
-                config.pick_synthetic_traveltime, source, self)
+            tsyn = source.time + self.get_timing_service().t(
+                engine, config.pick_synthetic_traveltime, source, self)
 
             marker = ds.get_pick(
                 source.name,
@@ -348,72 +361,114 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
     def post_process(self, engine, source, tr_syn):
 
         tr_syn = tr_syn.pyrocko_trace()
-        nslc = self.codes
-
-        config = self.misfit_config
 
         tmin_fit, tmax_fit, tfade, tfade_taper = \
             self.get_taper_params(engine, source)
 
-        ds = self.get_dataset()
-
         tobs, tsyn = self.get_pick_shift(engine, source)
         if None not in (tobs, tsyn):
             tobs_shift = tobs - tsyn
         else:
             tobs_shift = 0.0
 
+        # snap fit window and alignment shift to the sampling grid, so that
+        # the processed observed trace can be reused for other models
+        deltat = tr_syn.deltat
+        ishifts = tuple(
+            int(round(t / deltat)) for t in (tmin_fit, tmax_fit, tobs_shift))
+        tmin_fit, tmax_fit, tobs_shift = (i * deltat for i in ishifts)
+
         tr_syn.extend(
             tmin_fit - tfade * 2.0,
             tmax_fit + tfade * 2.0,
             fillmethod='repeat')
 
-        freqlimits = self.get_freqlimits()
+        deferred = WaveformPostProcess(
+            self, tr_syn, tmin_fit, tmax_fit, tfade, tfade_taper,
+            tobs_shift, tsyn, ishifts, self._piggyback_subtargets)
 
-        tr_syn = tr_syn.transfer(
-            freqlimits=freqlimits,
-            tfade=tfade)
+        self._piggyback_subtargets = []
 
-        tr_syn.chop(tmin_fit - 2*tfade, tmax_fit + 2*tfade)
+        if self._defer_post_process:
+            return deferred
 
-        tmin_obs, tmax_obs = self.get_cutout_timespan(
-            tmin_fit+tobs_shift, tmax_fit+tobs_shift, tfade)
+        return WaveformPostProcess.complete_many([deferred])[0]
 
-        try:
+    def finish_post_process(self, deferred, tr_syn):
+        '''
+        Compute misfit result from filtered synthetic trace.
+
+        Second half of :py:meth:`post_process`, called by
+        :py:meth:`WaveformPostProcess.complete_many`.
+        '''
+
+        d = deferred
+        nslc = self.codes
+        config = self.misfit_config
+        ds = self.get_dataset()
+        freqlimits = self.get_freqlimits()
+
+        tr_syn.chop(d.tmin_fit - 2*d.tfade, d.tmax_fit + 2*d.tfade)
+
+        taper = trace.CosTaper(
+            d.tmin_fit - d.tfade_taper,
+            d.tmin_fit,
+            d.tmax_fit,
+            d.tmax_fit + d.tfade_taper)
+
+        def get_observed():
             tr_obs = ds.get_waveform(
                 nslc,
                 tinc_cache=1.0/(config.fmin or 0.1*config.fmax),
-                tmin=tmin_fit+tobs_shift-tfade,
-                tmax=tmax_fit+tobs_shift+tfade,
-                tfade=tfade,
+                tmin=d.tmin_fit+d.tobs_shift-d.tfade,
+                tmax=d.tmax_fit+d.tobs_shift+d.tfade,
+                tfade=d.tfade,
                 freqlimits=freqlimits,
                 deltat=tr_syn.deltat,
                 cache=True,
                 backazimuth=self.get_backazimuth_for_waveform())
 
-            if tobs_shift != 0.0:
+            if d.tobs_shift != 0.0:
                 tr_obs = tr_obs.copy()
-                tr_obs.shift(-tobs_shift)
+                tr_obs.shift(-d.tobs_shift)
+
+            return tr_obs
+
+        try:
+            out = None
+            if self._result_mode == 'sparse' and not d.subtargets:
+                tr_obs = None
+                processed_obs = self._observed_cache.get(
+                    d.ishifts,
+                    lambda: _process_array(
+                        get_observed(), *taper.time_span(),
+                        taper=taper, domain=config.domain))
+
+                nframe = _frame(*taper.time_span(), tr_syn.deltat)[1]
+                if self._misfit_buffer.size < nframe:
+                    self._misfit_buffer = num.empty(nframe)
+
+                out = self._misfit_buffer
+            else:
+                tr_obs = get_observed()
+                processed_obs = None
 
             mr = misfit(
                 tr_obs, tr_syn,
-                taper=trace.CosTaper(
-                    tmin_fit - tfade_taper,
-                    tmin_fit,
-                    tmax_fit,
-                    tmax_fit + tfade_taper),
+                taper=taper,
                 domain=config.domain,
                 exponent=config.norm_exponent,
                 flip=self.flip_norm,
                 result_mode=self._result_mode,
                 tautoshift_max=config.tautoshift_max,
                 autoshift_penalty_max=config.autoshift_penalty_max,
-                subtargets=self._piggyback_subtargets)
+                subtargets=d.subtargets,
+                processed_obs=processed_obs,
+                out=out)
 
-            self._piggyback_subtargets = []
-
-            mr.tobs_shift = float(tobs_shift)
-            mr.tsyn_pick = float_or_none(tsyn)
+            if isinstance(mr, WaveformMisfitResult):
+                mr.tobs_shift = float(d.tobs_shift)
+                mr.tsyn_pick = float_or_none(d.tsyn)
 
             return mr
 
@@ -438,9 +493,112 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         self._piggyback_subtargets.append(subtarget)
 
 
+class WaveformPostProcess(DeferredResult):
+    '''
+    Synthetic trace of a :py:class:`WaveformMisfitTarget` awaiting filtering.
+
+    The synthetics of all deferred results are band-pass filtered together
+    with :py:func:`transfer_many`, before the misfits are computed.
+    '''
+
+    def __init__(
+            self, target, tr_syn, tmin_fit, tmax_fit, tfade, tfade_taper,
+            tobs_shift, tsyn, ishifts, subtargets):
+
+        self.target = target
+        self.tr_syn = tr_syn
+        self.tmin_fit = tmin_fit
+        self.tmax_fit = tmax_fit
+        self.tfade = tfade
+        self.tfade_taper = tfade_taper
+        self.tobs_shift = tobs_shift
+        self.tsyn = tsyn
+        self.ishifts = ishifts
+        self.subtargets = subtargets
+
+    @classmethod
+    def complete_many(cls, deferred_results):
+        trs_syn = transfer_many(
+            [d.tr_syn for d in deferred_results],
+            [d.tfade for d in deferred_results],
+            [d.target.get_freqlimits() for d in deferred_results])
+
+        results = []
+        for d, tr_syn in zip(deferred_results, trs_syn):
+            try:
+                results.append(d.target.finish_post_process(d, tr_syn))
+            except gf.SeismosizerError as e:
+                results.append(e)
+
+        return results
+
+
+def transfer_many(trs, tfades, freqlimitss):
+    '''
+    Band-pass filter many traces.
+
+    Same as calling :py:meth:`pyrocko.trace.Trace.transfer` with ``tfade``
+    and ``freqlimits`` on each trace but traces with equal sampling interval,
+    FFT length, fading time and filter are zero-padded into one 2D array and
+    transformed together.
+
+    :returns: list of filtered traces
+    '''
+
+    groups = {}
+    for itr, (tr, tfade, freqlimits) in enumerate(
+            zip(trs, tfades, freqlimitss)):
+
+        if tr.tmax - tr.tmin <= tfade*2.:
+            raise trace.TraceTooShort(
+                'Trace %s.%s.%s.%s too short for fading length setting. '
+                'trace length = %g, fading length = %g'
+                % (tr.nslc_id + (tr.tmax-tr.tmin, tfade)))
+
+        ntrans = trace.nextpow2(tr.ydata.size*1.2)
+        groups.setdefault(
+            (tr.deltat, ntrans, tuple(freqlimits), tfade), []).append(itr)
+
+    trs_filtered = [None] * len(trs)
+    for (deltat, ntrans, freqlimits, tfade), itrs in groups.items():
+        coeffs = trs[itrs[0]]._get_tapered_coeffs(
+            ntrans, freqlimits, trace.g_one_response)
+
+        tapers = {}
+        data_pad = num.zeros((len(itrs), ntrans))
+        for irow, itr in enumerate(itrs):
+            data = trs[itr].ydata
+            ndata = data.size
+            row = data_pad[irow, :ndata]
+            row[:] = data
+            row -= data.mean()
+            if tfade != 0.0:
+                if ndata not in tapers:
+                    tapers[ndata] = trace.costaper(
+                        0., tfade, deltat*(ndata-1)-tfade, deltat*ndata,
+                        ndata, deltat)
+
+                row *= tapers[ndata]
+
+        fdata = scipy.fft.rfft(data_pad, axis=1)
+        fdata *= coeffs[num.newaxis, :]
+        ddata = scipy.fft.irfft(fdata, n=ntrans, axis=1)
+
+        for irow, itr in enumerate(itrs):
+            tr = trs[itr].copy(data=False)
+            tr.set_ydata(ddata[irow, :trs[itr].ydata.size].copy())
+            if tfade != 0.0:
+                tr.chop(tr.tmin+tfade, tr.tmax-tfade, inplace=True)
+
+            trs_filtered[itr] = tr
+
+    return trs_filtered
+
+
 def misfit(
         tr_obs, tr_syn, taper, domain, exponent, tautoshift_max,
-        autoshift_penalty_max, flip, result_mode='sparse', subtargets=[]):
+        autoshift_penalty_max, flip, result_mode='sparse', subtargets=[],
+        processed_obs=None, out=None):
 
     '''
     Calculate misfit between observed and synthetic trace.
@@ -461,14 +619,39 @@ tautoshift**2 / tautoshift_max**2``
         computed against *tr_syn* rather than *tr_obs*
     :param result_mode: ``'full'``, include traces and spectra or ``'sparse'``,
         include only misfit and normalization factor in result
-
-    :returns: object of type :py:class:`WaveformMisfitResult`
+    :param processed_obs: if not ``None``, reuse observed data and spectrum
+        as previously returned by :py:func:`_process_array` for the same taper
+        and domain. *tr_obs* is ignored in this case. Only used in
+        ``'sparse'`` mode without subtargets.
+    :param out: optional buffer for the processed synthetic trace, see
+        :py:func:`_process_array`. Only used in ``'sparse'`` mode without
+        subtargets.
+
+    :returns: object of type :py:class:`WaveformMisfitResult` or, in
+        ``'sparse'`` mode without subtargets,
+        :py:class:`~grond.targets.base.SparseMisfitResult`
     '''
 
-    trace.assert_same_sampling_rate(tr_obs, tr_syn)
-    deltat = tr_obs.deltat
     tmin, tmax = taper.time_span()
 
+    if result_mode == 'sparse' and not subtargets:
+        # plain arrays, no trace or result objects are created
+        if processed_obs is None:
+            trace.assert_same_sampling_rate(tr_obs, tr_syn)
+            processed_obs = _process_array(tr_obs, tmin, tmax, taper, domain)
+
+        y_obs, spec_obs = processed_obs
+        y_syn, spec_syn = _process_array(
+            tr_syn, tmin, tmax, taper, domain, out=out)
+
+        m, n, _, _ = _misfit_values(
+            y_obs, spec_obs, y_syn, spec_syn, tr_syn.deltat, domain,
+            exponent, tautoshift_max, autoshift_penalty_max, flip)
+
+        return SparseMisfitResult(
+            misfits=num.array([[m, n]], dtype=num.float))
+
+    trace.assert_same_sampling_rate(tr_obs, tr_syn)
     tr_proc_obs, trspec_proc_obs = _process(tr_obs, tmin, tmax, taper, domain)
     tr_proc_syn, trspec_proc_syn = _process(tr_syn, tmin, tmax, taper, domain)
 
@@ -478,11 +661,64 @@ tautoshift**2 / tautoshift_max**2``
             subtarget.evaluate(
                 tr_proc_obs, trspec_proc_obs, tr_proc_syn, trspec_proc_syn))
 
-    tshift = None
+    m, n, tshift, cc = _misfit_values(
+        tr_proc_obs.ydata,
+        trspec_proc_obs.ydata if trspec_proc_obs else None,
+        tr_proc_syn.ydata,
+        trspec_proc_syn.ydata if trspec_proc_syn else None,
+        tr_proc_obs.deltat, domain, exponent, tautoshift_max,
+        autoshift_penalty_max, flip,
+        tshift_offset=tr_proc_obs.tmin - tr_proc_syn.tmin)
+
     ctr = None
-    deltat = tr_proc_obs.deltat
+    if cc is not None and result_mode == 'full':
+        kmin, ydata = cc
+        ctr = tr_proc_syn.copy(data=False)
+        ctr.set_ydata(ydata)
+        ctr.set_codes(*trace.merge_codes(tr_proc_syn, tr_proc_obs, '~'))
+        ctr.shift(
+            -ctr.tmin + tr_proc_obs.tmin - tr_proc_syn.tmin
+            + kmin*tr_proc_obs.deltat)
+
+    if result_mode == 'full':
+        result = WaveformMisfitResult(
+            misfits=num.array([[m, n]], dtype=num.float),
+            processed_obs=tr_proc_obs,
+            processed_syn=tr_proc_syn,
+            filtered_obs=tr_obs.copy(),
+            filtered_syn=tr_syn,
+            spectrum_obs=trspec_proc_obs,
+            spectrum_syn=trspec_proc_syn,
+            taper=taper,
+            tshift=tshift,
+            cc=ctr)
+
+    elif result_mode == 'sparse':
+        result = WaveformMisfitResult(
+            misfits=num.array([[m, n]], dtype=num.float))
+    else:
+        assert False
+
+    result.piggyback_subresults = piggyback_results
+
+    return result
+
+
+def _misfit_values(
+        y_obs, spec_obs, y_syn, spec_syn, deltat, domain, exponent,
+        tautoshift_max, autoshift_penalty_max, flip, tshift_offset=0.0):
+
+    '''
+    Misfit computation of :py:func:`misfit` on processed data arrays.
+
+    :returns: ``(m, n, tshift, cc)``, where ``cc`` is ``(kmin, ydata)`` with
+        the cross correlation for ``'cc_max_norm'`` and ``None`` otherwise.
+    '''
+
+    tshift = None
+    cc = None
     if domain in ('time_domain', 'envelope', 'absolute'):
-        a, b = tr_proc_syn.ydata, tr_proc_obs.ydata
+        a, b = y_syn, y_obs
         if flip:
             b, a = a, b
 
@@ -492,49 +728,60 @@ tautoshift**2 / tautoshift_max**2``
         if nshift_max == 0:
             m, n = trace.Lx_norm(a, b, norm=exponent)
         else:
-            mns = []
-            for ishift in range(-nshift_max, nshift_max+1):
-                if ishift < 0:
-                    a_cut = a[-ishift:]
-                    b_cut = b[:ishift]
-                elif ishift == 0:
-                    a_cut = a
-                    b_cut = b
-                elif ishift > 0:
-                    a_cut = a[:-ishift]
-                    b_cut = b[ishift:]
-
-                mns.append(trace.Lx_norm(a_cut, b_cut, norm=exponent))
-
-            ms, ns = num.array(mns).T
+            if exponent == 2:
+                ms, ns = _l2_norm_shifts(a, b, nshift_max)
+            else:
+                mns = []
+                for ishift in range(-nshift_max, nshift_max+1):
+                    a_cut, b_cut = _cut_shifted(a, b, ishift)
+                    mns.append(trace.Lx_norm(a_cut, b_cut, norm=exponent))
+
+                ms, ns = num.array(mns).T
 
             iarg = num.argmin(ms)
             tshift = (iarg-nshift_max)*deltat
 
-            m, n = ms[iarg], ns[iarg]
+            if exponent == 2:
+                # recompute exactly, the fast path is affected by rounding
+                # errors for near-perfect fits
+                a_cut, b_cut = _cut_shifted(a, b, iarg-nshift_max)
+                m, n = trace.Lx_norm(a_cut, b_cut, norm=exponent)
+            else:
+                m, n = ms[iarg], ns[iarg]
+
             m += autoshift_penalty_max * n * tshift**2 / tautoshift_max**2
 
     elif domain == 'cc_max_norm':
+        a, b = y_syn, y_obs
+        if tautoshift_max > 0.0:
+            nshift_max = max(0, min(a.size-1,
+                                    int(math.floor(tautoshift_max / deltat))))
+            kmin, kmax = -nshift_max, nshift_max
+        else:
+            # lag range of mode='same' correlation
+            kmin = -(b.size-1) + (a.size+b.size-1 - max(a.size, b.size)) // 2
+            kmax = kmin + max(a.size, b.size) - 1
+
+        ydata = _correlate_lags(a, b, kmin, kmax) / (
+            num.sqrt(num.sum(a**2)) * num.sqrt(num.sum(b**2)))
 
-        ctr = trace.correlate(
-            tr_proc_syn,
-            tr_proc_obs,
-            mode='same',
-            normalization='normal')
+        icc_max = num.argmax(ydata)
+        cc_max = ydata[icc_max]
+        tshift = tshift_offset + (kmin+icc_max)*deltat
+        cc = kmin, ydata
 
-        tshift, cc_max = ctr.max()
         m = 0.5 - 0.5 * cc_max
         n = 0.5
 
     elif domain == 'frequency_domain':
-        a, b = trspec_proc_syn.ydata, trspec_proc_obs.ydata
+        a, b = spec_syn, spec_obs
         if flip:
             b, a = a, b
 
         m, n = trace.Lx_norm(num.abs(a), num.abs(b), norm=exponent)
 
     elif domain == 'log_frequency_domain':
-        a, b = trspec_proc_syn.ydata, trspec_proc_obs.ydata
+        a, b = spec_syn, spec_obs
         if flip:
             b, a = a, b
 
@@ -550,37 +797,73 @@ tautoshift**2 / tautoshift_max**2``
 
         m, n = trace.Lx_norm(a, b, norm=exponent)
 
-    if result_mode == 'full':
-        result = WaveformMisfitResult(
-            misfits=num.array([[m, n]], dtype=num.float),
-            processed_obs=tr_proc_obs,
-            processed_syn=tr_proc_syn,
-            filtered_obs=tr_obs.copy(),
-            filtered_syn=tr_syn,
-            spectrum_obs=trspec_proc_obs,
-            spectrum_syn=trspec_proc_syn,
-            taper=taper,
-            tshift=tshift,
-            cc=ctr)
+    return m, n, tshift, cc
 
-    elif result_mode == 'sparse':
-        result = WaveformMisfitResult(
-            misfits=num.array([[m, n]], dtype=num.float))
+
+def _cut_shifted(a, b, ishift):
+    if ishift < 0:
+        return a[-ishift:], b[:ishift]
+    elif ishift == 0:
+        return a, b
     else:
-        assert False
+        return a[:-ishift], b[ishift:]
 
-    result.piggyback_subresults = piggyback_results
 
-    return result
+def _correlate_lags(a, b, kmin, kmax):
+    '''
+    Cross correlation ``c[k] = sum_i a[i] * b[i+k]``, computed in the
+    frequency domain for the lags ``kmin <= k <= kmax`` only.
+    '''
 
+    nfft = trace.nextpow2(max(a.size, b.size) + max(abs(kmin), abs(kmax)))
+    c = num.fft.irfft(
+        num.conj(num.fft.rfft(a, nfft)) * num.fft.rfft(b, nfft), nfft)
 
-def _extend_extract(tr, tmin, tmax):
-    deltat = tr.deltat
+    return c[num.arange(kmin, kmax+1) % nfft]
+
+
+def _l2_norm_shifts(a, b, nshift_max):
+    '''
+    L2 misfits and normalisations of ``a`` and ``b`` shifted against each
+    other by ``-nshift_max`` to ``nshift_max`` samples.
+
+    Same as calling :py:func:`pyrocko.trace.Lx_norm` on the overlapping parts
+    for each shift but computed from the cross correlation and cumulative
+    energy sums.
+    '''
+
+    n = a.size
+    ishifts = num.arange(-nshift_max, nshift_max+1)
+    cum_a = num.concatenate(([0.0], num.cumsum(a**2)))
+    cum_b = num.concatenate(([0.0], num.cumsum(b**2)))
+
+    energy_a = cum_a[n - num.maximum(ishifts, 0)] \
+        - cum_a[num.maximum(-ishifts, 0)]
+    energy_b = cum_b[n - num.maximum(-ishifts, 0)] \
+        - cum_b[num.maximum(ishifts, 0)]
+
+    cross = _correlate_lags(a, b, -nshift_max, nshift_max)
+
+    ms = num.sqrt(num.maximum(energy_a + energy_b - 2.0*cross, 0.0))
+    ns = num.sqrt(num.maximum(energy_b, 0.0))
+    return ms, ns
+
+
+def _frame(tmin, tmax, deltat):
     itmin_frame = int(math.floor(tmin/deltat))
     itmax_frame = int(math.ceil(tmax/deltat))
-    nframe = itmax_frame - itmin_frame + 1
+    return itmin_frame, itmax_frame - itmin_frame + 1
+
+
+def _extend_extract_array(tr, tmin, tmax, out=None):
+    deltat = tr.deltat
+    itmin_frame, nframe = _frame(tmin, tmax, deltat)
     n = tr.data_len()
-    a = num.empty(nframe, dtype=num.float)
+    if out is None:
+        a = num.empty(nframe, dtype=num.float)
+    else:
+        a = out[:nframe]
+
     itmin_tr = int(round(tr.tmin / deltat))
     itmax_tr = itmin_tr + n
     icut1 = min(max(0, itmin_tr - itmin_frame), nframe)
@@ -590,40 +873,60 @@ def _extend_extract(tr, tmin, tmax):
     a[:icut1] = tr.ydata[0]
     a[icut1:icut2] = tr.ydata[icut1_tr:icut2_tr]
     a[icut2:] = tr.ydata[-1]
+    return itmin_frame, a
+
+
+def _extend_extract(tr, tmin, tmax):
+    itmin_frame, a = _extend_extract_array(tr, tmin, tmax)
     tr = tr.copy(data=False)
-    tr.tmin = itmin_frame * deltat
+    tr.tmin = itmin_frame * tr.deltat
     tr.set_ydata(a)
     return tr
 
 
-def _process(tr, tmin, tmax, taper, domain):
-    tr_proc = _extend_extract(tr, tmin, tmax)
-    tr_proc.taper(taper)
+def _process_array(tr, tmin, tmax, taper, domain, out=None):
+    '''
+    Same as :py:func:`_process` but returning plain arrays.
 
-    df = None
-    trspec_proc = None
+    :param out: optional array with at least as many samples as the
+        extracted time window, to be used as buffer for the processed data
+    :returns: ``(ydata, spectrum)``, where spectrum is ``None`` for time
+        domain misfits
+    '''
+
+    deltat = tr.deltat
+    itmin_frame, y = _extend_extract_array(tr, tmin, tmax, out=out)
+    taper(y, itmin_frame * deltat, deltat)
 
+    spectrum = None
     if domain == 'envelope':
-        tr_proc = tr_proc.envelope(inplace=False)
-        tr_proc.set_ydata(num.abs(tr_proc.get_ydata()))
+        y = num.abs(trace.hilbert(y))
 
     elif domain == 'absolute':
-        tr_proc.set_ydata(num.abs(tr_proc.get_ydata()))
+        y = num.abs(y, out=y)
 
     elif domain in ('frequency_domain', 'log_frequency_domain'):
-        ndata = tr_proc.ydata.size
-        nfft = trace.nextpow2(ndata)
-        padded = num.zeros(nfft, dtype=num.float)
-        padded[:ndata] = tr_proc.ydata
-        spectrum = num.fft.rfft(padded)
-        df = 1.0 / (tr_proc.deltat * nfft)
+        spectrum = num.fft.rfft(y, trace.nextpow2(y.size))
+
+    return y, spectrum
+
 
+def _process(tr, tmin, tmax, taper, domain):
+    ydata, spectrum = _process_array(tr, tmin, tmax, taper, domain)
+
+    tr_proc = tr.copy(data=False)
+    tr_proc.tmin = _frame(tmin, tmax, tr.deltat)[0] * tr.deltat
+    tr_proc.set_ydata(ydata)
+
+    trspec_proc = None
+    if spectrum is not None:
+        nfft = trace.nextpow2(ydata.size)
         trspec_proc = TraceSpectrum(
             network=tr_proc.network,
             station=tr_proc.station,
             location=tr_proc.location,
             channel=tr_proc.channel,
-            deltaf=df,
+            deltaf=1.0 / (tr_proc.deltat * nfft),
             fmin=0.0,
             ydata=spectrum)
 
@@ -57,6 +57,9 @@ class WOACTarget(MisfitTarget):
 
     can_bootstrap_weights = True
 
+    # piggyback subtargets are consumed by the first source processed
+    can_batch_modelling = False
+
     def __init__(self, **kwargs):
         MisfitTarget.__init__(self, **kwargs)
         self.piggy_ids = set()
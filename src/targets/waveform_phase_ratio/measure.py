@@ -114,15 +114,51 @@ class FeatureMeasure(Object):
 
         return mtargets
 
+    def get_time_windows(self, engine, source, targets, snap=False):
+        '''
+        Get measurement time windows ``(tmin, tmax)`` for given targets.
+
+        Targets with channels not handled by this measure get ``None``. If
+        ``snap`` is ``True``, the window limits are snapped to the sampling
+        interval of the GF store.
+        '''
+
+        windows = []
+        for target in targets:
+            if target.codes[-1] not in self.channels:
+                windows.append(None)
+                continue
+
+            store = engine.get_store(target.store_id)
+            deltat = store.config.deltat
+
+            window = []
+            for timing in (self.timing_tmin, self.timing_tmax):
+                t = store.t(timing, source, target)
+                if t is not None:
+                    t += source.time
+                    if snap:
+                        t = round(t / deltat) * deltat
+
+                window.append(t)
+
+            windows.append(tuple(window))
+
+        return windows
+
     def evaluate(
             self, engine, source, targets,
             dataset=None,
             trs=None,
             extra_responses=[],
-            debug=False):
+            debug=False,
+            time_windows=None):
 
         from ..waveform import target as base
 
+        if time_windows is None:
+            time_windows = self.get_time_windows(engine, source, targets)
+
         trs_processed = []
         trs_orig = []
         for itarget, target in enumerate(targets):
@@ -131,8 +167,10 @@ class FeatureMeasure(Object):
 
             store = engine.get_store(target.store_id)
 
-            tmin = source.time + store.t(self.timing_tmin, source, target)
-            tmax = source.time + store.t(self.timing_tmax, source, target)
+            tmin, tmax = time_windows[itarget]
+            if tmin is None or tmax is None:
+                raise FeatureMeasurementFailed(
+                    'timing determination failed (phase unavailable?)')
 
             if self.fmin is not None and self.fmax is not None:
                 freqlimits = [
@@ -207,10 +245,6 @@ class FeatureMeasure(Object):
                     raise FeatureMeasurementFailed(
                         'transfer: trace too short')
 
-            if tmin is None or tmax is None:
-                raise FeatureMeasurementFailed(
-                    'timing determination failed (phase unavailable?)')
-
             tr.chop(tmin, tmax)
 
             tr.set_location(tr.location + '-' + self.name + '-proc')
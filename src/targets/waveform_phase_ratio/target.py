@@ -197,19 +197,30 @@ class PhaseRatioTarget(gf.Location, MisfitTarget):
         try:
             imt = 0
             amps = []
-            for measure in [self.measure_a, self.measure_b]:
+            for imeasure, measure in enumerate(
+                    [self.measure_a, self.measure_b]):
+
                 nmt_this = measure.get_nmodelling_targets()
-                amp_obs, _ = measure.evaluate(
-                    engine, source,
-                    modelling_targets[imt:imt+nmt_this],
-                    dataset=ds)
+                mtargets = modelling_targets[imt:imt+nmt_this]
+
+                # windows are snapped to the sampling interval, so that the
+                # observed amplitude can be reused for other models
+                time_windows = measure.get_time_windows(
+                    engine, source, mtargets, snap=True)
+
+                amp_obs = self._observed_cache.get(
+                    (imeasure, tuple(time_windows)),
+                    lambda: measure.evaluate(
+                        engine, source, mtargets,
+                        dataset=ds,
+                        time_windows=time_windows)[0])
 
                 amp_syn, _ = measure.evaluate(
-                    engine, source,
-                    modelling_targets[imt:imt+nmt_this],
+                    engine, source, mtargets,
                     trs=[r.trace.pyrocko_trace()
                          for r
-                         in modelling_results[imt:imt+nmt_this]])
+                         in modelling_results[imt:imt+nmt_this]],
+                    time_windows=time_windows)
 
                 amps.append((amp_obs, amp_syn))
 
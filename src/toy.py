@@ -93,6 +93,12 @@ class ToyProblem(Problem):
                 [t.obs_distance for t in self.targets],
                 dtype=num.float)
 
+    def evaluate(self, x, mask=None, result_mode='full', targets=None):
+        return self.misfits(x, mask=mask)
+
+    def evaluate_many(self, xs, mask=None, result_mode='full', targets=None):
+        return self.misfits_many(xs, mask=mask)
+
     def misfits(self, x, mask=None):
         self._setup_modelling()
         distances = num.sqrt(
@@ -104,7 +110,7 @@ class ToyProblem(Problem):
             * num.mean(num.abs(self._obs_distances))
         return misfits
 
-    def misfits_many(self, xs):
+    def misfits_many(self, xs, mask=None):
         self._setup_modelling()
         distances = num.sqrt(
             num.sum(
@@ -0,0 +1,332 @@
+from __future__ import print_function
+
+import os
+import os.path as op
+
+import numpy as num
+
+from pyrocko import io, model, trace
+from pyrocko.io import stationxml
+from pyrocko.fdsn import enhanced_sacpz
+from grond.dataset import Dataset, DatasetConfig
+from grond.dataset_cache import DatasetCache, MetadataCache, \
+    NoiseRealisationCache, ResponseCache, WaveformDiskCache, get_nbytes
+
+
+def make_dataset(data_dir, nstations=3):
+    rstate = num.random.RandomState(42)
+    tmin = 1e9
+    deltat = 0.1
+    n = 6000
+
+    stations = []
+    responses = []
+    for ista in range(nstations):
+        sta = 'S%i' % ista
+        station = model.Station(
+            'XX', sta, '', lat=float(ista), lon=0.)
+        station.set_channels_by_name('E', 'N', 'Z')
+        stations.append(station)
+
+        trs = []
+        for cha in 'ENZ':
+            trs.append(trace.Trace(
+                'XX', sta, '', cha, tmin=tmin, deltat=deltat,
+                ydata=rstate.normal(size=n)))
+
+            responses.append(enhanced_sacpz.EnhancedSacPzResponse(
+                codes=('XX', sta, '', cha),
+                tmin=tmin - 1000.,
+                lat=0., lon=0., elevation=0., depth=0., dip=0., azimuth=0.,
+                input_unit='M', output_unit='COUNTS',
+                response=trace.PoleZeroResponse(
+                    zeros=[0., 0.], poles=[-1.+1.j, -1.-1.j],
+                    constant=1e9)))
+
+        io.save(trs, os.path.join(data_dir, '%s.mseed' % sta))
+
+    def make():
+        ds = Dataset()
+        ds.add_stations(stations=stations)
+        ds.add_waveforms(paths=[data_dir])
+        for x in responses:
+            ds.responses[x.codes].append(x)
+
+        return ds
+
+    return make, tmin, tmin + n * deltat
+
+
+def test_waveform_disk_cache(tmpdir):
+    data_dir = str(tmpdir.mkdir('data'))
+    cache_dir = str(tmpdir.join('cache'))
+    make, tmin, tmax = make_dataset(data_dir)
+
+    kwargs = dict(
+        tmin=tmin + 100., tmax=tmin + 400., tfade=20.,
+        freqlimits=(0.01, 0.02, 1.0, 2.0), deltat=0.2)
+
+    def get_all(ds):
+        return [ds.get_waveform(('XX', 'S%i' % i, '', 'Z'), **kwargs)
+                for i in range(3)]
+
+    trs_ref = get_all(make())
+
+    disk_cache = WaveformDiskCache(cache_dir, size_max=1e9)
+    ds = make()
+    ds.set_disk_cache(disk_cache)
+    for tr_ref, tr in zip(trs_ref, get_all(ds)):
+        num.testing.assert_equal(tr.ydata, tr_ref.ydata)
+
+    assert disk_cache.nmisses == 3 and disk_cache.nhits == 0
+
+    disk_cache = WaveformDiskCache(cache_dir, size_max=1e9)
+    ds = make()
+    ds.set_disk_cache(disk_cache)
+    for tr_ref, tr in zip(trs_ref, get_all(ds)):
+        num.testing.assert_equal(tr.ydata, tr_ref.ydata)
+        assert tr.tmin == tr_ref.tmin and tr.deltat == tr_ref.deltat
+
+    assert disk_cache.nmisses == 0 and disk_cache.nhits == 3
+
+    fn = os.path.join(data_dir, 'S0.mseed')
+    st = os.stat(fn)
+    os.utime(fn, (st.st_atime, st.st_mtime + 10.))
+
+    disk_cache = WaveformDiskCache(cache_dir, size_max=1e9)
+    ds = make()
+    ds.set_disk_cache(disk_cache)
+    get_all(ds)
+    assert disk_cache.nmisses == 1 and disk_cache.nhits == 2
+
+    disk_cache = WaveformDiskCache(cache_dir, size_max=1)
+    ds = make()
+    ds.set_disk_cache(disk_cache)
+    ds.get_waveform(('XX', 'S0', '', 'N'), **kwargs)
+    assert not any(fn.endswith('.npy') for fn in os.listdir(cache_dir))
+
+
+def test_dataset_cache():
+    def tr(n):
+        return trace.Trace(ydata=num.zeros(n))
+
+    cache = DatasetCache(size_max=8000, nentries_max=3)
+    cache['a'] = tr(500)
+    cache['b'] = tr(500)
+    assert cache.get('a') is not None
+    cache['c'] = tr(500)
+    assert 'b' not in cache and 'a' in cache
+    assert cache.size == 8000 and cache.nevictions == 1
+
+    cache['d'] = ValueError()
+    cache['e'] = ValueError()
+    assert len(cache) == 3 and 'a' not in cache
+    assert cache.get('b') is None
+    assert (cache.nhits, cache.nmisses, cache.nevictions) == (1, 1, 2)
+
+    # cached exceptions must be bounded under the default limits
+    config = DatasetConfig()
+    cache = DatasetCache(
+        size_max=config.waveform_cache_size_max,
+        nentries_max=config.waveform_cache_nentries_max)
+
+    n = config.waveform_cache_nentries_max
+    for i in range(n + 10):
+        cache[i] = ValueError()
+
+    assert len(cache) == n and cache.nevictions == 10
+    assert 9 not in cache and 10 in cache and n + 9 in cache
+    assert cache.size == n * get_nbytes(ValueError())
+
+
+def test_pile_index(tmpdir):
+    data_dir = str(tmpdir.mkdir('data'))
+    make, tmin, tmax = make_dataset(data_dir)
+    ds = make()
+
+    for codes in [('XX', 'S1', '', 'N'), ('XX', 'S2', ''), ('XX', 'S5', '')]:
+        for load_data in (False, True):
+            kwargs = dict(
+                tmin=tmin + 10., tmax=tmin + 700., tpad=5.,
+                load_data=load_data)
+
+            trs_ref = ds.pile.all(
+                trace_selector=lambda tr: tr.nslc_id[:len(codes)] == codes,
+                **kwargs)
+
+            trs = ds._pile_all(codes, **kwargs)
+            assert len(trs) == len(trs_ref)
+            for tr, tr_ref in zip(trs, trs_ref):
+                assert tr.nslc_id == tr_ref.nslc_id
+                assert (tr.tmin, tr.tmax) == (tr_ref.tmin, tr_ref.tmax)
+                if load_data:
+                    num.testing.assert_equal(tr.ydata, tr_ref.ydata)
+
+
+def test_response_cache():
+    rstate = num.random.RandomState(23)
+    resp = trace.PoleZeroResponse(
+        zeros=[0., 0.], poles=[-1.+1.j, -1.-1.j], constant=1e9)
+
+    response_cache = ResponseCache()
+    for n in (1000, 1500, 2000):
+        tr = trace.Trace(
+            'XX', 'S1', '', 'Z', deltat=0.1, ydata=rstate.normal(size=n))
+
+        for freqlimits in [(0.01, 0.02, 1.0, 2.0), (0.05, 0.1, 0.2, 0.4)]:
+            for invert in (False, True):
+                kwargs = dict(
+                    tfade=10., freqlimits=freqlimits,
+                    transfer_function=resp, invert=invert)
+
+                num.testing.assert_equal(
+                    response_cache.transfer(tr, **kwargs).ydata,
+                    tr.transfer(**kwargs).ydata)
+
+    assert response_cache.nmisses == 2
+
+
+def test_metadata_cache(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    stations = [
+        model.Station('XX', 'S%i' % i, '', lat=float(i), lon=0.)
+        for i in range(3)]
+
+    for station in stations:
+        station.set_channels_by_name('E', 'N', 'Z')
+
+    fn_stations = str(tmpdir.join('stations.xml'))
+    stationxml.FDSNStationXML.from_pyrocko_stations(
+        stations, add_flat_responses_from='M').dump_xml(filename=fn_stations)
+
+    fn_events = str(tmpdir.join('events.txt'))
+    model.dump_events(
+        [model.Event(lat=0., lon=0., time=1e9, name='ev1')],
+        filename=fn_events)
+
+    nloads = []
+
+    def load_xml(filename):
+        nloads.append(filename)
+        return stationxml.load_xml(filename=filename)
+
+    for i in range(2):
+        cache = MetadataCache(cache_dir)
+        cache.prefetch([(load_xml, fn_stations), (load_xml, fn_stations)])
+        sx = cache.load(load_xml, fn_stations)
+        assert cache.load(load_xml, fn_stations) is sx
+        assert [s.nsl() for s in sx.get_pyrocko_stations()] \
+            == [s.nsl() for s in stations]
+
+    assert len(nloads) == 1
+
+    dataset_config = DatasetConfig(
+        stations_stationxml_paths=[fn_stations],
+        responses_stationxml_paths=[fn_stations],
+        events_path=fn_events)
+
+    dataset_config.set_basepath(str(tmpdir))
+    ds = dataset_config.get_dataset('ev1')
+    assert ds.get_event().name == 'ev1'
+    assert len(ds.get_stations()) == 3
+    assert ds.responses_stationxml[0].get_pyrocko_response(
+        ('XX', 'S1', '', 'Z'), fake_input_units='M') is not None
+
+
+def test_waveform_event_window(tmpdir):
+    data_dir = str(tmpdir.mkdir('data'))
+    tday = 86400.
+    for iday in range(4):
+        io.save(
+            [trace.Trace(
+                'XX', 'S0', '', 'Z', tmin=1e9 + iday * tday, deltat=1.0,
+                ydata=num.zeros(int(tday)-1))],
+            os.path.join(data_dir, 'day%i.mseed' % iday))
+
+    ds = Dataset()
+    ds.add_waveforms(paths=[data_dir])
+    assert len(list(ds.pile.iter_files())) == 4
+
+    ds = Dataset()
+    ds.keep_waveform_data = True
+    ds.add_waveforms(
+        paths=[data_dir], tmin=1e9 + 1.5 * tday, tmax=1e9 + 1.6 * tday)
+
+    files = list(ds.pile.iter_files())
+    assert [op.basename(file.abspath) for file in files] == ['day1.mseed']
+
+    trs = ds.get_waveform_raw(
+        ('XX', 'S0', '', 'Z'), tmin=1e9 + 1.5 * tday, tmax=1e9 + 1.6 * tday)
+    assert len(trs) == 1
+    assert files[0].data_loaded
+
+
+def test_shared_restitution(tmpdir):
+    data_dir = str(tmpdir.mkdir('data'))
+    make, tmin, tmax = make_dataset(data_dir)
+
+    kwargs = dict(tmin=tmin + 100., tmax=tmin + 400., tfade=20., deltat=0.2)
+    bands = [(0.01, 0.02, 1.0, 2.0), (0.01, 0.02, 0.1, 0.2)]
+
+    ds = make()
+    for freqlimits in bands:
+        for cha in 'ENZ':
+            tr = ds.get_waveform(
+                ('XX', 'S1', '', cha), freqlimits=freqlimits, **kwargs)
+
+            tr_ref = make().get_waveform(
+                ('XX', 'S1', '', cha), freqlimits=freqlimits, **kwargs)
+
+            num.testing.assert_equal(tr.ydata, tr_ref.ydata)
+
+    assert ds._spectrum_cache.nmisses == 3
+    assert ds._spectrum_cache.nhits == 3
+
+    for freqlimits in bands:
+        _, trs_raw = ds.get_waveform_restituted(
+            ('XX', 'S1', '', 'Z'), freqlimits=freqlimits, **kwargs)
+
+        for tr in trs_raw:
+            tr.ydata *= 2.
+            tr.chop(tr.tmin + 10., tr.tmax - 10.)
+
+    _, trs_raw_ref = make().get_waveform_restituted(
+        ('XX', 'S1', '', 'Z'), freqlimits=bands[0], **kwargs)
+
+    _, trs_raw = ds.get_waveform_restituted(
+        ('XX', 'S1', '', 'Z'), freqlimits=bands[0], **kwargs)
+
+    num.testing.assert_equal(trs_raw[0].ydata, trs_raw_ref[0].ydata)
+
+
+class Covariance(object):
+    def getQuadtreeNoise(self, rstate):
+        return rstate.normal(size=7)
+
+
+def test_noise_realisation_cache(tmpdir):
+    from pyrocko import parimap
+    from grond.targets.satellite.target import \
+        get_quadtree_noise_realisations
+
+    cov = Covariance()
+    ref = get_quadtree_noise_realisations(cov, 23, range(10))
+    assert ref.shape == (10, 7)
+
+    num.testing.assert_equal(
+        get_quadtree_noise_realisations(cov, 23, range(4, 10), nprocs=3),
+        ref[4:])
+
+    # serial fallback inside daemonic workers, e.g. of grond go --parallel
+    results = list(parimap.parimap(
+        get_quadtree_noise_realisations,
+        [cov, cov], [23, 23], [range(10), range(10)], [3, 3], nprocs=2))
+
+    for realisations in results:
+        num.testing.assert_equal(realisations, ref)
+
+    cache = NoiseRealisationCache(str(tmpdir.join('noise')))
+    key = cache.make_key('scene', 23)
+    assert cache.get(key) is None
+    cache.put(key, ref)
+    num.testing.assert_equal(cache.get(key), ref)
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+
+import numpy as num
+
+from pyrocko import gf
+from grond.toy import scenario, ToyProblem
+from grond.problems.base import ModelHistory, load_problem_data
+from grond.optimisers.evolution.optimiser import \
+    DifferentialEvolutionOptimiser
+
+
+def make_problem():
+    source, targets = scenario('wellposed', 'lownoise')
+
+    return ToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+
+def test_differential_evolution():
+    problem = make_problem()
+    source, _ = scenario('wellposed', 'lownoise')
+    x_true = num.array([source.north, source.east, source.depth])
+
+    for strategy in ['best1bin', 'rand1bin', 'current_to_best1bin']:
+        optimiser = DifferentialEvolutionOptimiser(
+            ngenerations=40,
+            population_size=15,
+            strategy=strategy,
+            nbootstrap=10,
+            sampler_seed=1)
+
+        rundir = tempfile.mkdtemp(prefix='grond-test')
+        try:
+            optimiser.optimise(problem, rundir=rundir)
+            xs, misfits, bootstrap_misfits = load_problem_data(
+                rundir, problem, nchains=optimiser.nchains)
+
+        finally:
+            shutil.rmtree(rundir)
+
+        assert xs.shape == (600, 3)
+        assert bootstrap_misfits.shape == (600, 11)
+
+        xbounds = problem.get_parameter_bounds()
+        assert num.all(xbounds[:, 0] <= xs)
+        assert num.all(xs <= xbounds[:, 1])
+
+        gms = problem.combine_misfits(misfits)
+        num.testing.assert_allclose(gms, bootstrap_misfits[:, 0])
+        gm_true = problem.combine_misfits(problem.misfits(x_true))
+        assert num.min(gms) < gm_true
+
+
+def test_differential_evolution_status():
+    problem = make_problem()
+    optimiser = DifferentialEvolutionOptimiser(
+        ngenerations=2, population_size=5, nbootstrap=10, sampler_seed=1)
+
+    history = ModelHistory(problem, nchains=optimiser.nchains, mode='w')
+    status = optimiser.get_status(history)
+    assert status.row_names[-1] == 'Misfit'
+    assert num.all(num.isnan(status.column_data['Pop best']))
+
+
+class Interrupt(Exception):
+    pass
+
+
+def test_differential_evolution_resume():
+    problem = make_problem()
+
+    def make_optimiser():
+        return DifferentialEvolutionOptimiser(
+            ngenerations=10,
+            population_size=10,
+            nbootstrap=10,
+            sampler_seed=2)
+
+    rundir = tempfile.mkdtemp(prefix='grond-test')
+    try:
+        make_optimiser().optimise(problem, rundir=rundir)
+        xs_ref, misfits_ref, _ = load_problem_data(rundir, problem)
+        shutil.rmtree(rundir)
+        os.mkdir(rundir)
+
+        optimiser = make_optimiser()
+        process_result_orig = optimiser.process_result
+        ncalls = [0]
+
+        def process_result_interrupted(*args):
+            ncalls[0] += 1
+            if ncalls[0] > 55:
+                raise Interrupt()
+
+            return process_result_orig(*args)
+
+        # interrupt in the middle of a generation
+        optimiser.process_result = process_result_interrupted
+        try:
+            optimiser.optimise(problem, rundir=rundir)
+        except Interrupt:
+            pass
+
+        assert load_problem_data(rundir, problem)[0].shape[0] == 55
+
+        make_optimiser().optimise(problem, rundir=rundir, resume=True)
+        xs, misfits, _ = load_problem_data(rundir, problem)
+
+    finally:
+        shutil.rmtree(rundir)
+
+    num.testing.assert_equal(xs, xs_ref)
+    num.testing.assert_equal(misfits, misfits_ref)
@@ -0,0 +1,405 @@
+import numpy as num
+
+from pyrocko import gf
+from grond.toy import scenario, ToyProblem
+from grond.problems.base import ModelHistory
+from grond.optimisers.highscore.optimiser import HighScoreOptimiser, \
+    UniformSamplerPhase, DirectedSamplerPhase, Chains, \
+    SamplerPhaseConvergence, SurrogateScreening, \
+    excentricity_compensated_probabilities
+
+
+def make_problem():
+    source, targets = scenario('wellposed', 'lownoise')
+
+    return ToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+
+def fill_history(problem, optimiser, nmodels):
+    history = ModelHistory(problem, nchains=optimiser.nchains, mode='w')
+    chains = optimiser.chains(problem, history)
+    xs = UniformSamplerPhase(niterations=nmodels).get_samples(
+        problem, num.arange(nmodels), chains,
+        rstate=optimiser.sampler_rstate)
+
+    for x in xs:
+        misfits = problem.misfits(x)
+        bootstrap_misfits = problem.combine_misfits(
+            misfits,
+            extra_weights=optimiser.get_bootstrap_weights(problem),
+            extra_residuals=optimiser.get_bootstrap_residuals(problem))
+
+        history.append(x, misfits, bootstrap_misfits)
+
+    return history, chains
+
+
+class DummyHistory(object):
+
+    def __init__(self, bootstrap_misfits):
+        self.bootstrap_misfits = bootstrap_misfits
+        self.nmodels = bootstrap_misfits.shape[0]
+
+    def add_listener(self, listener):
+        pass
+
+
+def test_chains_insert():
+    rstate = num.random.RandomState(10)
+    nmodels, nchains, nlinks_cap = 500, 5, 17
+
+    # rounding produces ties
+    bootstrap_misfits = num.round(
+        rstate.uniform(size=(nmodels, nchains)) * 20.) / 20.
+
+    links = [[] for ichain in range(nchains)]
+    accept_sum = num.zeros(nchains, dtype=num.int)
+    for imodel in range(nmodels):
+        for ichain in range(nchains):
+            m = bootstrap_misfits[imodel, ichain]
+            ipos = sum(1 for (m_link, _) in links[ichain] if m_link <= m)
+            links[ichain].insert(ipos, (m, imodel))
+            accept_sum[ichain] += ipos < nlinks_cap - 1
+            del links[ichain][nlinks_cap-1:]
+
+    for steps in [[nmodels], range(1, nmodels+1), [3, 17, 18, 260, nmodels]]:
+        chains = Chains(
+            None, DummyHistory(bootstrap_misfits), nchains, nlinks_cap)
+
+        for n in steps:
+            chains.goto(n)
+
+        num.testing.assert_equal(chains.accept_sum, accept_sum)
+        for ichain in range(nchains):
+            num.testing.assert_equal(
+                chains.indices(ichain),
+                [imodel for (_, imodel) in links[ichain]])
+
+
+def test_excentricity_compensated_probabilities():
+    rstate = num.random.RandomState(10)
+    xs = rstate.normal(size=(200, 10)) * rstate.uniform(size=10)
+    sbx = num.std(xs, axis=0)
+    sbx[3] = 0.0
+
+    scale = num.zeros_like(sbx)
+    scale[sbx != 0.0] = 1.0 / (sbx[sbx != 0.0] * 2.)
+    distances_sqr_all = num.sum(
+        ((xs[num.newaxis, :, :] - xs[:, num.newaxis, :]) *
+         scale[num.newaxis, num.newaxis, :])**2, axis=2)
+    probabilities = 1.0 / num.sum(distances_sqr_all < 1.0, axis=1)
+    probabilities /= num.sum(probabilities)
+
+    num.testing.assert_allclose(
+        excentricity_compensated_probabilities(xs, sbx, 2.),
+        probabilities)
+
+
+def test_chains_covariance():
+    problem = make_problem()
+    optimiser = HighScoreOptimiser(
+        sampler_phases=[UniformSamplerPhase(niterations=1)],
+        nbootstrap=10,
+        sampler_seed=1)
+
+    history, _ = fill_history(problem, optimiser, 600)
+    chains = optimiser.chains(problem, history)
+    chains.goto(100)
+    for n in [101, 150, 151, 400, 600]:
+        chains.goto(n)
+        for ichain in range(chains.nchains):
+            cov = chains.covariance_models(ichain)
+            num.testing.assert_allclose(
+                cov, num.cov(chains.models(ichain).T), rtol=1e-8, atol=1e-10)
+
+            factor = chains.covariance_factor_models(ichain)
+            num.testing.assert_allclose(
+                num.dot(factor, factor.T), cov, rtol=1e-8, atol=1e-10)
+
+
+def test_directed_sampler_batch():
+    problem = make_problem()
+    xbounds = problem.get_parameter_bounds()
+
+    for distribution in ['normal', 'multivariate_normal']:
+        for starting_point in ['excentricity_compensated', 'random', 'mean']:
+            optimiser = HighScoreOptimiser(nbootstrap=10, sampler_seed=1)
+            history, chains = fill_history(problem, optimiser, 100)
+
+            phase = DirectedSamplerPhase(
+                niterations=1000,
+                scatter_scale_begin=2.0,
+                scatter_scale_end=0.5,
+                starting_point=starting_point,
+                sampler_distribution=distribution)
+
+            xs = phase.get_samples(
+                problem, num.arange(500), chains,
+                rstate=optimiser.sampler_rstate)
+
+            assert xs.shape == (500, problem.nparameters)
+            assert num.all(xbounds[:, 0] <= xs)
+            assert num.all(xs <= xbounds[:, 1])
+
+            x = phase.get_sample(
+                problem, 999, chains, rstate=optimiser.sampler_rstate)
+
+            assert x.shape == (problem.nparameters,)
+
+
+def test_sampler_seed():
+    problem = make_problem()
+
+    xss = []
+    for i in range(2):
+        optimiser = HighScoreOptimiser(nbootstrap=10, sampler_seed=42)
+        history, chains = fill_history(problem, optimiser, 50)
+        phase = DirectedSamplerPhase(niterations=100)
+        xss.append(phase.get_samples(
+            problem, num.arange(100), chains,
+            rstate=optimiser.sampler_rstate))
+
+    num.testing.assert_equal(xss[0], xss[1])
+
+
+def evaluate_in_worker(nprocs):
+    from grond.optimisers.base import MisfitEvaluator
+
+    problem = make_problem()
+    xs = num.array([[1., 2., 3.], [-1., 0., 5.], [2., -2., 1.]])
+    with MisfitEvaluator(problem, nprocs=nprocs) as evaluator:
+        return evaluator.misfits_many(xs)
+
+
+def test_evaluator_in_daemonic_worker():
+    from pyrocko import parimap
+
+    # event workers of grond go --parallel cannot start their own pools
+    results = list(parimap.parimap(evaluate_in_worker, [2, 2], nprocs=2))
+    misfits_ref = evaluate_in_worker(1)
+    for misfits in results:
+        num.testing.assert_equal(misfits, misfits_ref)
+
+
+def test_parallel_optimise():
+    import tempfile
+    import shutil
+    from grond.problems.base import load_problem_data
+
+    problem = make_problem()
+
+    for nprocs in [1, 2]:
+        optimiser = HighScoreOptimiser(
+            sampler_phases=[
+                UniformSamplerPhase(niterations=100),
+                DirectedSamplerPhase(niterations=200)],
+            nbootstrap=10,
+            sampler_seed=1,
+            nprocs=nprocs,
+            ncandidates_inflight=4)
+
+        rundir = tempfile.mkdtemp(prefix='grond-test')
+        try:
+            optimiser.optimise(problem, rundir=rundir)
+            xs, misfits, bootstrap_misfits = load_problem_data(
+                rundir, problem, nchains=optimiser.nchains)
+
+        finally:
+            shutil.rmtree(rundir)
+
+        assert xs.shape == (300, problem.nparameters)
+        assert bootstrap_misfits.shape == (300, optimiser.nchains)
+        num.testing.assert_allclose(
+            problem.combine_misfits(misfits), bootstrap_misfits[:, 0],
+            rtol=1e-12)
+
+
+class Interrupt(Exception):
+    pass
+
+
+def test_resume():
+    for ncandidates_inflight in [None, 4]:
+        check_resume(ncandidates_inflight)
+
+        # convergence window spanning the interruption
+        check_resume(
+            ncandidates_inflight,
+            dict(window=40, misfit_improvement_limit=0.01))
+
+
+def check_resume(ncandidates_inflight, convergence=None):
+    import os
+    import tempfile
+    import shutil
+    from grond.problems.base import load_problem_data
+
+    problem = make_problem()
+
+    def make_optimiser():
+        optimiser = HighScoreOptimiser(
+            sampler_phases=[
+                UniformSamplerPhase(niterations=50),
+                DirectedSamplerPhase(
+                    niterations=150,
+                    convergence=convergence and SamplerPhaseConvergence(
+                        **convergence))],
+            nbootstrap=10,
+            sampler_seed=1,
+            ncandidates_inflight=ncandidates_inflight)
+
+        optimiser.checkpoint_interval = 0.
+        return optimiser
+
+    rundir = tempfile.mkdtemp(prefix='grond-test')
+    try:
+        optimiser = make_optimiser()
+        optimiser.optimise(problem, rundir=rundir)
+        phase_stops_ref = optimiser._phase_stops
+        xs_ref, misfits_ref, _ = load_problem_data(rundir, problem)
+        shutil.rmtree(rundir)
+        os.mkdir(rundir)
+
+        misfits_orig = problem.misfits
+        ncalls = [0]
+
+        def misfits_interrupted(x, mask=None):
+            ncalls[0] += 1
+            if ncalls[0] > 120:
+                raise Interrupt()
+
+            return misfits_orig(x, mask=mask)
+
+        problem.misfits = misfits_interrupted
+        try:
+            make_optimiser().optimise(problem, rundir=rundir)
+        except Interrupt:
+            pass
+
+        problem.misfits = misfits_orig
+
+        # simulate incomplete record written at the time of interruption
+        with open(rundir + '/bootstraps', 'ab') as f:
+            f.write(b'\0' * 13)
+
+        optimiser = make_optimiser()
+        optimiser.optimise(problem, rundir=rundir, resume=True)
+        xs, misfits, bootstrap_misfits = load_problem_data(
+            rundir, problem, nchains=11)
+
+    finally:
+        shutil.rmtree(rundir)
+
+    def stops(phase_stops):
+        return [(stop.iphase, stop.niterations) for stop in phase_stops]
+
+    assert stops(optimiser._phase_stops) == stops(phase_stops_ref)
+
+    num.testing.assert_equal(xs, xs_ref)
+    num.testing.assert_equal(misfits, misfits_ref)
+    assert bootstrap_misfits.shape == (xs_ref.shape[0], 11)
+
+
+def test_phase_convergence():
+    problem = make_problem()
+
+    optimiser = HighScoreOptimiser(
+        sampler_phases=[
+            UniformSamplerPhase(niterations=100),
+            DirectedSamplerPhase(
+                niterations=100000,
+                convergence=SamplerPhaseConvergence(
+                    window=200,
+                    acceptance_rate_limit=0.05,
+                    misfit_improvement_limit=0.01))],
+        nbootstrap=10,
+        sampler_seed=1)
+
+    optimiser.optimise(problem)
+
+    assert len(optimiser._phase_stops) == 1
+    stop = optimiser._phase_stops[0]
+    assert stop.iphase == 1
+    assert 200 <= stop.niterations < 100000
+    assert optimiser.niterations == 100 + stop.niterations
+
+
+class DummyChains(object):
+
+    def __init__(self, nchains, nparameters):
+        self.accept_sum = num.zeros(nchains, dtype=int)
+        self.chains_m = num.zeros((nchains, 1))
+        self._mean_model = num.zeros(nparameters)
+
+    def mean_model(self):
+        return self._mean_model
+
+
+def test_phase_convergence_zero_misfit():
+    convergence = SamplerPhaseConvergence(
+        window=100, misfit_improvement_limit=0.01)
+
+    chains = DummyChains(nchains=4, nparameters=3)
+    stops = []
+    with num.errstate(divide='raise', invalid='raise'):
+        for iiter_phase in range(0, 200, convergence.nstep):
+            stop = convergence.check(chains, iiter_phase)
+            if stop is not None:
+                stops.append(stop)
+
+    assert stops
+    assert 'misfit improvement 0 ' in stops[0]
+
+
+def test_phase_stop_bounds():
+    optimiser = HighScoreOptimiser(
+        sampler_phases=[
+            UniformSamplerPhase(niterations=100),
+            DirectedSamplerPhase(niterations=100)],
+        nbootstrap=10)
+
+    # candidates in flight reach into the next phase
+    optimiser.stop_sampler_phase(90, 150, 'converged')
+    optimiser.stop_sampler_phase(95, 150, 'converged')
+
+    assert len(optimiser._phase_stops) == 1
+    stop = optimiser._phase_stops[0]
+    assert (stop.iphase, stop.niterations) == (0, 100)
+    assert optimiser.is_sampler_phase_stopped(optimiser.sampler_phases[0])
+    assert optimiser.niterations == 200
+
+
+def test_surrogate_screening():
+    problem = make_problem()
+
+    optimiser = HighScoreOptimiser(
+        sampler_phases=[
+            UniformSamplerPhase(niterations=300),
+            DirectedSamplerPhase(niterations=700)],
+        nbootstrap=10,
+        sampler_seed=1,
+        surrogate=SurrogateScreening(
+            nmodels_min=300, refit_interval=200, nvalidation=100))
+
+    history, chains = fill_history(problem, optimiser, 600)
+    surrogate = optimiser.surrogate
+    surrogate.update(problem, history)
+    assert surrogate._nmodels_fit == 600
+    assert num.all(surrogate._error >= 0.0)
+
+    # models already known to be worse than every chain's worst link are
+    # recognised by the surrogate
+    chains.goto()
+    iworst = num.argsort(history.bootstrap_misfits[:, 0])[-10:]
+    skip = surrogate.screen(problem, history, chains, history.models[iworst])
+    assert num.all(skip)
+
+    optimiser.optimise(problem)
+    assert surrogate._nmodels_fit == 800
@@ -65,10 +65,10 @@ def test_combine_misfits():
 
         gm_2 = p.combine_misfits(misfits, extra_weights=bweights)
 
-        assert gm_2[0] == gm
-        assert gm_2[1] == gm
-        assert gms_2[ix, 0] == gm
-        assert gms_2[ix, 1] == gm
+        assert_ae(gm_2[0], gm)
+        assert_ae(gm_2[1], gm)
+        assert_ae(gms_2[ix, 0], gm)
+        assert_ae(gms_2[ix, 1], gm)
 
         gm_2_contrib = p.combine_misfits(
             misfits, extra_weights=bweights,
@@ -78,3 +78,84 @@ def test_combine_misfits():
         assert_ae(gm_2_contrib[1, :], gm_contrib)
         assert_ae(gms_2_contrib[ix, 0, :], gm_contrib)
         assert_ae(gms_2_contrib[ix, 1, :], gm_contrib)
+
+
+def test_combine_bootstrap_misfits():
+    source, targets = scenario('wellposed', 'lownoise')
+
+    p = ToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+    rstate = num.random.RandomState(1)
+    xs = num.array([
+        p.random_uniform(p.get_parameter_bounds(), rstate=rstate)
+        for _ in range(20)])
+
+    misfitss = p.misfits_many(xs)
+    misfitss[3, 2, :] = num.nan
+    misfitss[5, 4, 0] = num.nan
+
+    bweights = rstate.uniform(0., 2., size=(10, p.nmisfits))
+    bresiduals = rstate.normal(0., 0.1, size=(10, p.nmisfits))
+
+    for norm_exponent in [1, 2]:
+        p.norm_exponent = norm_exponent
+        exp, root = p.get_norm_functions()
+        for extra_weights, extra_residuals in [
+                (bweights, None), (None, bresiduals),
+                (bweights, bresiduals)]:
+
+            gms = p.combine_misfits(
+                misfitss,
+                extra_weights=extra_weights,
+                extra_residuals=extra_residuals)
+
+            gms_contrib = p.combine_misfits(
+                misfitss,
+                extra_weights=extra_weights,
+                extra_residuals=extra_residuals,
+                get_contributions=True)
+
+            num.testing.assert_allclose(
+                gms, root(num.nansum(gms_contrib, axis=2)), rtol=1e-12)
+
+            for ix in range(xs.shape[0]):
+                num.testing.assert_allclose(
+                    p.combine_misfits(
+                        misfitss[ix],
+                        extra_weights=extra_weights,
+                        extra_residuals=extra_residuals),
+                    gms[ix], rtol=1e-12)
+
+    # residuals large enough to make the weighted sums negative for p=1
+    bresiduals = rstate.normal(0., 1e3, size=(10, p.nmisfits))
+    for norm_exponent in [1, 2]:
+        p.norm_exponent = norm_exponent
+        exp, root = p.get_norm_functions()
+        for extra_weights in [None, bweights]:
+            if extra_weights is not None:
+                w = extra_weights[num.newaxis, :, :] \
+                    * p.get_target_weights()[num.newaxis, num.newaxis, :] \
+                    * p.inter_family_weights2(
+                        misfitss[:, :, 1])[:, num.newaxis, :]
+            else:
+                w = 1.0
+
+            r = bresiduals[num.newaxis, :, :]
+            gms_ref = root(
+                num.nansum(exp(w*(misfitss[:, num.newaxis, :, 0]+r)), axis=2)
+                / num.nansum(exp(w*misfitss[:, num.newaxis, :, 1]), axis=2))
+
+            gms = p.combine_misfits(
+                misfitss,
+                extra_weights=extra_weights,
+                extra_residuals=bresiduals)
+
+            assert num.all(gms_ref > 0.)
+            num.testing.assert_allclose(gms, gms_ref, rtol=1e-9)
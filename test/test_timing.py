@@ -0,0 +1,85 @@
+from __future__ import print_function
+
+import numpy as num
+
+from pyrocko import gf, cake
+from pyrocko.gf.meta import OutOfBounds
+from grond.targets import WaveformMisfitTarget, WaveformMisfitConfig, \
+    PhaseTimingService
+
+
+def make_store(store_dir):
+    config = gf.ConfigTypeA(
+        id='timing_test',
+        ncomponents=10,
+        sample_rate=0.2,
+        receiver_depth=0.,
+        source_depth_min=0.,
+        source_depth_max=30e3,
+        source_depth_delta=5e3,
+        distance_min=0.,
+        distance_max=1000e3,
+        distance_delta=10e3,
+        earthmodel_1d=cake.load_model('ak135-f-continental.m'),
+        modelling_code_id='fomosto_qseis',
+        tabulated_phases=[
+            gf.TPDef(id='P', definition='p,P,p\\,P\\'),
+            gf.TPDef(id='S', definition='s,S,s\\,S\\')])
+
+    gf.Store.create(store_dir, config=config)
+    gf.Store(store_dir).make_travel_time_tables()
+
+
+def test_phase_timing_service(tmpdir):
+    store_dir = str(tmpdir.join('timing_test'))
+    make_store(store_dir)
+    engine = gf.LocalEngine(store_dirs=[store_dir])
+    store = engine.get_store('timing_test')
+
+    rstate = num.random.RandomState(23)
+    targets = [
+        WaveformMisfitTarget(
+            codes=('', 'S%i' % i, '', 'Z'),
+            lat=rstate.uniform(-5., 5.),
+            lon=rstate.uniform(-5., 5.),
+            store_id='timing_test',
+            path='test',
+            misfit_config=WaveformMisfitConfig(fmax=1.))
+        for i in range(20)]
+
+    timing_service = PhaseTimingService(targets)
+    for target in targets:
+        assert target.get_timing_service() is timing_service
+
+    timings = [
+        '{stored:P}-10',
+        'first{stored:P|stored:S}',
+        'last(P|S)+5',
+        '{stored:S}+10%',
+        '{vel_surface:3}',
+        '{stored:P}-2S']
+
+    for _ in range(5):
+        source = gf.DCSource(
+            lat=0., lon=0.,
+            north_shift=rstate.uniform(-1e4, 1e4),
+            east_shift=rstate.uniform(-1e4, 1e4),
+            depth=rstate.uniform(0., 35e3))
+
+        snapped_source = timing_service.get_snapped_source(source)
+        for timing in timings:
+            for target in targets:
+                try:
+                    t_ref = store.t(timing, snapped_source, target)
+                except OutOfBounds:
+                    t_ref = OutOfBounds
+
+                try:
+                    t = timing_service.t(engine, timing, source, target)
+                except OutOfBounds:
+                    t = OutOfBounds
+
+                if t_ref in (None, OutOfBounds):
+                    assert t is t_ref
+                else:
+                    num.testing.assert_allclose(t, t_ref, rtol=1e-12)
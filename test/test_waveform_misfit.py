@@ -0,0 +1,70 @@
+from __future__ import print_function
+
+import numpy as num
+
+from pyrocko import trace
+from grond.targets.waveform import target as wt
+
+
+def test_autoshift_l2_norm():
+    rstate = num.random.RandomState(23)
+    a = rstate.normal(size=500)
+    b = num.roll(a, 7) + 0.1 * rstate.normal(size=500)
+
+    nshift_max = 20
+    ms, ns = wt._l2_norm_shifts(a, b, nshift_max)
+
+    mns = []
+    for ishift in range(-nshift_max, nshift_max+1):
+        a_cut, b_cut = wt._cut_shifted(a, b, ishift)
+        mns.append(trace.Lx_norm(a_cut, b_cut, norm=2))
+
+    ms_ref, ns_ref = num.array(mns).T
+
+    num.testing.assert_allclose(ms, ms_ref, rtol=1e-9)
+    num.testing.assert_allclose(ns, ns_ref, rtol=1e-9)
+    assert num.argmin(ms) - nshift_max == 7
+
+
+def test_cc_max_norm_lags():
+    rstate = num.random.RandomState(23)
+    a = rstate.normal(size=301)
+    b = num.roll(a, -12)
+
+    tr_a = trace.Trace(deltat=0.1, ydata=a)
+    tr_b = trace.Trace(deltat=0.1, ydata=b)
+    ctr = trace.correlate(tr_a, tr_b, mode='same')
+
+    kmin = int(round(ctr.tmin / ctr.deltat))
+    cc = wt._correlate_lags(a, b, kmin, kmin + ctr.ydata.size - 1)
+    num.testing.assert_allclose(cc, ctr.ydata, atol=1e-9)
+
+    cc = wt._correlate_lags(a, b, -20, 20)
+    assert num.argmax(cc) - 20 == -12
+
+
+def test_transfer_many():
+    rstate = num.random.RandomState(23)
+    freqlimits = (0.01, 0.02, 0.1, 0.2)
+    trs = [
+        trace.Trace(
+            station='S%i' % i, deltat=0.5, tmin=rstate.uniform(0., 10.),
+            ydata=rstate.normal(size=rstate.randint(400, 600)))
+        for i in range(10)]
+
+    trs_filtered = wt.transfer_many(
+        trs, [20.] * len(trs), [freqlimits] * len(trs))
+
+    for tr, tr_filtered in zip(trs, trs_filtered):
+        tr_ref = tr.transfer(tfade=20., freqlimits=freqlimits)
+        assert abs(tr_filtered.tmin - tr_ref.tmin) < 1e-6
+        num.testing.assert_allclose(
+            tr_filtered.ydata, tr_ref.ydata, rtol=1e-9, atol=1e-12)
+
+
+def test_post_process_result_attributes():
+    # the seismosizer engine annotates results, e.g. with n_records_stacked
+    result = wt.WaveformPostProcess(*([None] * 10))
+    result.n_records_stacked = 1
+    result.t_stack = 0.0
+    assert result.n_records_stacked == 1